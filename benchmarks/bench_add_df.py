@@ -0,0 +1,64 @@
+"""Benchmark the ORM and bulk insert paths of database.add_data._add_df
+
+Run from the repo root:
+    python -m benchmarks.bench_add_df --tickers 50 --days 2000
+"""
+import argparse
+import datetime as dt
+import os
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker, scoped_session
+
+from stock_trading_ml_modelling.database.add_data import _add_df
+from stock_trading_ml_modelling.database.models.prices import create_db, DailyPrice
+
+
+def make_prices(n_tickers, n_days, seed=0):
+    """Create a dataframe of random daily prices in the daily_price layout"""
+    rng = np.random.default_rng(seed)
+    dates = pd.bdate_range(dt.date(1990, 1, 1), periods=n_days)
+    df = pd.DataFrame({
+        "ticker_id": np.repeat(np.arange(1, n_tickers + 1), n_days),
+        "date": np.tile(dates, n_tickers),
+    })
+    df["open"] = rng.uniform(1, 100, df.shape[0])
+    df["close"] = df.open + rng.normal(0, 1, df.shape[0])
+    df["high"] = df[["open", "close"]].max(axis=1) + 0.5
+    df["low"] = df[["open", "close"]].min(axis=1) - 0.5
+    df["change"] = df.close - df.open
+    df["volume"] = rng.integers(1000, 100000, df.shape[0]).astype(float)
+    df["week_start_date"] = df.date - pd.to_timedelta(df.date.dt.weekday, unit="D")
+    return df
+
+
+def time_insert(df, bulk, chunk_size):
+    """Insert df into a fresh database and return the elapsed seconds"""
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_engine(f"sqlite:///{os.path.join(tmp, 'bench.db')}")
+        create_db(engine)
+        session = scoped_session(sessionmaker(bind=engine, expire_on_commit=False))
+        st = time.perf_counter()
+        _add_df(df, DailyPrice, session=session, bulk=bulk, chunk_size=chunk_size)
+        elapsed = time.perf_counter() - st
+        session.remove()
+        engine.dispose()
+    return elapsed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--tickers", type=int, default=20)
+    parser.add_argument("--days", type=int, default=2500)
+    parser.add_argument("--chunk-size", type=int, default=10000)
+    args = parser.parse_args()
+
+    prices = make_prices(args.tickers, args.days)
+    print(f"rows -> {prices.shape[0]:,}")
+    for label, bulk in [("orm", False), ("bulk", True)]:
+        elapsed = time_insert(prices, bulk, args.chunk_size)
+        print(f"{label:>5} -> {elapsed:8.2f}s, {prices.shape[0] / elapsed:12,.0f} rows/sec")
@@ -41,8 +41,8 @@ import sys
 
 from stock_trading_ml_modelling.config import HIST_PRICES_D, HIST_PRICES_W, \
     WEB_SCRAPE_MODE, TICK_FTSE
-from stock_trading_ml_modelling.libs.scrapping import get_day_prices, \
-    process_weekly_prices
+from stock_trading_ml_modelling.libs.scrapping import get_day_prices
+from stock_trading_ml_modelling.libs.manage_data import daily_to_weekly_price_conversion
 from stock_trading_ml_modelling.utils.file import replace_file
 from stock_trading_ml_modelling.utils.timing import ProcessTime
 from stock_trading_ml_modelling.utils.ft_eng import get_col_len_df
@@ -279,7 +279,7 @@ for tick in tick_ftse['ticker']:
 
         # WEEKLY PRICES
         # Convert to weekly prices
-        resp = process_weekly_prices(tick_df)
+        resp = daily_to_weekly_price_conversion(tick_df)
         if resp[0]:
             df_w = resp[1]
         else:
@@ -28,6 +28,24 @@ for k, v in os.environ.items():
 # Scraping
 WEB_SCRAPE_MODE = CONFIG.get("web_scrape", {}).get("mode", "update")
 WEB_SCRAPE_MAX_DAYS = CONFIG.get("web_scrape", {}).get("max_days", 140)
+WEB_SCRAPE_BATCH = CONFIG.get("web_scrape", {}).get("batch", True)
+WEB_SCRAPE_CONCURRENCY = CONFIG.get("web_scrape", {}).get("concurrency", 16)
+WEB_SCRAPE_PER_HOST = CONFIG.get("web_scrape", {}).get("per_host", 8)
+WEB_SCRAPE_POOL_SIZE = CONFIG.get("web_scrape", {}).get("pool_size", 32)
+WEB_SCRAPE_TIMEOUT = CONFIG.get("web_scrape", {}).get("timeout", 30)
+WEB_SCRAPE_CONNECT_TIMEOUT = CONFIG.get("web_scrape", {}).get("connect_timeout", 10)
+WEB_SCRAPE_KEEPALIVE = CONFIG.get("web_scrape", {}).get("keepalive_timeout", 30)
+WEB_SCRAPE_DNS_TTL = CONFIG.get("web_scrape", {}).get("dns_cache_ttl", 300)
+WEB_SCRAPE_ATTEMPTS = CONFIG.get("web_scrape", {}).get("attempts", 5)
+WEB_SCRAPE_BACKOFF_BASE = CONFIG.get("web_scrape", {}).get("backoff_base", 0.5)
+WEB_SCRAPE_BACKOFF_MAX = CONFIG.get("web_scrape", {}).get("backoff_max", 60)
+WEB_SCRAPE_PARSE_POOL = CONFIG.get("web_scrape", {}).get("parse_pool", "process")
+WEB_SCRAPE_PARSE_WORKERS = CONFIG.get("web_scrape", {}).get("parse_workers", 4)
+WEB_SCRAPE_RATE_LIMIT = CONFIG.get("web_scrape", {}).get("rate_limit", {})
+WEB_SCRAPE_CACHE_ENABLED = CONFIG.get("web_scrape", {}).get("cache", {}).get("enabled", False)
+WEB_SCRAPE_CACHE_MAX_BYTES = int(CONFIG.get("web_scrape", {}).get("cache", {}).get("max_mb", 1024) * 1024 ** 2)
+WEB_SCRAPE_CACHE_RECENT_TTL = CONFIG.get("web_scrape", {}).get("cache", {}).get("recent_ttl", 3600)
+WEB_SCRAPE_CACHE_REPLAY = CONFIG.get("web_scrape", {}).get("cache", {}).get("replay", False)
 WEB_ADDRS = CONFIG.get("web_addrs", {})
 # Files
 STORE_PATH = CONFIG.get("files", {}).get("store_path", "./data")
@@ -46,10 +64,30 @@ FUND_LEDGE = os.path.join(STORE_PATH, CONFIG.get("files", {}).get("nn_tar_numpy"
 WS_UPDATE_PRICES_LOG = os.path.join(STORE_PATH, CONFIG.get("files", {}).get("ws_update_prices_log", "update_db_historic_prices_LOG.logger"))
 WS_UPDATE_TICKERS_LOG = os.path.join(STORE_PATH, CONFIG.get("files", {}).get("ws_update_tickers_log", "update_db_tickers_LOG.logger"))
 WS_UPDATE_SIGNALS_LOG = os.path.join(STORE_PATH, CONFIG.get("files", {}).get("ws_update_signals_log", "update_db_historic_bsh_LOG.logger"))
+WEB_SCRAPE_CACHE_PATH = os.path.join(STORE_PATH, CONFIG.get("web_scrape", {}).get("cache", {}).get("path", "scrape_cache"))
 # Database
 DB_PATH = os.path.join(STORE_PATH, CONFIG.get("files", {}).get("prices_db", "prices.db"))
 DB_UPDATE_PRICES = CONFIG.get("db_update", {}).get("prices", "full")
 DB_UPDATE_SIGNALS = CONFIG.get("db_update", {}).get("signals", "full")
+DB_BULK_INSERT = CONFIG.get("db_write", {}).get("bulk_insert", True)
+DB_CHUNK_SIZE = CONFIG.get("db_write", {}).get("chunk_size", 10000)
+DB_SKIP_UNCHANGED = CONFIG.get("db_write", {}).get("skip_unchanged", True)
+DB_WRITER_MAX_ROWS = CONFIG.get("db_writer", {}).get("max_rows", 50000)
+DB_WRITER_MAX_SECONDS = CONFIG.get("db_writer", {}).get("max_seconds", 5)
+DB_WRITER_MAX_QUEUE = CONFIG.get("db_writer", {}).get("max_queue", 64)
+DB_DATE_STORAGE = CONFIG.get("db_schema", {}).get("date_storage", "iso")
+DB_TUNING_PROFILE = CONFIG.get("db_tuning", {}).get("profile", "default")
+DB_TUNING_PROFILES = CONFIG.get("db_tuning", {}).get("profiles", {})
+PRICE_STORE_BACKEND = CONFIG.get("price_store", {}).get("backend", "sqlite")
+PRICE_STORE_PATH = os.path.join(STORE_PATH, CONFIG.get("price_store", {}).get("path", "parquet"))
+PRICE_ARRAYS_PATH = os.path.join(STORE_PATH, CONFIG.get("price_arrays", {}).get("path", "arrays"))
+PRICE_ARRAYS_DTYPE = CONFIG.get("price_arrays", {}).get("dtype", "float32")
+PRICE_ARRAYS_REFRESH = CONFIG.get("price_arrays", {}).get("refresh_after_scrape", False)
+# price cache, read by fetch_df so only used while the price panel is disabled
+PRICE_CACHE_ENABLED = CONFIG.get("price_cache", {}).get("enabled", True)
+PRICE_CACHE_MAX_BYTES = int(CONFIG.get("price_cache", {}).get("max_mb", 512) * 1024 ** 2)
+PRICE_PANEL_ENABLED = CONFIG.get("price_panel", {}).get("enabled", False)
+PRICE_PANEL_DTYPE = CONFIG.get("price_panel", {}).get("dtype", "float64")
 # nn ft eng
 NN_FT_PERIODS = CONFIG.get("nn_ft_eng", {}).get("ft_periods", 6)
 NN_TARGET_PERIODS = CONFIG.get("nn_ft_eng", {}).get("target_periods", 6)
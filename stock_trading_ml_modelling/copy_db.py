@@ -1,43 +1,200 @@
-import pandas as pd
-from pathlib import Path
+"""Copy or compact the prices database
+
+Two methods are available:
+    backup - page level copy with the SQLite online backup API, the source
+        can stay in use while it runs. The copy has the same schema as the
+        source unless upgrade is set.
+    attach - ATTACH the source to a freshly created database and copy each
+        table with INSERT INTO ... SELECT in id ranges, keeping the ids. The
+        copy is compacted, built with the current schema and has duplicate
+        prices dropped.
+
+Run from the repo root:
+    python -m stock_trading_ml_modelling.copy_db --method attach
+"""
+import os
+import argparse
+import sqlite3
+from sqlalchemy import create_engine, event, inspect
 from sqlalchemy.orm import sessionmaker, scoped_session
 from tqdm import tqdm
 
-from stock_trading_ml_modelling.config import STORE_PATH
-from sqlalchemy import create_engine
-from stock_trading_ml_modelling.database.get_data import sqlaq_to_df
-from stock_trading_ml_modelling.database import ticker, ticker_market, daily_price, weekly_price
-from stock_trading_ml_modelling.database.add_data import _add_df
-from stock_trading_ml_modelling.database.models import engine, Session as session
-from stock_trading_ml_modelling.database.models.prices import create_db, Ticker, TickerMarket, DailyPrice, WeeklyPrice
-
-eng_old = create_engine(
-    f'sqlite:///{str(STORE_PATH / "prices_old.db")}'
-)
-old_session = scoped_session(sessionmaker(bind=eng_old, expire_on_commit=False))
-
-#Create the new db
-create_db(engine)
-
-#ticker
-ticker_df = sqlaq_to_df(ticker.fetch(), session=old_session)
-#add to the new database
-_add_df(ticker_df, Ticker)
-
-#ticker_market
-ticker_market_df = sqlaq_to_df(ticker_market.fetch(), session=old_session)
-#add to the new database
-_add_df(ticker_market_df, TickerMarket)
-
-#daily_price
-for id in tqdm(ticker_df.id, total=ticker_df.shape[0]):
-    daily_price_df = sqlaq_to_df(daily_price.fetch(ticker_ids=[id]), session=old_session)
-    #add to the new database
-    _add_df(daily_price_df, DailyPrice)
-
-#weekly_price
-for id in tqdm(ticker_df.id, total=ticker_df.shape[0]):
-    weekly_price_df = sqlaq_to_df(weekly_price.fetch(ticker_ids=[id]), session=old_session)
-    #add to the new database
-    _add_df(weekly_price_df, WeeklyPrice)
+from stock_trading_ml_modelling.config import STORE_PATH, DB_PATH, DB_DATE_STORAGE
+from stock_trading_ml_modelling.utils.log import logger
+from stock_trading_ml_modelling.utils.timing import ProcessTime
+from stock_trading_ml_modelling.database.models import Base, apply_pragmas
+from stock_trading_ml_modelling.database.models.prices import create_db, create_indexes, convert_date_storage, \
+    migrate_price_changes, DailyPrice, WeeklyPrice
+from stock_trading_ml_modelling.database.latest_data import _rebuild_latest
+from stock_trading_ml_modelling.database.remove_data import _remove_duplicates, _duplicates_sql
+
+OLD_DB_PATH = os.path.join(STORE_PATH, "prices_old.db")
+PRICE_TABLES = [DailyPrice.__table__.name, WeeklyPrice.__table__.name]
+
+def _bulk_engine(db_path):
+    """Create an engine on db_path using the bulk_load pragmas"""
+    engine = create_engine(f'sqlite:///{str(db_path)}')
+    event.listen(engine, "connect", lambda dbapi_conn, _: apply_pragmas(dbapi_conn, "bulk_load"))
+    return engine
+
+def upgrade_db(engine):
+    """Function to bring a copied database up to the current schema. Missing
+    tables are created, price_changes moved to AUTOINCREMENT ids, dates 
+    converted to DB_DATE_STORAGE, duplicate prices
+    removed so the unique indexes can be built, then the indexes are created
+    and ticker_latest rebuilt.
+
+    args:
+    ----
+    engine - sqla engine - the database to upgrade
+    """
+    session = scoped_session(sessionmaker(bind=engine))
+    try:
+        create_db(engine)
+        migrate_price_changes(engine)
+        convert_date_storage(engine, DB_DATE_STORAGE)
+        for DestClass in [DailyPrice, WeeklyPrice]:
+            counts = _remove_duplicates(DestClass, session=session)
+            logger.info(f"Deleted {counts['deleted']} duplicate records from {DestClass.__table__.name}")
+        create_indexes(engine)
+        logger.info(f"Rebuilt ticker_latest for {_rebuild_latest(session=session)} tickers")
+    finally:
+        session.remove()
+
+def backup_db(src_path=OLD_DB_PATH, dest_path=DB_PATH, upgrade=False, pages=4096):
+    """Function to copy a database with the SQLite online backup API.
+
+    args:
+    ----
+    src_path - str:OLD_DB_PATH - the database to copy
+    dest_path - str:DB_PATH - the database to create, overwritten if it exists
+    upgrade - bool:False - bring the copy up to the current schema
+    pages - int:4096 - the number of pages copied per step
+
+    returns:
+    ----
+    None
+    """
+    run_time = ProcessTime()
+    src = sqlite3.connect(src_path)
+    dest = sqlite3.connect(dest_path)
+    try:
+        with tqdm(desc="Backup pages", unit="page") as pbar:
+            def _progress(status, remaining, total):
+                pbar.total = total
+                pbar.update(total - remaining - pbar.n)
+            src.backup(dest, pages=pages, progress=_progress)
+    finally:
+        dest.close()
+        src.close()
+    logger.info(f"BACKUP RUN TIME - {run_time.end()}")
+    if upgrade:
+        engine = _bulk_engine(dest_path)
+        upgrade_db(engine)
+        engine.dispose()
+
+def _copy_table(conn, table, cols, chunk_rows):
+    """Copy a table from the attached old database in id ranges. The ids are
+    copied so rows keep their rowid order, any ORDER BY would not change it"""
+    tab_name = table.name
+    col_str = ", ".join(cols)
+    where = ""
+    if tab_name in PRICE_TABLES:
+        #Drop duplicates on the way across so the unique index holds, the
+        #ids are found once rather than per chunk
+        conn.exec_driver_sql(f"DROP TABLE IF EXISTS temp.dup_{tab_name}")
+        conn.exec_driver_sql(f"CREATE TEMP TABLE dup_{tab_name} AS SELECT id FROM ({_duplicates_sql(f'old.{tab_name}')})")
+        where = f" AND id NOT IN (SELECT id FROM temp.dup_{tab_name})"
+    min_id, max_id = conn.exec_driver_sql(f"SELECT MIN(id), MAX(id) FROM old.{tab_name}").one()
+    if min_id is None:
+        return 0
+    count = 0
+    with tqdm(total=max_id - min_id + 1, desc=f"Copy {tab_name}", unit="id") as pbar:
+        for st in range(min_id, max_id + 1, chunk_rows):
+            en = st + chunk_rows - 1
+            result = conn.exec_driver_sql(
+                f"INSERT INTO main.{tab_name} ({col_str}) SELECT {col_str} FROM old.{tab_name} "
+                f"WHERE id BETWEEN ? AND ?{where}",
+                (st, en)
+                )
+            count += result.rowcount
+            pbar.update(min(en, max_id) - st + 1)
+    return count
+
+def attach_copy_db(src_path=OLD_DB_PATH, dest_path=DB_PATH, chunk_rows=1000000):
+    """Function to copy a database table by table into a new database built
+    with the current schema, using ATTACH and INSERT INTO ... SELECT.
+
+    args:
+    ----
+    src_path - str:OLD_DB_PATH - the database to copy
+    dest_path - str:DB_PATH - the database to create, must not exist
+    chunk_rows - int:1000000 - the id range copied per statement, sets the
+        progress granularity
+
+    returns:
+    ----
+    dict - table name to rows copied
+    """
+    if os.path.exists(dest_path):
+        raise FileExistsError(f"{dest_path} already exists")
+    run_time = ProcessTime()
+    engine = _bulk_engine(dest_path)
+    create_db(engine)
+    counts = {}
+    #The attachment belongs to the connection so the copy stays on one
+    with engine.connect() as conn:
+        conn.exec_driver_sql("ATTACH DATABASE ? AS old", (str(src_path),))
+        old_tables = inspect(conn).get_table_names(schema="old")
+        for table in Base.metadata.sorted_tables:
+            if table.name not in old_tables:
+                continue
+            #Only copy the columns both schemas have
+            old_cols = {c["name"] for c in inspect(conn).get_columns(table.name, schema="old")}
+            cols = [c.name for c in table.columns if c.name in old_cols]
+            counts[table.name] = _copy_table(conn, table, cols, chunk_rows)
+            logger.info(f"Copied {counts[table.name]} records into {table.name}")
+        #Tables are copied in one transaction, DETACH must run outside it
+        conn.commit()
+        conn.exec_driver_sql("DETACH DATABASE old")
+        conn.commit()
+    #Keep new change ids above the copied consumer watermarks
+    migrate_price_changes(engine)
+    #Dates are copied as stored in the old database
+    convert_date_storage(engine, DB_DATE_STORAGE)
+    #Summary tables are rebuilt from the copied prices
+    session = scoped_session(sessionmaker(bind=engine))
+    try:
+        _rebuild_latest(session=session)
+    finally:
+        session.remove()
+    engine.dispose()
+    logger.info(f"ATTACH COPY RUN TIME - {run_time.end()}")
+    return counts
+
+def copy_db(src_path=OLD_DB_PATH, dest_path=DB_PATH, method="backup", upgrade=False):
+    """Function to copy the prices database.
+
+    args:
+    ----
+    src_path - str:OLD_DB_PATH - the database to copy
+    dest_path - str:DB_PATH - the database to create
+    method - str:"backup" - "backup" for a page copy, "attach" for a compacting
+        table copy with the current schema
+    upgrade - bool:False - bring a backup copy up to the current schema
+    """
+    logger.info(f"Copying {src_path} to {dest_path} by {method}")
+    if method == "backup":
+        return backup_db(src_path, dest_path, upgrade=upgrade)
+    if method == "attach":
+        return attach_copy_db(src_path, dest_path)
+    raise ValueError(f'method must be "backup" or "attach", "{method}" given')
 
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--src", default=OLD_DB_PATH)
+    parser.add_argument("--dest", default=DB_PATH)
+    parser.add_argument("--method", choices=["backup","attach"], default="backup")
+    parser.add_argument("--upgrade", action="store_true", help="upgrade the schema of a backup copy")
+    args = parser.parse_args()
+    copy_db(args.src, args.dest, method=args.method, upgrade=args.upgrade)
@@ -1,24 +1,43 @@
 """Create sub-classes for querying the database"""
-from sqlalchemy import func, and_
+from sqlalchemy import func, and_, or_, case
+from sqlalchemy.orm import aliased
+from contextlib import contextmanager
 import logging
 
+from stock_trading_ml_modelling.config import DB_BULK_INSERT, DB_CHUNK_SIZE, PRICE_STORE_BACKEND
 from stock_trading_ml_modelling.database.models import Session as session
-from stock_trading_ml_modelling.database.models.prices import Ticker, TickerMarket, DailyPrice, WeeklyPrice
+from stock_trading_ml_modelling.database.models.prices import Ticker, TickerMarket, DailyPrice, WeeklyPrice, TickerLatest
 from stock_trading_ml_modelling.database.add_data import _add_df
 from stock_trading_ml_modelling.database.update_data import _update_df
+from stock_trading_ml_modelling.database.upsert_data import _upsert_df
+from stock_trading_ml_modelling.database.latest_data import _refresh_latest, _rebuild_latest
+from stock_trading_ml_modelling.database.remove_data import _remove_duplicates
+from stock_trading_ml_modelling.database.changes_data import _log_changes_df, _log_changes_where, \
+    _log_changes_updated, _pending_changes, _ack_changes, _prune_changes
+from stock_trading_ml_modelling.database.get_data import sqlaq_to_df, _fetch_price_arrays, PRICE_FIELDS
+from stock_trading_ml_modelling.database.cache import price_cache, make_key
+
+
+def _price_store(table):
+    """Function to open the parquet store for a price table. pyarrow is only 
+    imported when the parquet backend is in use."""
+    from stock_trading_ml_modelling.database.parquet_store import ParquetPriceStore
+    return ParquetPriceStore(table)
 
 
 class TickerCl:
     def __init__(self):
         pass
 
-    def add_df(self, df, session=session):
+    def add_df(self, df, session=session, bulk=DB_BULK_INSERT, chunk_size=DB_CHUNK_SIZE):
         """Function to add data to the database.
         
         args:
         ----
         df - pandas dataframe - the data to be added to the database
         session - sqla session:None - the db session object
+        bulk - bool:DB_BULK_INSERT - use the chunked executemany insert
+        chunk_size - int:DB_CHUNK_SIZE - rows per executemany when bulk is True
 
         returns:
         ----
@@ -30,7 +49,7 @@ class TickerCl:
                 keep_cols.append('last_seen_date')
             df = df[keep_cols] \
                 .drop_duplicates()
-            _add_df(df, Ticker, session=session)
+            _add_df(df, Ticker, session=session, bulk=bulk, chunk_size=chunk_size)
 
     def fetch(self,
         ticker_ids=[],
@@ -67,13 +86,15 @@ class TickerMarketCl:
     def __init__(self):
         pass
 
-    def add_df(self, df, session=session):
+    def add_df(self, df, session=session, bulk=DB_BULK_INSERT, chunk_size=DB_CHUNK_SIZE):
         """Function to add data to the database.
         
         args:
         ----
         df - pandas dataframe - the data to be added to the database
         session - sqla session:None - the db session object
+        bulk - bool:DB_BULK_INSERT - use the chunked executemany insert
+        chunk_size - int:DB_CHUNK_SIZE - rows per executemany when bulk is True
 
         returns:
         ----
@@ -85,7 +106,7 @@ class TickerMarketCl:
                 keep_cols.append('first_seen_date')
             df = df[keep_cols] \
                 .drop_duplicates()
-            _add_df(df, TickerMarket, session=session)
+            _add_df(df, TickerMarket, session=session, bulk=bulk, chunk_size=chunk_size)
 
     def fetch(self,
         ticker_ids=[],
@@ -117,16 +138,25 @@ class TickerMarketCl:
         return _update_df(df, TickerMarket, session=session)
 
 class DailyPriceCl:
-    def __init__(self):
-        pass
+    def __init__(self, backend=PRICE_STORE_BACKEND):
+        """
+        args:
+        ----
+        backend - str:PRICE_STORE_BACKEND - where fetch_df reads from, 
+            "sqlite" or "parquet"
+        """
+        self.backend = backend
+        self.store = _price_store("daily_price") if backend == "parquet" else None
 
-    def add_df(self, df, session=session):
+    def add_df(self, df, session=session, bulk=DB_BULK_INSERT, chunk_size=DB_CHUNK_SIZE):
         """Function to add data to the database.
         
         args:
         ----
         df - pandas dataframe - the data to be added to the database
         session - sqla session:None - the db session object
+        bulk - bool:DB_BULK_INSERT - use the chunked executemany insert
+        chunk_size - int:DB_CHUNK_SIZE - rows per executemany when bulk is True
 
         returns:
         ----
@@ -135,12 +165,19 @@ class DailyPriceCl:
         if df.shape[0]:
             df = df[['date','open','high','low','close','change','volume','week_start_date','ticker_id']] \
                 .drop_duplicates()
-            _add_df(df, DailyPrice, session=session)
+            _add_df(df, DailyPrice, session=session, bulk=bulk, chunk_size=chunk_size, commit=False)
+            _log_changes_df(DailyPrice, df, session=session)
+            _refresh_latest(DailyPrice, df.ticker_id.dropna().unique(), session=session)
+            session.commit()
+            price_cache.invalidate("daily_price", df.ticker_id.dropna().unique())
 
     def fetch(self,
         ticker_ids=[],
         from_date=None,
-        to_date=None
+        to_date=None,
+        ordered=False,
+        last_n=None,
+        from_dates=None
         ):
         """Function to create a query to grab all sub-jobs from the offers db.
         Open sub-jobs are set to status_id 1.
@@ -148,6 +185,13 @@ class DailyPriceCl:
         args:
         ----
         ticker_ids - list:[] - the ids of the records to be extracted
+        from_date - dtatime:None - the min date for filtering records
+        to_date - dtatime:None - the max date for filtering records
+        ordered - bool:False - order the records by ticker_id then date
+        last_n - int:None - only the latest last_n records of each ticker
+        from_dates - dict:None - ticker_id to the min date of that ticker, 
+            only these tickers are extracted. Tickers sharing a date are 
+            filtered together.
 
         returns:
         ----
@@ -156,12 +200,104 @@ class DailyPriceCl:
         query = session.query(DailyPrice)
         if len(ticker_ids):
             query = query.filter(DailyPrice.ticker_id.in_(ticker_ids))
+        if from_dates:
+            by_date = {}
+            for k,v in from_dates.items():
+                by_date.setdefault(v, []).append(int(k))
+            query = query.filter(or_(*[
+                and_(DailyPrice.ticker_id.in_(ids), DailyPrice.date >= d) for d,ids in by_date.items()
+                ]))
         if from_date:
             query = query.filter(DailyPrice.date >= from_date)
         if to_date:
             query = query.filter(DailyPrice.date <= to_date)
+        if last_n:
+            #Number each ticker's rows from the latest and keep the first last_n
+            rn = func.row_number().over(
+                    partition_by=DailyPrice.ticker_id,
+                    order_by=DailyPrice.date.desc()
+                ).label("rn")
+            subq = query.add_columns(rn).subquery("t1")
+            price = aliased(DailyPrice, subq)
+            query = session.query(price).filter(subq.c.rn <= last_n)
+            if ordered:
+                query = query.order_by(price.ticker_id, price.date)
+            return query
+        if ordered:
+            query = query.order_by(DailyPrice.ticker_id, DailyPrice.date)
         return query
 
+    def fetch_df(self,
+        ticker_ids=[],
+        from_date=None,
+        to_date=None,
+        ordered=False,
+        last_n=None,
+        cache=True
+        ):
+        """Function to fetch prices as a dataframe from the configured backend.
+        Results are held in price_cache until a write to the table makes them 
+        stale. PriceData.get_prices reads through here while the price panel
+        is disabled.
+        
+        args:
+        ----
+        ticker_ids - list:[] - the ids of the records to be extracted
+        from_date - dtatime:None - the min date for filtering records
+        to_date - dtatime:None - the max date for filtering records
+        ordered - bool:False - order the records by ticker_id then date
+        last_n - int:None - only the latest last_n records of each ticker
+        cache - bool:True - read and fill price_cache
+
+        returns:
+        ----
+        pandas dataframe
+        """
+        key = make_key("daily_price", ticker_ids, from_date, to_date, ordered=ordered, last_n=last_n)
+        df = price_cache.get(key) if cache else None
+        if df is not None:
+            return df
+        if self.store is not None:
+            df = self.store.fetch_df(ticker_ids=ticker_ids, from_date=from_date, 
+                to_date=to_date, ordered=True if last_n else ordered)
+            if last_n:
+                df = df.groupby("ticker_id").tail(last_n) \
+                    .reset_index(drop=True)
+        else:
+            df = sqlaq_to_df(self.fetch(ticker_ids=ticker_ids, from_date=from_date, 
+                to_date=to_date, ordered=ordered, last_n=last_n))
+        if cache:
+            price_cache.put(key, df)
+        return df
+
+    def fetch_arrays(self,
+        ticker_ids=[],
+        from_date=None,
+        to_date=None,
+        dtype="float32",
+        fields=PRICE_FIELDS,
+        session=session
+        ):
+        """Function to fetch prices as contiguous numpy arrays ordered by 
+        ticker_id then date.
+        
+        args:
+        ----
+        ticker_ids - list:[] - the ids of the records to be extracted
+        from_date - dtatime:None - the min date for filtering records
+        to_date - dtatime:None - the max date for filtering records
+        dtype - str:"float32" - the dtype of the price fields
+        fields - list:PRICE_FIELDS - the price fields to fetch
+        session - sqla session:None - the db session object
+
+        returns:
+        ----
+        dict of numpy arrays - ticker_id, date, each field plus tickers and 
+            offsets where tickers[i] covers rows offsets[i]:offsets[i+1]
+        """
+        return _fetch_price_arrays(DailyPrice, ticker_ids=ticker_ids, from_date=from_date,
+            to_date=to_date, dtype=dtype, fields=fields, session=session)
+
         
     def fetch_latest(self,
         session,
@@ -169,7 +305,8 @@ class DailyPriceCl:
         from_date=None,
         to_date=None
         ):
-        """Function to get that last entry for each item
+        """Function to get that last entry for each item, read from the 
+        ticker_latest summary unless to_date is given
         
         args:
         ----
@@ -182,6 +319,21 @@ class DailyPriceCl:
         ----
         sqla query
         """
+        if not to_date:
+            #Read the maintained summary, one row per ticker
+            max_date = TickerLatest.last_daily_date
+            if from_date:
+                max_date = case((max_date >= from_date, max_date), else_=None)
+            query = session.query(Ticker, max_date.label("max_date")) \
+                .outerjoin(
+                    TickerLatest,
+                    TickerLatest.ticker_id == Ticker.id
+                )
+            if len(ticker_ids):
+                query = query.filter(Ticker.id.in_(ticker_ids))
+            return query
+        #The summary only holds the overall last date so a to_date needs the
+        #price table itself
         #create the sub-query
         subq = session.query(
                 DailyPrice.ticker_id,
@@ -209,8 +361,57 @@ class DailyPriceCl:
 
     def update_df(self, df, session=session):
         """Function for updating records from a dataframe"""
-        return _update_df(df, DailyPrice, session=session)
+        out = _update_df(df, DailyPrice, session=session, commit=False)
+        _log_changes_updated(DailyPrice, df, session=session)
+        ticker_ids = df.ticker_id.dropna().unique() if "ticker_id" in df.columns else None
+        _refresh_latest(DailyPrice, ticker_ids, session=session)
+        session.commit()
+        price_cache.invalidate("daily_price", ticker_ids)
+        return out
+
+    def upsert_df(self, df, session=session, chunk_size=DB_CHUNK_SIZE):
+        """Function to insert new records and update existing ones, matched on 
+        (ticker_id, date), in one statement batch.
+        
+        args:
+        ----
+        df - pandas dataframe - the data to be upserted
+        session - sqla session:None - the db session object
+        chunk_size - int:DB_CHUNK_SIZE - rows per executemany
+
+        returns:
+        ----
+        int - the number of rows upserted
+        """
+        if not df.shape[0]:
+            return 0
+        df = df[['date','open','high','low','close','change','volume','week_start_date','ticker_id']] \
+            .drop_duplicates(subset=['ticker_id','date'], keep='last')
+        count = _upsert_df(df, DailyPrice, ['ticker_id','date'], session=session, chunk_size=chunk_size, commit=False)
+        _log_changes_df(DailyPrice, df, session=session)
+        _refresh_latest(DailyPrice, df.ticker_id.dropna().unique(), session=session)
+        session.commit()
+        price_cache.invalidate("daily_price", df.ticker_id.dropna().unique())
+        return count
+        
+    def remove_duplicates(self, dry_run=False, session=session):
+        """Function to delete prices duplicated on (ticker_id, date) keeping 
+        the one with the highest volume, in a single statement.
         
+        args:
+        ----
+        dry_run - bool:False - only count the duplicates
+        session - sqla session:None - the db session object
+
+        returns:
+        ----
+        dict - duplicates, tickers and deleted counts
+        """
+        counts = _remove_duplicates(DailyPrice, dry_run=dry_run, session=session)
+        if counts["deleted"]:
+            price_cache.invalidate("daily_price")
+        return counts
+
     def remove(self,
         ids=[],
         ticker_ids=[],
@@ -246,23 +447,38 @@ class DailyPriceCl:
                 query = query.filter(DailyPrice.date >= from_date)
             if to_date:
                 query = query.filter(DailyPrice.date <= to_date)
+            #Find the tickers losing rows, all if no ids were given
+            touched = [r[0] for r in query.with_entities(DailyPrice.ticker_id).distinct()] \
+                if len(ids) or len(ticker_ids) else None
+            _log_changes_where(DailyPrice, query.whereclause, session=session)
             query.delete(synchronize_session=False)
+            _refresh_latest(DailyPrice, touched, session=session)
             session.commit()
+            price_cache.invalidate("daily_price", touched)
             return True
         except:
             return False
 
 class WeeklyPriceCl:
-    def __init__(self):
-        pass
+    def __init__(self, backend=PRICE_STORE_BACKEND):
+        """
+        args:
+        ----
+        backend - str:PRICE_STORE_BACKEND - where fetch_df reads from, 
+            "sqlite" or "parquet"
+        """
+        self.backend = backend
+        self.store = _price_store("weekly_price") if backend == "parquet" else None
 
-    def add_df(self, df, session=session):
+    def add_df(self, df, session=session, bulk=DB_BULK_INSERT, chunk_size=DB_CHUNK_SIZE):
         """Function to add data to the database.
         
         args:
         ----
         df - pandas dataframe - the data to be added to the database
         session - sqla session:None - the db session object
+        bulk - bool:DB_BULK_INSERT - use the chunked executemany insert
+        chunk_size - int:DB_CHUNK_SIZE - rows per executemany when bulk is True
 
         returns:
         ----
@@ -271,12 +487,18 @@ class WeeklyPriceCl:
         if df.shape[0]:
             df = df[['date','open','high','low','close','change','volume','ticker_id']] \
                 .drop_duplicates()
-            _add_df(df, WeeklyPrice, session=session)
+            _add_df(df, WeeklyPrice, session=session, bulk=bulk, chunk_size=chunk_size, commit=False)
+            _log_changes_df(WeeklyPrice, df, session=session)
+            _refresh_latest(WeeklyPrice, df.ticker_id.dropna().unique(), session=session)
+            session.commit()
+            price_cache.invalidate("weekly_price", df.ticker_id.dropna().unique())
 
     def fetch(self,
         ticker_ids=[],
         from_date=None,
-        to_date=None
+        to_date=None,
+        ordered=False,
+        last_n=None
         ):
         """Function to create a query to grab all sub-jobs from the offers db.
         Open sub-jobs are set to status_id 1.
@@ -284,6 +506,10 @@ class WeeklyPriceCl:
         args:
         ----
         ticker_ids - list:[] - the ids of the records to be extracted
+        from_date - dtatime:None - the min date for filtering records
+        to_date - dtatime:None - the max date for filtering records
+        ordered - bool:False - order the records by ticker_id then date
+        last_n - int:None - only the latest last_n records of each ticker
 
         returns:
         ----
@@ -296,15 +522,101 @@ class WeeklyPriceCl:
             query = query.filter(WeeklyPrice.date >= from_date)
         if to_date:
             query = query.filter(WeeklyPrice.date <= to_date)
+        if last_n:
+            #Number each ticker's rows from the latest and keep the first last_n
+            rn = func.row_number().over(
+                    partition_by=WeeklyPrice.ticker_id,
+                    order_by=WeeklyPrice.date.desc()
+                ).label("rn")
+            subq = query.add_columns(rn).subquery("t1")
+            price = aliased(WeeklyPrice, subq)
+            query = session.query(price).filter(subq.c.rn <= last_n)
+            if ordered:
+                query = query.order_by(price.ticker_id, price.date)
+            return query
+        if ordered:
+            query = query.order_by(WeeklyPrice.ticker_id, WeeklyPrice.date)
         return query
 
+    def fetch_df(self,
+        ticker_ids=[],
+        from_date=None,
+        to_date=None,
+        ordered=False,
+        last_n=None,
+        cache=True
+        ):
+        """Function to fetch prices as a dataframe from the configured backend.
+        Results are held in price_cache until a write to the table makes them 
+        stale. PriceData.get_prices reads through here while the price panel
+        is disabled.
+        
+        args:
+        ----
+        ticker_ids - list:[] - the ids of the records to be extracted
+        from_date - dtatime:None - the min date for filtering records
+        to_date - dtatime:None - the max date for filtering records
+        ordered - bool:False - order the records by ticker_id then date
+        last_n - int:None - only the latest last_n records of each ticker
+        cache - bool:True - read and fill price_cache
+
+        returns:
+        ----
+        pandas dataframe
+        """
+        key = make_key("weekly_price", ticker_ids, from_date, to_date, ordered=ordered, last_n=last_n)
+        df = price_cache.get(key) if cache else None
+        if df is not None:
+            return df
+        if self.store is not None:
+            df = self.store.fetch_df(ticker_ids=ticker_ids, from_date=from_date, 
+                to_date=to_date, ordered=True if last_n else ordered)
+            if last_n:
+                df = df.groupby("ticker_id").tail(last_n) \
+                    .reset_index(drop=True)
+        else:
+            df = sqlaq_to_df(self.fetch(ticker_ids=ticker_ids, from_date=from_date, 
+                to_date=to_date, ordered=ordered, last_n=last_n))
+        if cache:
+            price_cache.put(key, df)
+        return df
+
+    def fetch_arrays(self,
+        ticker_ids=[],
+        from_date=None,
+        to_date=None,
+        dtype="float32",
+        fields=PRICE_FIELDS,
+        session=session
+        ):
+        """Function to fetch prices as contiguous numpy arrays ordered by 
+        ticker_id then date.
+        
+        args:
+        ----
+        ticker_ids - list:[] - the ids of the records to be extracted
+        from_date - dtatime:None - the min date for filtering records
+        to_date - dtatime:None - the max date for filtering records
+        dtype - str:"float32" - the dtype of the price fields
+        fields - list:PRICE_FIELDS - the price fields to fetch
+        session - sqla session:None - the db session object
+
+        returns:
+        ----
+        dict of numpy arrays - ticker_id, date, each field plus tickers and 
+            offsets where tickers[i] covers rows offsets[i]:offsets[i+1]
+        """
+        return _fetch_price_arrays(WeeklyPrice, ticker_ids=ticker_ids, from_date=from_date,
+            to_date=to_date, dtype=dtype, fields=fields, session=session)
+
     def fetch_latest(self,
         session,
         ticker_ids=[],
         from_date=None,
         to_date=None
         ):
-        """Function to get that last entry for each item
+        """Function to get that last entry for each item, read from the 
+        ticker_latest summary unless to_date is given
         
         args:
         ----
@@ -317,6 +629,21 @@ class WeeklyPriceCl:
         ----
         sqla query
         """
+        if not to_date:
+            #Read the maintained summary, one row per ticker
+            max_date = TickerLatest.last_weekly_date
+            if from_date:
+                max_date = case((max_date >= from_date, max_date), else_=None)
+            query = session.query(Ticker, max_date.label("max_date")) \
+                .outerjoin(
+                    TickerLatest,
+                    TickerLatest.ticker_id == Ticker.id
+                )
+            if len(ticker_ids):
+                query = query.filter(Ticker.id.in_(ticker_ids))
+            return query
+        #The summary only holds the overall last date so a to_date needs the
+        #price table itself
         #create the sub-query
         subq = session.query(
                 WeeklyPrice.ticker_id,
@@ -344,7 +671,56 @@ class WeeklyPriceCl:
 
     def update_df(self, df, session=session):
         """Function for updating records from a dataframe"""
-        return _update_df(df, WeeklyPrice, session=session)
+        out = _update_df(df, WeeklyPrice, session=session, commit=False)
+        _log_changes_updated(WeeklyPrice, df, session=session)
+        ticker_ids = df.ticker_id.dropna().unique() if "ticker_id" in df.columns else None
+        _refresh_latest(WeeklyPrice, ticker_ids, session=session)
+        session.commit()
+        price_cache.invalidate("weekly_price", ticker_ids)
+        return out
+
+    def upsert_df(self, df, session=session, chunk_size=DB_CHUNK_SIZE):
+        """Function to insert new records and update existing ones, matched on 
+        (ticker_id, date), in one statement batch.
+        
+        args:
+        ----
+        df - pandas dataframe - the data to be upserted
+        session - sqla session:None - the db session object
+        chunk_size - int:DB_CHUNK_SIZE - rows per executemany
+
+        returns:
+        ----
+        int - the number of rows upserted
+        """
+        if not df.shape[0]:
+            return 0
+        df = df[['date','open','high','low','close','change','volume','ticker_id']] \
+            .drop_duplicates(subset=['ticker_id','date'], keep='last')
+        count = _upsert_df(df, WeeklyPrice, ['ticker_id','date'], session=session, chunk_size=chunk_size, commit=False)
+        _log_changes_df(WeeklyPrice, df, session=session)
+        _refresh_latest(WeeklyPrice, df.ticker_id.dropna().unique(), session=session)
+        session.commit()
+        price_cache.invalidate("weekly_price", df.ticker_id.dropna().unique())
+        return count
+
+    def remove_duplicates(self, dry_run=False, session=session):
+        """Function to delete prices duplicated on (ticker_id, date) keeping 
+        the one with the highest volume, in a single statement.
+        
+        args:
+        ----
+        dry_run - bool:False - only count the duplicates
+        session - sqla session:None - the db session object
+
+        returns:
+        ----
+        dict - duplicates, tickers and deleted counts
+        """
+        counts = _remove_duplicates(WeeklyPrice, dry_run=dry_run, session=session)
+        if counts["deleted"]:
+            price_cache.invalidate("weekly_price")
+        return counts
 
     def remove(self,
         ids=[],
@@ -381,13 +757,106 @@ class WeeklyPriceCl:
                 query = query.filter(WeeklyPrice.date >= from_date)
             if to_date:
                 query = query.filter(WeeklyPrice.date <= to_date)
+            #Find the tickers losing rows, all if no ids were given
+            touched = [r[0] for r in query.with_entities(WeeklyPrice.ticker_id).distinct()] \
+                if len(ids) or len(ticker_ids) else None
+            _log_changes_where(WeeklyPrice, query.whereclause, session=session)
             query.delete(synchronize_session=False)
+            _refresh_latest(WeeklyPrice, touched, session=session)
             session.commit()
+            price_cache.invalidate("weekly_price", touched)
             return True
         except:
             return False
 
+class TickerLatestCl:
+    def __init__(self):
+        pass
+
+    def fetch(self,
+        ticker_ids=[]
+        ):
+        """Function to create a query to grab the ticker_latest summary.
+        
+        args:
+        ----
+        ticker_ids - list:[] - the ids of the records to be extracted
+
+        returns:
+        ----
+        sqlalchemy query 
+        """
+        query = session.query(TickerLatest)
+        if len(ticker_ids):
+            query = query.filter(TickerLatest.ticker_id.in_(ticker_ids))
+        return query
+
+    def rebuild(self, session=session):
+        """Function to rebuild the ticker_latest summary from the price tables.
+        
+        returns:
+        ----
+        int - the number of tickers in the summary
+        """
+        return _rebuild_latest(session=session)
+
+class PriceChangesCl:
+    def __init__(self):
+        pass
+
+    def pending(self, consumer, table_name, session=session):
+        """Function to get the changes to a price table a consumer has not yet
+        processed, one date range per ticker.
+        
+        args:
+        ----
+        consumer - str - the name of the downstream step, eg "weekly_price"
+        table_name - str - the price table read, "daily_price" or "weekly_price"
+        session - sqla session:None - the db session object
+
+        returns:
+        ----
+        pandas dataframe - ticker_id, min_date, max_date, change_id
+        """
+        return _pending_changes(consumer, table_name, session=session)
+
+    def acknowledge(self, consumer, table_name, change_id, session=session):
+        """Function to mark the changes up to change_id as processed by a 
+        consumer.
+        
+        returns:
+        ----
+        int - the consumer's watermark
+        """
+        return _ack_changes(consumer, table_name, change_id, session=session)
+
+    @contextmanager
+    def consume(self, consumer, table_name, session=session):
+        """Context manager yielding the pending changes, which are 
+        acknowledged only if the block completes without an exception.
+
+        Example:
+            with price_changes.consume("weekly_price", "daily_price") as changes:
+                process(changes)
+        """
+        changes = self.pending(consumer, table_name, session=session)
+        yield changes
+        if changes.shape[0]:
+            self.acknowledge(consumer, table_name, changes.change_id.max(), session=session)
+
+    def prune(self, session=session):
+        """Function to delete the changes processed by every consumer.
+        
+        returns:
+        ----
+        int - the number of changes deleted
+        """
+        return _prune_changes(session=session)
+
+
 ticker = TickerCl()
 ticker_market = TickerMarketCl()
 daily_price = DailyPriceCl()
-weekly_price = WeeklyPriceCl()
\ No newline at end of file
+weekly_price = WeeklyPriceCl()
+ticker_latest = TickerLatestCl()
+price_changes = PriceChangesCl()
@@ -2,6 +2,7 @@
 import re
 import pandas as pd
 
+from stock_trading_ml_modelling.config import DB_BULK_INSERT, DB_CHUNK_SIZE
 from stock_trading_ml_modelling.utils.data import overlap
 
 from stock_trading_ml_modelling.database.models import Session as session
@@ -13,7 +14,7 @@ def sqlaq_to_df(self, query, session=session, limit=None):
     out_df = out_df.iloc[:limit] if limit < out_df.shape[0] else out_df
     return out_df
 
-def _add_df(df, DestClass, fields=[], session=session):
+def _add_df(df, DestClass, fields=[], session=session, bulk=DB_BULK_INSERT, chunk_size=DB_CHUNK_SIZE, commit=True):
     """Generic function for adding to a table from a dataframe.
     
     args:
@@ -21,6 +22,10 @@ def _add_df(df, DestClass, fields=[], session=session):
     df - pandas dataframe - the records to be added to the database 
     DestClass - sqla table class - the class of the receiving table
     session - sqla session:None - the offers db session object
+    bulk - bool:DB_BULK_INSERT - insert with chunked executemany calls rather 
+        than building an ORM object per row
+    chunk_size - int:DB_CHUNK_SIZE - the number of rows sent in each executemany
+    commit - bool:True - commit the session once the rows are added
 
     returns:
     ----
@@ -35,6 +40,35 @@ def _add_df(df, DestClass, fields=[], session=session):
     if len(fields) > 0:
         cols = overlap([cols, fields])
     df = df[cols]
-    objects = [DestClass(**r) for _,r in df.iterrows()]
-    session.bulk_save_objects(objects)
-    session.commit()
+    if bulk:
+        _bulk_insert_df(df, DestClass, session=session, chunk_size=chunk_size)
+    else:
+        objects = [DestClass(**r) for _,r in df.iterrows()]
+        session.bulk_save_objects(objects)
+    if commit:
+        session.commit()
+
+def _bulk_insert_df(df, DestClass, session=session, chunk_size=DB_CHUNK_SIZE):
+    """Function to insert a dataframe through a core insert statement. Rows are 
+    passed to the driver as parameter sets in chunks so no ORM objects are 
+    created. Does not commit.
+    
+    args:
+    ----
+    df - pandas dataframe - the records to be added, columns must match the table
+    DestClass - sqla table class - the class of the receiving table
+    session - sqla session:None - the db session object
+    chunk_size - int:DB_CHUNK_SIZE - the number of rows sent in each executemany
+
+    returns:
+    ----
+    int - the number of rows inserted
+    """
+    if not df.shape[0]:
+        return 0
+    stmt = DestClass.__table__.insert()
+    chunk_size = max(int(chunk_size), 1)
+    for st in range(0, df.shape[0], chunk_size):
+        records = df.iloc[st:st + chunk_size].to_dict(orient="records")
+        session.execute(stmt, records)
+    return df.shape[0]
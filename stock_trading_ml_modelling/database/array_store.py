@@ -0,0 +1,216 @@
+"""Memory mapped numpy store for the price tables.
+
+Each field is saved as one contiguous .npy array across all tickers, ordered
+by ticker_id then date, with an offsets index so the rows of tickers[i] are
+offsets[i]:offsets[i+1]:
+    <PRICE_ARRAYS_PATH>/<table>/<field>.npy
+    <PRICE_ARRAYS_PATH>/<table>/tickers.npy
+    <PRICE_ARRAYS_PATH>/<table>/offsets.npy
+    <PRICE_ARRAYS_PATH>/<table>/meta.json
+
+Arrays are opened with mmap_mode="r" so slicing a ticker, or taking moving
+windows over it, returns views onto the file without copying. The sqlite db
+remains the source of truth, the store is rebuilt from it with build.
+"""
+import os
+import json
+import shutil
+import logging
+import datetime as dt
+import numpy as np
+import pandas as pd
+from numpy.lib.format import open_memmap
+from numpy.lib.stride_tricks import sliding_window_view
+
+from stock_trading_ml_modelling.config import PRICE_ARRAYS_PATH, PRICE_ARRAYS_DTYPE, DB_CHUNK_SIZE
+from stock_trading_ml_modelling.database.models import Session as session
+from stock_trading_ml_modelling.database.get_data import _price_arrays_where, PRICE_FIELDS
+from stock_trading_ml_modelling.database.models.prices import DailyPrice, WeeklyPrice
+from stock_trading_ml_modelling.database.models.types import db_to_datetime64
+
+class PriceArrayStore:
+    def __init__(self, table, path=PRICE_ARRAYS_PATH):
+        """
+        args:
+        ----
+        table - str - the name of the price table, eg "daily_price"
+        path - str:PRICE_ARRAYS_PATH - the root folder of the store
+        """
+        self.table = table
+        self.path = os.path.join(path, table)
+        self.meta = None
+        self.arrays = {}
+        self.tickers = None
+        self.offsets = None
+        self._ticker_pos = {}
+
+    def build(self, DestClass, session=session, dtype=PRICE_ARRAYS_DTYPE, fields=PRICE_FIELDS, chunksize=DB_CHUNK_SIZE):
+        """Function to rebuild the store from the db. Rows are streamed from
+        the DB-API cursor straight into memory mapped files so memory use is
+        bounded by chunksize. The new store is written to a temp folder and
+        swapped in once complete.
+
+        args:
+        ----
+        DestClass - sqla table class - DailyPrice or WeeklyPrice
+        session - sqla session:None - the db session object
+        dtype - str:PRICE_ARRAYS_DTYPE - the dtype of the price fields
+        fields - list:PRICE_FIELDS - the price fields to store
+        chunksize - int:DB_CHUNK_SIZE - the number of rows pulled from the cursor at a time
+
+        returns:
+        ----
+        int - the number of rows written
+        """
+        tab_name = DestClass.__table__.name
+        cols = ["id","ticker_id","date"] + list(fields)
+        dtypes = ["int64","int32","datetime64[D]"] + [dtype] * len(fields)
+        where, params = _price_arrays_where()
+        tmp_path = self.path + ".tmp"
+        if os.path.isdir(tmp_path):
+            shutil.rmtree(tmp_path)
+        os.makedirs(tmp_path)
+        conn = session.bind.raw_connection()
+        try:
+            cursor = conn.cursor()
+            n_rows = cursor.execute(f"SELECT COUNT(*) FROM {tab_name} {where}", params).fetchone()[0]
+            out = {
+                c:open_memmap(os.path.join(tmp_path, f"{c}.npy"), mode="w+", dtype=d, shape=(n_rows,))
+                for c, d in zip(cols, dtypes)
+                }
+            cursor.execute(f"SELECT {', '.join(cols)} FROM {tab_name} {where} ORDER BY ticker_id, date", params)
+            st = 0
+            while True:
+                rows = cursor.fetchmany(chunksize)
+                if not rows:
+                    break
+                #Rows added since the count are left for the next build
+                rows = rows[:n_rows - st]
+                for c, d, vals in zip(cols, dtypes, zip(*rows)):
+                    out[c][st:st + len(rows)] = db_to_datetime64(vals) if c == "date" else np.array(vals, dtype=d)
+                st += len(rows)
+                if st >= n_rows:
+                    break
+            cursor.close()
+        finally:
+            conn.close()
+        #Mark where each ticker starts and ends
+        ticker_id = out["ticker_id"][:st]
+        bounds = np.flatnonzero(np.diff(ticker_id)) + 1
+        offsets = np.concatenate([[0], bounds, [st]]).astype("int64") if st else np.zeros(1, dtype="int64")
+        np.save(os.path.join(tmp_path, "offsets.npy"), offsets)
+        np.save(os.path.join(tmp_path, "tickers.npy"), np.asarray(ticker_id[offsets[:-1]]))
+        for c in cols:
+            out[c].flush()
+        del out, ticker_id
+        with open(os.path.join(tmp_path, "meta.json"), "w+") as f:
+            f.write(json.dumps({
+                "table":tab_name,
+                "fields":["id","date"] + list(fields),
+                "dtype":dtype,
+                "n_rows":int(st),
+                "built_at":dt.datetime.now().isoformat(),
+                }))
+        #Swap in the new store
+        if os.path.isdir(self.path):
+            shutil.rmtree(self.path)
+        os.replace(tmp_path, self.path)
+        self.close()
+        logging.info(f"Built price arrays for {tab_name}, {st} rows to {self.path}")
+        return int(st)
+
+    def load(self):
+        """Function to open the arrays in the store as read only memory maps"""
+        with open(os.path.join(self.path, "meta.json"), "r") as f:
+            self.meta = json.loads(f.read())
+        self.arrays = {
+            c:np.load(os.path.join(self.path, f"{c}.npy"), mmap_mode="r")
+            for c in self.meta["fields"]
+            }
+        self.tickers = np.load(os.path.join(self.path, "tickers.npy"))
+        self.offsets = np.load(os.path.join(self.path, "offsets.npy"))
+        self._ticker_pos = {int(t):i for i,t in enumerate(self.tickers)}
+        return self
+
+    def close(self):
+        self.meta = None
+        self.arrays = {}
+        self.tickers = None
+        self.offsets = None
+        self._ticker_pos = {}
+
+    def _loaded(self):
+        if self.meta is None:
+            self.load()
+
+    def ticker_slice(self, ticker_id):
+        """Function to find the rows held for a ticker
+
+        returns:
+        ----
+        slice - empty if the ticker is not in the store
+        """
+        self._loaded()
+        i = self._ticker_pos.get(int(ticker_id))
+        if i is None:
+            return slice(0, 0)
+        return slice(int(self.offsets[i]), int(self.offsets[i + 1]))
+
+    def get(self, ticker_id, fields=None, from_date=None, to_date=None):
+        """Function to get the history of a ticker as views onto the store
+
+        args:
+        ----
+        ticker_id - int - the ticker to fetch
+        fields - list:None - the fields to fetch (all if None)
+        from_date - datetime:None - the min date for filtering records
+        to_date - datetime:None - the max date for filtering records
+
+        returns:
+        ----
+        dict - field name to read only array
+        """
+        sl = self.ticker_slice(ticker_id)
+        if from_date or to_date:
+            dates = self.arrays["date"][sl]
+            st = np.searchsorted(dates, np.datetime64(pd.Timestamp(from_date).date(), "D"), side="left") \
+                if from_date else 0
+            en = np.searchsorted(dates, np.datetime64(pd.Timestamp(to_date).date(), "D"), side="right") \
+                if to_date else dates.shape[0]
+            sl = slice(sl.start + int(st), sl.start + int(en))
+        fields = self.meta["fields"] if fields is None else fields
+        return {c:self.arrays[c][sl] for c in fields}
+
+    def windows(self, ticker_id, field, window):
+        """Function to get every moving window of a field for a ticker. The
+        windows are a strided view, row j holds rows j:j+window of the ticker.
+
+        args:
+        ----
+        ticker_id - int - the ticker to fetch
+        field - str - the field to window
+        window - int - the length of each window
+
+        returns:
+        ----
+        numpy array - shape (n_rows - window + 1, window), (0, window) if
+            the ticker has fewer than window rows
+        """
+        arr = self.get(ticker_id, fields=[field])[field]
+        if arr.shape[0] < window:
+            return np.empty((0, window), dtype=arr.dtype)
+        return sliding_window_view(arr, window)
+
+def refresh_price_arrays(session=session):
+    """Function to rebuild the array stores of the daily and weekly price 
+    tables. Each store is rewritten in full, so this is run on demand by 
+    build_price_arrays or after each scrape if refresh_after_scrape is set.
+
+    returns:
+    ----
+    dict - table name to the number of rows written
+    """
+    return {
+        DestClass.__table__.name:PriceArrayStore(DestClass.__table__.name).build(DestClass, session=session)
+        for DestClass in [DailyPrice, WeeklyPrice]
+        }
@@ -0,0 +1,136 @@
+"""In memory LRU cache for price query results
+
+Only fetch_df reads the cache, so it serves the readers which go through 
+it: PriceData.get_prices while the price panel is disabled, as it is by 
+default, so repeated DataBuilder runs in a process share their reads. With
+the panel enabled prices are read from the panel and the cache can be
+turned off with price_cache.enabled.
+"""
+import threading
+from collections import OrderedDict
+
+import pandas as pd
+
+from stock_trading_ml_modelling.config import PRICE_CACHE_ENABLED, PRICE_CACHE_MAX_BYTES
+
+def _date_key(d):
+    return None if d is None else pd.Timestamp(d).strftime("%Y-%m-%d")
+
+def make_key(table, ticker_ids=[], from_date=None, to_date=None, **kwargs):
+    """Function to build the cache key of a price query, ticker order and the
+    type used for the dates do not change the key.
+
+    returns:
+    ----
+    tuple
+    """
+    return (
+        table,
+        tuple(sorted({int(v) for v in ticker_ids})),
+        _date_key(from_date),
+        _date_key(to_date),
+        tuple(sorted(kwargs.items())),
+    )
+
+class QueryCache:
+    def __init__(self, max_bytes=PRICE_CACHE_MAX_BYTES, enabled=PRICE_CACHE_ENABLED):
+        """LRU cache of dataframes bounded by their memory usage. Dataframes
+        are copied going in and coming out so callers can modify them freely.
+
+        args:
+        ----
+        max_bytes - int:PRICE_CACHE_MAX_BYTES - the max total size of the cached dataframes
+        enabled - bool:PRICE_CACHE_ENABLED - when False every get is a miss and nothing is stored
+        """
+        self.max_bytes = max_bytes
+        self.enabled = enabled
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        """Function to get a copy of a cached dataframe
+
+        returns:
+        ----
+        pandas dataframe or None on a miss
+        """
+        with self._lock:
+            item = self._data.get(key) if self.enabled else None
+            if item is None:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return item[0].copy()
+
+    def put(self, key, df):
+        """Function to add a dataframe, evicting the least recently used
+        entries to stay within max_bytes. Dataframes larger than max_bytes
+        are not cached."""
+        if not self.enabled:
+            return
+        size = int(df.memory_usage(index=True, deep=True).sum())
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._data:
+                self.bytes -= self._data.pop(key)[1]
+            self._data[key] = (df.copy(), size)
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                _, (_, old_size) = self._data.popitem(last=False)
+                self.bytes -= old_size
+                self.evictions += 1
+
+    def invalidate(self, table=None, ticker_ids=None):
+        """Function to drop cached results made stale by a write.
+
+        args:
+        ----
+        table - str:None - the table written to, all tables if None
+        ticker_ids - list:None - the tickers written to, all if None. Cached
+            queries over all tickers are always dropped.
+
+        returns:
+        ----
+        int - the number of entries dropped
+        """
+        if not self.enabled:
+            return 0
+        ticker_ids = None if ticker_ids is None else {int(v) for v in ticker_ids}
+        with self._lock:
+            stale = [
+                k for k in self._data
+                if (table is None or k[0] == table)
+                and (ticker_ids is None or not len(k[1]) or ticker_ids & set(k[1]))
+                ]
+            for k in stale:
+                self.bytes -= self._data.pop(k)[1]
+            return len(stale)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.bytes = 0
+
+    def stats(self):
+        """Function to get the cache counters
+
+        returns:
+        ----
+        dict - hits, misses, evictions, entries and bytes
+        """
+        with self._lock:
+            return {
+                "hits":self.hits,
+                "misses":self.misses,
+                "evictions":self.evictions,
+                "entries":len(self._data),
+                "bytes":self.bytes,
+                }
+
+price_cache = QueryCache()
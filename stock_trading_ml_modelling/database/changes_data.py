@@ -0,0 +1,179 @@
+"""Functions for the price_changes journal of writes to the price tables
+
+Every price write appends one row per ticker touched holding the min and
+max date written (or deleted) and the id of the run. Downstream steps keep
+a watermark per table in change_consumer and read only the changes logged
+since they last ran.
+"""
+import uuid
+import datetime as dt
+import pandas as pd
+from sqlalchemy import func, select, literal, delete
+from sqlalchemy.dialects.sqlite import insert
+
+from stock_trading_ml_modelling.database.models import Session as session
+from stock_trading_ml_modelling.database.models.prices import PriceChange, ChangeConsumer
+
+#The id written with each change, shared by everything in the process
+_run = {"id":None}
+
+def new_run(run_id=None):
+    """Function to start a new run, the changes logged from now on carry its id
+
+    returns:
+    ----
+    str - the run id
+    """
+    _run["id"] = run_id or f"{dt.datetime.now().strftime('%Y%m%d%H%M%S')}-{uuid.uuid4().hex[:8]}"
+    return _run["id"]
+
+def get_run_id():
+    return _run["id"] or new_run()
+
+def _log_changes_df(DestClass, df, session=session):
+    """Function to log the ticker date ranges held in a dataframe of written
+    prices. Does not commit.
+
+    args:
+    ----
+    DestClass - sqla table class - the price table written to
+    df - pandas dataframe - the rows written, with ticker_id and date
+    session - sqla session:None - the db session object
+
+    returns:
+    ----
+    int - the number of changes logged
+    """
+    if not df.shape[0]:
+        return 0
+    ranges = df[["ticker_id","date"]].dropna(subset=["ticker_id"]).copy()
+    ranges["date"] = pd.to_datetime(ranges.date)
+    ranges = ranges.groupby("ticker_id").date.agg(["min","max"]).reset_index()
+    if not ranges.shape[0]:
+        return 0
+    run_id = get_run_id()
+    session.execute(insert(PriceChange.__table__), [{
+        "table_name":DestClass.__table__.name,
+        "ticker_id":int(r.ticker_id),
+        "min_date":r["min"].date(),
+        "max_date":r["max"].date(),
+        "run_id":run_id,
+        } for _,r in ranges.iterrows()])
+    return ranges.shape[0]
+
+def _log_changes_where(DestClass, where, session=session):
+    """Function to log the ticker date ranges of the rows matching where, in
+    one INSERT ... SELECT. Run it before a delete or after an update. Does not
+    commit.
+
+    args:
+    ----
+    DestClass - sqla table class - the price table written to
+    where - sqla expression - selects the rows changed, all rows if None
+    session - sqla session:None - the db session object
+
+    returns:
+    ----
+    int - the number of changes logged
+    """
+    sel = select(
+            literal(DestClass.__table__.name),
+            DestClass.ticker_id,
+            func.min(DestClass.date),
+            func.max(DestClass.date),
+            literal(get_run_id())
+        ) \
+        .where(DestClass.ticker_id.is_not(None)) \
+        .group_by(DestClass.ticker_id)
+    if where is not None:
+        sel = sel.where(where)
+    stmt = insert(PriceChange).from_select(["table_name","ticker_id","min_date","max_date","run_id"], sel)
+    return session.execute(stmt).rowcount
+
+def _log_changes_updated(DestClass, df, session=session):
+    """Function to log the rows of an update, from the dataframe when it holds
+    ticker_id and date, otherwise from the updated rows found by id. Does not
+    commit."""
+    if {"ticker_id","date"}.issubset(df.columns):
+        return _log_changes_df(DestClass, df, session=session)
+    if "id" in df.columns and df.shape[0]:
+        return _log_changes_where(DestClass, DestClass.id.in_([int(v) for v in df.id]), session=session)
+    return 0
+
+def _watermark(consumer, table_name, session=session):
+    return session.execute(
+        select(ChangeConsumer.last_change_id)
+            .where(ChangeConsumer.name == consumer, ChangeConsumer.table_name == table_name)
+        ).scalar() or 0
+
+def _pending_changes(consumer, table_name, session=session):
+    """Function to get the changes to a table since a consumer last
+    acknowledged, merged to one range per ticker.
+
+    args:
+    ----
+    consumer - str - the name of the downstream step
+    table_name - str - the price table, eg "daily_price"
+    session - sqla session:None - the db session object
+
+    returns:
+    ----
+    pandas dataframe - ticker_id, min_date, max_date and change_id, the
+        latest change merged into the row
+    """
+    sel = select(
+            PriceChange.ticker_id,
+            func.min(PriceChange.min_date).label("min_date"),
+            func.max(PriceChange.max_date).label("max_date"),
+            func.max(PriceChange.id).label("change_id")
+        ) \
+        .where(PriceChange.table_name == table_name) \
+        .where(PriceChange.id > _watermark(consumer, table_name, session=session)) \
+        .group_by(PriceChange.ticker_id) \
+        .order_by(PriceChange.ticker_id)
+    return pd.DataFrame(session.execute(sel).all(), columns=["ticker_id","min_date","max_date","change_id"])
+
+def _ack_changes(consumer, table_name, change_id, session=session):
+    """Function to move a consumer's watermark forward to change_id. Commits.
+
+    returns:
+    ----
+    int - the consumer's watermark
+    """
+    stmt = insert(ChangeConsumer).values(
+        name=consumer,
+        table_name=table_name,
+        last_change_id=int(change_id),
+        updated_at=dt.datetime.now()
+        )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["name","table_name"],
+        set_={
+            "last_change_id":func.max(ChangeConsumer.last_change_id, stmt.excluded.last_change_id),
+            "updated_at":stmt.excluded.updated_at,
+            }
+    )
+    session.execute(stmt)
+    session.commit()
+    return _watermark(consumer, table_name, session=session)
+
+def _prune_changes(session=session):
+    """Function to delete the changes every consumer of their table has
+    acknowledged. Changes to tables without consumers are kept. Commits.
+
+    returns:
+    ----
+    int - the number of changes deleted
+    """
+    count = 0
+    marks = session.execute(
+        select(ChangeConsumer.table_name, func.min(ChangeConsumer.last_change_id))
+            .group_by(ChangeConsumer.table_name)
+        ).all()
+    for table_name, change_id in marks:
+        count += session.execute(
+            delete(PriceChange)
+                .where(PriceChange.table_name == table_name, PriceChange.id <= change_id)
+            ).rowcount
+    session.commit()
+    return count
@@ -1,10 +1,12 @@
 """File to fetch data from stock_trading_ml_modelling.database database"""
+import numpy as np
 import pandas as pd
 from sqlalchemy import func, and_
 
-from stock_trading_ml_modelling.config import CONFIG
+from stock_trading_ml_modelling.config import CONFIG, DB_CHUNK_SIZE
 from stock_trading_ml_modelling.database.models.prices import Ticker, TickerMarket, DailyPrice, WeeklyPrice
 from stock_trading_ml_modelling.database.models import Session as session
+from stock_trading_ml_modelling.database.models.types import date_to_db, db_to_datetime64
 
 #Converting query to dataframe
 def sqlaq_to_df(query, session=session):
@@ -13,4 +15,146 @@ def sqlaq_to_df(query, session=session):
 
 def sqlaq_to_df_first(query, session=session):
     out_df = pd.read_sql(query.statement, con=session.bind)
-    return out_df.iloc[0]
\ No newline at end of file
+    return out_df.iloc[0]
+
+def sqlaq_to_df_chunks(query, session=session, chunksize=DB_CHUNK_SIZE):
+    """Generator to stream the results of a query as dataframes of at most
+    chunksize rows. The result is read with stream_results/yield_per so only
+    one chunk is held in memory at a time.
+
+    args:
+    ----
+    query - sqla query - the query to run
+    session - sqla session:None - the db session object
+    chunksize - int:DB_CHUNK_SIZE - the max number of rows in each dataframe
+
+    yields:
+    ----
+    pandas dataframe
+    """
+    with session.bind.connect() as conn:
+        result = conn.execution_options(stream_results=True, yield_per=chunksize) \
+            .execute(query.statement)
+        cols = list(result.keys())
+        for rows in result.partitions(chunksize):
+            yield pd.DataFrame(rows, columns=cols)
+
+def sqlaq_to_df_by_ticker(query, session=session, chunksize=DB_CHUNK_SIZE, key="ticker_id"):
+    """Generator to stream the results of a query one ticker at a time. The
+    query MUST be ordered by key, rows for a ticker which straddle two chunks
+    are carried over and yielded once the ticker is complete.
+
+    args:
+    ----
+    query - sqla query - the query to run, ordered by key
+    session - sqla session:None - the db session object
+    chunksize - int:DB_CHUNK_SIZE - the number of rows read from the db at a time
+    key - str:"ticker_id" - the column to group on
+
+    yields:
+    ----
+    tuple - (key value, pandas dataframe)
+    """
+    carry = None
+    for chunk in sqlaq_to_df_chunks(query, session=session, chunksize=chunksize):
+        if carry is not None:
+            chunk = pd.concat([carry, chunk], ignore_index=True)
+        #The last ticker in the chunk may continue in the next chunk
+        mask = chunk[key] == chunk[key].iloc[-1]
+        done, carry = chunk[~mask], chunk[mask]
+        for k, group in done.groupby(key, sort=False):
+            yield k, group.reset_index(drop=True)
+    if carry is not None and carry.shape[0]:
+        yield carry[key].iloc[0], carry.reset_index(drop=True)
+
+PRICE_FIELDS = ["open","high","low","close","change","volume"]
+
+def _price_arrays_where(ticker_ids=[], from_date=None, to_date=None):
+    """Function to build the WHERE clause and qmark params used when reading 
+    prices over the raw DB-API cursor
+
+    returns:
+    ----
+    tuple - (str, list)
+    """
+    where = "WHERE ticker_id IS NOT NULL"
+    params = []
+    if len(ticker_ids):
+        where += f" AND ticker_id IN ({', '.join(['?'] * len(ticker_ids))})"
+        params += [int(v) for v in ticker_ids]
+    if from_date:
+        where += " AND date >= ?"
+        params.append(date_to_db(from_date))
+    if to_date:
+        where += " AND date <= ?"
+        params.append(date_to_db(to_date))
+    return where, params
+
+def _fetch_price_arrays(
+    DestClass,
+    ticker_ids=[],
+    from_date=None,
+    to_date=None,
+    dtype="float32",
+    fields=PRICE_FIELDS,
+    session=session,
+    chunksize=DB_CHUNK_SIZE,
+    ids=False
+    ):
+    """Function to read prices straight from the DB-API cursor into typed, 
+    contiguous numpy arrays, ordered by ticker_id then date. No dataframe or 
+    sqla row objects are built.
+
+    args:
+    ----
+    DestClass - sqla table class - DailyPrice or WeeklyPrice
+    ticker_ids - list:[] - the ids of the records to be extracted (all if empty)
+    from_date - datetime:None - the min date for filtering records
+    to_date - datetime:None - the max date for filtering records
+    dtype - str:"float32" - the dtype of the price fields
+    fields - list:PRICE_FIELDS - the price fields to fetch
+    session - sqla session:None - the db session object
+    chunksize - int:DB_CHUNK_SIZE - the number of rows pulled from the cursor at a time
+    ids - bool:False - also fetch the row ids
+
+    returns:
+    ----
+    dict - 
+        id - int64 array, only when ids is True
+        ticker_id - int32 array
+        date - datetime64[D] array
+        <field> - dtype array for each item in fields
+        tickers - int32 array of the unique ticker ids in order
+        offsets - int64 array, the rows of tickers[i] are offsets[i]:offsets[i+1]
+    """
+    cols = ["ticker_id","date"] + list(fields)
+    dtypes = ["int32", "datetime64[D]"] + [dtype] * len(fields)
+    if ids:
+        cols, dtypes = ["id"] + cols, ["int64"] + dtypes
+    where, params = _price_arrays_where(ticker_ids, from_date, to_date)
+    sql = f"SELECT {', '.join(cols)} FROM {DestClass.__table__.name} {where} ORDER BY ticker_id, date"
+    #Convert each block of rows column by column to keep python objects bounded
+    blocks = {c:[] for c in cols}
+    conn = session.bind.raw_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute(sql, params)
+        while True:
+            rows = cursor.fetchmany(chunksize)
+            if not rows:
+                break
+            for c, d, vals in zip(cols, dtypes, zip(*rows)):
+                blocks[c].append(db_to_datetime64(vals) if c == "date" else np.array(vals, dtype=d))
+        cursor.close()
+    finally:
+        conn.close()
+    out = {
+        c:np.concatenate(blocks[c]) if len(blocks[c]) else np.array([], dtype=d)
+        for c, d in zip(cols, dtypes)
+        }
+    #Mark where each ticker starts and ends
+    bounds = np.flatnonzero(np.diff(out["ticker_id"])) + 1
+    out["offsets"] = np.concatenate([[0], bounds, [out["ticker_id"].shape[0]]]).astype("int64") \
+        if out["ticker_id"].shape[0] else np.zeros(1, dtype="int64")
+    out["tickers"] = out["ticker_id"][out["offsets"][:-1]]
+    return out
@@ -0,0 +1,72 @@
+"""Functions for maintaining the ticker_latest summary table"""
+from sqlalchemy import func, select, update, delete
+from sqlalchemy.dialects.sqlite import insert
+
+from stock_trading_ml_modelling.database.models import Session as session
+from stock_trading_ml_modelling.database.models.prices import DailyPrice, WeeklyPrice, TickerLatest
+
+#The ticker_latest columns maintained for each price table
+LATEST_COLS = {
+    DailyPrice.__table__.name:("last_daily_date", "daily_count"),
+    WeeklyPrice.__table__.name:("last_weekly_date", "weekly_count"),
+}
+
+def _refresh_latest(DestClass, ticker_ids=None, session=session):
+    """Function to recalculate the ticker_latest columns of a price table for
+    the given tickers. Runs in the caller's transaction, does not commit, so
+    the summary is committed with the price rows that changed it.
+
+    Each ticker is resolved through the (ticker_id, date) unique index so the
+    cost is the rows held for the tickers touched, not the whole table.
+
+    args:
+    ----
+    DestClass - sqla table class - DailyPrice or WeeklyPrice
+    ticker_ids - list:None - the tickers to recalculate, all if None
+    session - sqla session:None - the db session object
+
+    returns:
+    ----
+    None
+    """
+    date_col, count_col = LATEST_COLS[DestClass.__table__.name]
+    if ticker_ids is not None:
+        ticker_ids = list({int(v) for v in ticker_ids})
+        if not len(ticker_ids):
+            return
+    #Clear the old values so tickers with no rows left are reset
+    clear = update(TickerLatest).values({date_col:None, count_col:0})
+    if ticker_ids is not None:
+        clear = clear.where(TickerLatest.ticker_id.in_(ticker_ids))
+    session.execute(clear)
+    #Recalculate from the price table
+    sel = select(
+            DestClass.ticker_id,
+            func.max(DestClass.date),
+            func.count()
+        ) \
+        .where(DestClass.ticker_id.is_not(None))
+    if ticker_ids is not None:
+        sel = sel.where(DestClass.ticker_id.in_(ticker_ids))
+    sel = sel.group_by(DestClass.ticker_id)
+    stmt = insert(TickerLatest).from_select(["ticker_id", date_col, count_col], sel)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["ticker_id"],
+        set_={date_col:stmt.excluded[date_col], count_col:stmt.excluded[count_col]}
+    )
+    session.execute(stmt)
+
+def _rebuild_latest(session=session):
+    """Function to rebuild the whole ticker_latest table from the price tables,
+    for databases where the summary has drifted or was created after the
+    prices were loaded. Commits.
+
+    returns:
+    ----
+    int - the number of tickers in the summary
+    """
+    session.execute(delete(TickerLatest))
+    for DestClass in [DailyPrice, WeeklyPrice]:
+        _refresh_latest(DestClass, session=session)
+    session.commit()
+    return session.query(func.count(TickerLatest.ticker_id)).scalar()
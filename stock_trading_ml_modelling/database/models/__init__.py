@@ -1,10 +1,11 @@
 """Model for sql database"""
-from sqlalchemy import create_engine
+from contextlib import contextmanager
+from sqlalchemy import create_engine, event
 from sqlalchemy.orm import sessionmaker, scoped_session
 from sqlalchemy.ext.declarative import declarative_base
 from pathlib import Path
 
-from stock_trading_ml_modelling.config import DB_PATH
+from stock_trading_ml_modelling.config import DB_PATH, DB_TUNING_PROFILE, DB_TUNING_PROFILES
 
 #Start the engine and Session
 engine = create_engine(
@@ -12,4 +13,55 @@ engine = create_engine(
 )
 Session = scoped_session(sessionmaker(bind=engine, expire_on_commit=False))
 
-Base = declarative_base()
\ No newline at end of file
+Base = declarative_base()
+
+#The tuning profile applied to new connections
+_db_profile = {"name":DB_TUNING_PROFILE}
+
+def apply_pragmas(dbapi_conn, profile=None):
+    """Function to set the pragmas of a tuning profile (from db_tuning in
+    config.json) on a raw sqlite connection.
+
+    args:
+    ----
+    dbapi_conn - sqlite3 connection - the connection to tune
+    profile - str:None - the profile name, defaults to the active profile
+    """
+    pragmas = DB_TUNING_PROFILES.get(profile or _db_profile["name"], {})
+    cursor = dbapi_conn.cursor()
+    for k,v in pragmas.items():
+        cursor.execute(f"PRAGMA {k}={v}")
+    cursor.close()
+
+@event.listens_for(engine, "connect")
+def _set_sqlite_pragmas(dbapi_conn, connection_record):
+    apply_pragmas(dbapi_conn)
+
+def set_db_profile(profile, engine=engine, session=Session):
+    """Function to switch the tuning profile used by the engine. The current
+    session is closed and the pool emptied so that every following connection
+    is opened with the new pragmas.
+
+    args:
+    ----
+    profile - str - the name of a profile in db_tuning.profiles
+    engine - sqla engine:engine - the engine to reset
+    session - sqla scoped session:Session - the session to close
+    """
+    if profile not in DB_TUNING_PROFILES and profile != DB_TUNING_PROFILE:
+        raise ValueError(f'profile must be one of {list(DB_TUNING_PROFILES)}, "{profile}" given')
+    session.remove()
+    _db_profile["name"] = profile
+    engine.dispose()
+
+@contextmanager
+def db_profile(profile, engine=engine, session=Session):
+    """Context manager to run a block under another tuning profile, eg
+    "bulk_load", then switch back to the previous one.
+    """
+    prev_profile = _db_profile["name"]
+    set_db_profile(profile, engine=engine, session=session)
+    try:
+        yield
+    finally:
+        set_db_profile(prev_profile, engine=engine, session=session)
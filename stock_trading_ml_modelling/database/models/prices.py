@@ -1,15 +1,20 @@
 """Set of functions for the SQLAlchemy classes
 
 """
-from sqlalchemy import Column, Sequence, Integer, String, Float, Date, ForeignKey, \
-    Enum, UniqueConstraint
+from sqlalchemy import Column, Sequence, Integer, String, Float, Date, DateTime, ForeignKey, \
+    Enum, UniqueConstraint, Index, func
 from sqlalchemy.orm import relationship
 from datetime import datetime as dt
 
 from stock_trading_ml_modelling.database.models import Base
+from stock_trading_ml_modelling.database.models.types import PriceDate, EPOCH_JULIANDAY
 
 class Ticker(Base):
     __tablename__ = 'ticker'
+    #constraints
+    __table_args__ = (
+        Index('ix_ticker_ticker', 'ticker'),
+    )
     id = Column(Integer, nullable=False, primary_key=True, autoincrement=True)
     ticker = Column(String, nullable=False)
     company = Column(String, nullable=False)
@@ -18,8 +23,6 @@ class Ticker(Base):
     markets = relationship('TickerMarket', backref='ticker')
     daily_prices = relationship('DailyPrice', backref='ticker')
     weekly_prices = relationship('WeeklyPrice', backref='ticker')
-    #constraints
-    UniqueConstraint('ticker', 'company', name='uix_1')
 
 class TickerMarket(Base):
     __tablename__ = 'ticker_market'
@@ -31,24 +34,30 @@ class TickerMarket(Base):
 
 class DailyPrice(Base):
     __tablename__ = 'daily_price'
+    #constraints - (ticker_id, date) is the conflict target for upserts
+    __table_args__ = (
+        Index('uix_daily_price_ticker_id_date', 'ticker_id', 'date', unique=True),
+    )
     id = Column(Integer, nullable=False, primary_key=True, autoincrement=True)
-    date = Column(Date, nullable=False)
+    date = Column(PriceDate, nullable=False)
     open = Column(Float, nullable=False)
     high = Column(Float, nullable=False)
     low = Column(Float, nullable=False)
     close = Column(Float, nullable=False)
     change = Column(Float, nullable=False)
     volume = Column(Float, nullable=False)
-    week_start_date = Column(Date, nullable=False)
+    week_start_date = Column(PriceDate, nullable=False)
     #child
     ticker_id = Column(Integer, ForeignKey('ticker.id'))
-    #constraints
-    UniqueConstraint('ticker_id', 'date', name='uix_1')
 
 class WeeklyPrice(Base):
     __tablename__ = 'weekly_price'
+    #constraints - (ticker_id, date) is the conflict target for upserts
+    __table_args__ = (
+        Index('uix_weekly_price_ticker_id_date', 'ticker_id', 'date', unique=True),
+    )
     id = Column(Integer, nullable=False, primary_key=True, autoincrement=True)
-    date = Column(Date, nullable=False)
+    date = Column(PriceDate, nullable=False)
     open = Column(Float, nullable=False)
     high = Column(Float, nullable=False)
     low = Column(Float, nullable=False)
@@ -57,8 +66,134 @@ class WeeklyPrice(Base):
     volume = Column(Float, nullable=False)
     #child
     ticker_id = Column(Integer, ForeignKey('ticker.id'))
-    #constraints
-    UniqueConstraint('ticker_id', 'date', name='uix_1')
-    
+
+class TickerLatest(Base):
+    """Summary of the price tables kept up to date by the price write paths,
+    avoids a MAX(date) GROUP BY over the full price tables"""
+    __tablename__ = 'ticker_latest'
+    ticker_id = Column(Integer, ForeignKey('ticker.id'), nullable=False, primary_key=True)
+    last_daily_date = Column(PriceDate)
+    daily_count = Column(Integer, nullable=False, default=0)
+    last_weekly_date = Column(PriceDate)
+    weekly_count = Column(Integer, nullable=False, default=0)
+
+class PriceChange(Base):
+    """Journal of the (ticker_id, date) ranges written to or deleted from the
+    price tables, read by downstream steps to process only what changed"""
+    __tablename__ = 'price_changes'
+    #constraints - consumers read a table from their watermark id onwards,
+    #AUTOINCREMENT stops ids being reused once the journal is pruned
+    __table_args__ = (
+        Index('ix_price_changes_table_name_id', 'table_name', 'id'),
+        {'sqlite_autoincrement':True},
+    )
+    id = Column(Integer, nullable=False, primary_key=True, autoincrement=True)
+    table_name = Column(String, nullable=False)
+    ticker_id = Column(Integer, ForeignKey('ticker.id'), nullable=False)
+    min_date = Column(PriceDate)
+    max_date = Column(PriceDate)
+    run_id = Column(String)
+    created_at = Column(DateTime, server_default=func.current_timestamp())
+
+class ChangeConsumer(Base):
+    """The last price_changes id processed by each downstream consumer"""
+    __tablename__ = 'change_consumer'
+    name = Column(String, nullable=False, primary_key=True)
+    table_name = Column(String, nullable=False, primary_key=True)
+    last_change_id = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime)
+
 def create_db(engine):
-    Base.metadata.create_all(engine)
\ No newline at end of file
+    Base.metadata.create_all(engine)
+
+def create_indexes(engine):
+    """Function to create any indexes defined on the models which are missing
+    from an existing database. create_all skips tables which already exist so
+    indexes added after a database was built have to be created this way.
+    """
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=engine, checkfirst=True)
+
+def migrate_price_changes(engine):
+    """Function to bring the price_changes table of an existing database up
+    to AUTOINCREMENT. Tables created without it can reuse ids once the 
+    journal is pruned, putting new changes below the consumer watermarks so
+    they are never processed. The table is rebuilt if needed and the id 
+    sequence moved past every id held or acknowledged. Safe to re-run.
+
+    args:
+    ----
+    engine - sqla engine - the database to migrate
+
+    returns:
+    ----
+    bool - True if the table was rebuilt
+    """
+    rebuilt = False
+    with engine.begin() as conn:
+        sql = conn.exec_driver_sql(
+            "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'price_changes'"
+            ).scalar()
+        if sql is None:
+            return rebuilt
+        if "AUTOINCREMENT" not in sql.upper():
+            conn.exec_driver_sql("ALTER TABLE price_changes RENAME TO price_changes_old")
+            #The index moves with the renamed table, its name is needed again
+            conn.exec_driver_sql("DROP INDEX IF EXISTS ix_price_changes_table_name_id")
+            PriceChange.__table__.create(conn)
+            cols = ", ".join(c.name for c in PriceChange.__table__.columns)
+            conn.exec_driver_sql(f"INSERT INTO price_changes ({cols}) SELECT {cols} FROM price_changes_old")
+            conn.exec_driver_sql("DROP TABLE price_changes_old")
+            rebuilt = True
+        #New ids must carry on above any a consumer has acknowledged, even
+        #when the journal has been pruned empty
+        seq = conn.exec_driver_sql("""SELECT MAX(v) FROM (
+            SELECT MAX(id) AS v FROM price_changes
+            UNION ALL SELECT MAX(last_change_id) FROM change_consumer
+            UNION ALL SELECT seq FROM sqlite_sequence WHERE name = 'price_changes'
+            )""").scalar() or 0
+        conn.exec_driver_sql("DELETE FROM sqlite_sequence WHERE name = 'price_changes'")
+        conn.exec_driver_sql("INSERT INTO sqlite_sequence (name, seq) VALUES ('price_changes', ?)", (seq,))
+    return rebuilt
+
+#The date columns converted by convert_date_storage
+PRICE_DATE_COLS = {
+    'daily_price':['date','week_start_date'],
+    'weekly_price':['date'],
+    'ticker_latest':['last_daily_date','last_weekly_date'],
+    'price_changes':['min_date','max_date'],
+}
+
+def convert_date_storage(engine, storage):
+    """Function to convert the stored price dates between ISO strings and
+    integer epoch days. Only values not already in the target form are
+    changed so the conversion can be re-run safely. Set
+    db_schema.date_storage in config.json to match once it has run.
+
+    args:
+    ----
+    engine - sqla engine - the database to convert
+    storage - str - "iso" or "epoch"
+
+    returns:
+    ----
+    dict - table.column to rows converted
+    """
+    if storage == "epoch":
+        set_sql = "CAST(julianday({col}) - " + str(EPOCH_JULIANDAY) + " AS INTEGER)"
+        from_type = "text"
+    elif storage == "iso":
+        set_sql = "date({col} * 86400, 'unixepoch')"
+        from_type = "integer"
+    else:
+        raise ValueError(f'storage must be "iso" or "epoch", "{storage}" given')
+    counts = {}
+    with engine.begin() as conn:
+        for tab_name, cols in PRICE_DATE_COLS.items():
+            for col in cols:
+                result = conn.exec_driver_sql(
+                    f"UPDATE {tab_name} SET {col} = {set_sql.format(col=col)} WHERE typeof({col}) = '{from_type}'"
+                    )
+                counts[f"{tab_name}.{col}"] = result.rowcount
+    return counts
@@ -0,0 +1,77 @@
+"""Column types for the price tables
+
+The price dates are stored either as ISO strings ("iso", the sqlalchemy Date
+default) or as integer days since 1970-01-01 ("epoch"), set by
+db_schema.date_storage in config.json. Epoch days compare as integers in
+range scans and convert to datetime64[D] without any string parsing.
+"""
+import datetime as dt
+import numpy as np
+from sqlalchemy import Date, Integer
+from sqlalchemy.types import TypeDecorator
+
+from stock_trading_ml_modelling.config import DB_DATE_STORAGE
+
+EPOCH = dt.date(1970, 1, 1)
+#Julian day of the epoch, used to convert in sql
+EPOCH_JULIANDAY = 2440587.5
+
+def to_epoch_day(value):
+    """Function to convert a date, datetime or ISO string to days since epoch"""
+    if value is None:
+        return None
+    if isinstance(value, np.datetime64):
+        return int(value.astype("datetime64[D]").astype("int64"))
+    if isinstance(value, str):
+        value = dt.date.fromisoformat(value[:10])
+    if isinstance(value, dt.datetime):
+        value = value.date()
+    return (value - EPOCH).days
+
+class EpochDate(TypeDecorator):
+    """Date stored as an integer number of days since 1970-01-01"""
+    impl = Integer
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        return to_epoch_day(value)
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        return EPOCH + dt.timedelta(days=int(value))
+
+#The type used by the date columns of the price tables
+PriceDate = EpochDate if DB_DATE_STORAGE == "epoch" else Date
+
+def date_to_db(value, storage=DB_DATE_STORAGE):
+    """Function to convert a date to the value stored in the db, for raw sql
+    parameters"""
+    if value is None:
+        return None
+    if storage == "epoch":
+        return to_epoch_day(value)
+    return (EPOCH + dt.timedelta(days=to_epoch_day(value))).isoformat()
+
+def db_to_datetime64(values, storage=DB_DATE_STORAGE):
+    """Function to convert stored dates read over a raw cursor to a
+    datetime64[D] array. Epoch days are a cast, ISO strings are parsed.
+
+    args:
+    ----
+    values - sequence - the stored values
+
+    returns:
+    ----
+    numpy array - datetime64[D]
+    """
+    if storage == "epoch":
+        return np.asarray(values, dtype="int64").astype("datetime64[D]")
+    return np.asarray(values, dtype="datetime64[D]")
+
+def sql_iso_date(col, storage=DB_DATE_STORAGE):
+    """Function to get a sql expression giving a date column as an ISO
+    string, for use in raw sql"""
+    if storage == "epoch":
+        return f"date({col} * 86400, 'unixepoch')"
+    return col
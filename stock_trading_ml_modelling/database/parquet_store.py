@@ -0,0 +1,229 @@
+"""Parquet dataset store for the price tables.
+
+Each table is written as a hive partitioned dataset, one file per
+ticker_id and year:
+    <PRICE_STORE_PATH>/<table>/ticker_id=<id>/year=<yyyy>/part-0.parquet
+
+Reads go through pyarrow.dataset so ticker and year filters prune whole
+partitions and the date filter is pushed down to the row groups.
+The sqlite db remains the source of truth, the store is brought up to date
+with sync_from_db from the changes logged in price_changes.
+"""
+import os
+import json
+import shutil
+import logging
+import datetime as dt
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from tqdm import tqdm
+
+from sqlalchemy import func, select
+
+from stock_trading_ml_modelling.config import PRICE_STORE_PATH
+from stock_trading_ml_modelling.database.models import Session as session
+from stock_trading_ml_modelling.database.models.prices import PriceChange
+from stock_trading_ml_modelling.database.models.types import date_to_db, db_to_datetime64
+from stock_trading_ml_modelling.database.changes_data import _pending_changes, _ack_changes
+
+PARTITION_COLS = ["ticker_id","year"]
+DATE_COLS = ["date","week_start_date"]
+#The price_changes consumer the store is synced as
+PARQUET_CONSUMER = "parquet"
+
+class ParquetPriceStore:
+    def __init__(self, table, path=PRICE_STORE_PATH):
+        """
+        args:
+        ----
+        table - str - the name of the price table, eg "daily_price"
+        path - str:PRICE_STORE_PATH - the root folder of the store
+        """
+        self.table = table
+        self.path = os.path.join(path, table)
+        self.state_path = os.path.join(self.path, "_sync_state.json")
+
+    def _partition_file(self, ticker_id, year):
+        return os.path.join(self.path, f"ticker_id={int(ticker_id)}", f"year={int(year)}", "part-0.parquet")
+
+    def _write_partition(self, df, ticker_id, year):
+        """Write a partition to a temp file and swap it in"""
+        fp = self._partition_file(ticker_id, year)
+        os.makedirs(os.path.dirname(fp), exist_ok=True)
+        df = df.drop(columns=[c for c in PARTITION_COLS if c in df.columns]) \
+            .sort_values("date") \
+            .reset_index(drop=True)
+        for c in [c for c in DATE_COLS if c in df.columns]:
+            df[c] = pd.to_datetime(df[c]).dt.date
+        pq.write_table(pa.Table.from_pandas(df, preserve_index=False), fp + ".tmp")
+        os.replace(fp + ".tmp", fp)
+
+    def _read_partition(self, ticker_id, year):
+        fp = self._partition_file(ticker_id, year)
+        if not os.path.isfile(fp):
+            return None
+        df = pq.read_table(fp).to_pandas()
+        df["ticker_id"] = int(ticker_id)
+        return df
+
+    def add_df(self, df, replace=False):
+        """Function to add prices to the store. Rows are merged into the
+        (ticker_id, year) partitions they fall in, matching (ticker_id, date)
+        rows are overwritten.
+
+        args:
+        ----
+        df - pandas dataframe - prices including ticker_id and date
+        replace - bool:False - replace the touched partitions rather than merging
+
+        returns:
+        ----
+        int - the number of partitions written
+        """
+        if not df.shape[0]:
+            return 0
+        df = df.copy()
+        df["year"] = pd.to_datetime(df.date).dt.year
+        count = 0
+        for (ticker_id, year), part_df in df.groupby(PARTITION_COLS):
+            if not replace:
+                old_df = self._read_partition(ticker_id, year)
+                if old_df is not None:
+                    part_df = pd.concat([old_df, part_df.drop(columns=["year"])], ignore_index=True)
+                    part_df["date"] = pd.to_datetime(part_df.date).dt.date
+                    part_df = part_df.drop_duplicates(subset=["date"], keep="last")
+            self._write_partition(part_df, ticker_id, year)
+            count += 1
+        return count
+
+    def fetch_df(self, ticker_ids=[], from_date=None, to_date=None, columns=None, ordered=True):
+        """Function to read prices from the store.
+
+        args:
+        ----
+        ticker_ids - list:[] - the ids of the records to be extracted
+        from_date - datetime:None - the min date for filtering records
+        to_date - datetime:None - the max date for filtering records
+        columns - list:None - the columns to read (all if None)
+        ordered - bool:True - order the records by ticker_id then date
+
+        returns:
+        ----
+        pandas dataframe
+        """
+        if not os.path.isdir(self.path):
+            return pd.DataFrame([], columns=columns)
+        dataset = ds.dataset(self.path, format="parquet", partitioning="hive")
+        filters = []
+        if len(ticker_ids):
+            filters.append(ds.field("ticker_id").isin([int(v) for v in ticker_ids]))
+        if from_date:
+            from_date = pd.Timestamp(from_date).date()
+            filters.append(ds.field("year") >= from_date.year)
+            filters.append(ds.field("date") >= pa.scalar(from_date, pa.date32()))
+        if to_date:
+            to_date = pd.Timestamp(to_date).date()
+            filters.append(ds.field("year") <= to_date.year)
+            filters.append(ds.field("date") <= pa.scalar(to_date, pa.date32()))
+        filt = None
+        for f in filters:
+            filt = f if filt is None else filt & f
+        df = dataset.to_table(filter=filt).to_pandas()
+        df = df.drop(columns=["year"])
+        if ordered:
+            df = df.sort_values(["ticker_id","date"]) \
+                .reset_index(drop=True)
+        if columns is not None:
+            df = df[columns]
+        return df
+
+    def load_state(self):
+        if not os.path.isfile(self.state_path):
+            return {}
+        with open(self.state_path, "r") as f:
+            return json.loads(f.read())
+
+    def save_state(self, state):
+        os.makedirs(self.path, exist_ok=True)
+        with open(self.state_path, "w+") as f:
+            f.write(json.dumps(state))
+
+    def _remove_partition(self, ticker_id, year):
+        """Delete a partition whose rows have all been removed from the db"""
+        fp = self._partition_file(ticker_id, year)
+        if not os.path.isfile(fp):
+            return False
+        os.remove(fp)
+        for d in [os.path.dirname(fp), os.path.dirname(os.path.dirname(fp))]:
+            if not os.listdir(d):
+                os.rmdir(d)
+        return True
+
+    def _read_db(self, tab_name, ticker_id, from_year=None, to_year=None, session=session):
+        """Read the prices of a ticker from the db, optionally for a span of years"""
+        sql = f"SELECT * FROM {tab_name} WHERE ticker_id = ?"
+        params = [int(ticker_id)]
+        if from_year is not None:
+            sql += " AND date >= ? AND date < ?"
+            params += [date_to_db(dt.date(int(from_year), 1, 1)), date_to_db(dt.date(int(to_year) + 1, 1, 1))]
+        prices = pd.read_sql(sql, con=session.bind, params=tuple(params))
+        for c in [c for c in DATE_COLS if c in prices.columns]:
+            prices[c] = db_to_datetime64(prices[c].values)
+        return prices
+
+    def sync_from_db(self, DestClass, session=session, full=False):
+        """Function to export prices from the sqlite db into the store.
+
+        Incremental syncs are driven by the price_changes journal, read as the
+        PARQUET_CONSUMER consumer. Every (ticker_id, year) partition within 
+        the date range logged for a ticker is re-read from the db, so rows 
+        added, updated or deleted all reach the store, and partitions left 
+        without rows are deleted. A store never synced from the journal is 
+        rebuilt in full.
+
+        args:
+        ----
+        DestClass - sqla table class - the class of the table to export
+        session - sqla session:None - the db session object
+        full - bool:False - rewrite every partition
+
+        returns:
+        ----
+        int - the number of partitions written or deleted
+        """
+        tab_name = DestClass.__table__.name
+        state = self.load_state()
+        full = full or "change_id" not in state
+        count = 0
+        if full:
+            #Changes logged from here on are picked up by the next sync
+            change_id = session.execute(
+                select(func.max(PriceChange.id)).where(PriceChange.table_name == tab_name)
+                ).scalar() or 0
+            if os.path.isdir(self.path):
+                shutil.rmtree(self.path)
+            ticker_ids = pd.read_sql(
+                f"SELECT DISTINCT ticker_id FROM {tab_name} WHERE ticker_id IS NOT NULL", con=session.bind
+                ).ticker_id
+            logging.info(f"Exporting {ticker_ids.shape[0]} tickers from {tab_name} to {self.path}")
+            for ticker_id in tqdm(ticker_ids, desc=f"Export {tab_name}"):
+                count += self.add_df(self._read_db(tab_name, ticker_id, session=session), replace=True)
+        else:
+            changes = _pending_changes(PARQUET_CONSUMER, tab_name, session=session)
+            change_id = int(changes.change_id.max()) if changes.shape[0] else state["change_id"]
+            logging.info(f"Syncing {changes.shape[0]} changed tickers from {tab_name} to {self.path}")
+            for _,r in tqdm(changes.iterrows(), total=changes.shape[0], desc=f"Sync {tab_name}"):
+                from_year, to_year = pd.Timestamp(r.min_date).year, pd.Timestamp(r.max_date).year
+                prices = self._read_db(tab_name, r.ticker_id, from_year, to_year, session=session)
+                count += self.add_df(prices, replace=True)
+                #Years in the range with nothing left in the db
+                held = set(pd.to_datetime(prices.date).dt.year)
+                for year in range(from_year, to_year + 1):
+                    if year not in held:
+                        count += self._remove_partition(r.ticker_id, year)
+        _ack_changes(PARQUET_CONSUMER, tab_name, change_id, session=session)
+        self.save_state({"change_id":int(change_id)})
+        logging.info(f"Wrote {count} partitions for {tab_name}")
+        return count
@@ -0,0 +1,282 @@
+"""Shared in memory panel of the prices of every ticker.
+
+The panel holds each field as one contiguous numpy array across all
+tickers, ordered by ticker_id then date, with an offsets index so the rows
+of tickers[i] are offsets[i]:offsets[i+1]. It is loaded from the db once per
+process with get_price_panel and shared by every step of a run. Readers
+such as get_prices only use it when price_panel.enabled is set, when asked
+to, or once something else has loaded it.
+
+Before each read the panel checks PRAGMA data_version on its own connection,
+which changes whenever another connection commits. Only the tickers logged
+in price_changes since the panel was loaded are then re-read and spliced in.
+"""
+import logging
+import threading
+import numpy as np
+import pandas as pd
+
+from stock_trading_ml_modelling.config import PRICE_PANEL_DTYPE
+from stock_trading_ml_modelling.database.models import Session as session
+from stock_trading_ml_modelling.database.models.prices import DailyPrice, WeeklyPrice
+from stock_trading_ml_modelling.database.get_data import _fetch_price_arrays, PRICE_FIELDS
+
+class PricePanel:
+    def __init__(self, DestClass=DailyPrice, dtype=PRICE_PANEL_DTYPE, fields=PRICE_FIELDS, session=session):
+        """
+        args:
+        ----
+        DestClass - sqla table class:DailyPrice - the price table to hold
+        dtype - str:PRICE_PANEL_DTYPE - the dtype of the price fields
+        fields - list:PRICE_FIELDS - the price fields to hold
+        session - sqla session:None - the db session object
+        """
+        self.DestClass = DestClass
+        self.table = DestClass.__table__.name
+        self.dtype = dtype
+        self.fields = list(fields)
+        self.session = session
+        self.arrays = None
+        self.data_version = None
+        self.change_id = 0
+        self.refreshes = 0
+        self._conn = None
+        self._lock = threading.RLock()
+
+    def _execute(self, sql, params=()):
+        #The panel keeps its own connection, data_version only changes for
+        #commits made by other connections
+        if self._conn is None:
+            self._conn = self.session.bind.raw_connection()
+        cursor = self._conn.cursor()
+        try:
+            return cursor.execute(sql, params).fetchall()
+        finally:
+            cursor.close()
+
+    def _db_state(self):
+        """Function to get the data_version and the latest change logged for
+        the table"""
+        version = self._execute("PRAGMA data_version")[0][0]
+        change_id = self._execute(
+            "SELECT MAX(id) FROM price_changes WHERE table_name = ?", (self.table,)
+            )[0][0]
+        return version, change_id or 0
+
+    def _fetch(self, ticker_ids=[]):
+        return _fetch_price_arrays(self.DestClass, ticker_ids=ticker_ids, dtype=self.dtype,
+            fields=self.fields, session=self.session, ids=True)
+
+    def _index(self, arrays):
+        """Function to set the ticker offsets of a set of arrays"""
+        n_rows = arrays["ticker_id"].shape[0]
+        bounds = np.flatnonzero(np.diff(arrays["ticker_id"])) + 1
+        arrays["offsets"] = np.concatenate([[0], bounds, [n_rows]]).astype("int64") \
+            if n_rows else np.zeros(1, dtype="int64")
+        arrays["tickers"] = arrays["ticker_id"][arrays["offsets"][:-1]]
+        arrays["_pos"] = {int(t):i for i,t in enumerate(arrays["tickers"])}
+        return arrays
+
+    def load(self):
+        """Function to read every ticker from the db"""
+        with self._lock:
+            #Read the state first so anything committed during the read is
+            #picked up by the next refresh
+            self.data_version, self.change_id = self._db_state()
+            self.arrays = self._index(self._fetch())
+            logging.info(f"Loaded price panel for {self.table}, {self.arrays['ticker_id'].shape[0]} rows")
+        return self
+
+    def refresh(self):
+        """Function to bring the panel up to date if the db has changed since
+        it was loaded. Tickers with logged changes are re-read, the panel is
+        reloaded in full if changes it has not seen may have been pruned.
+
+        returns:
+        ----
+        bool - True if the panel changed
+        """
+        with self._lock:
+            if self.arrays is None:
+                self.load()
+                return True
+            version, change_id = self._db_state()
+            if version == self.data_version:
+                return False
+            self.data_version = version
+            if change_id == self.change_id:
+                #Writes to other tables
+                return False
+            #Pruning deletes the oldest changes of a table, the unseen ones
+            #are all still logged if the first left follows the panel's. Ids
+            #only increase but are shared with other tables, so a gap may 
+            #not be a prune and the panel is then reloaded to be safe.
+            first_id = self._execute(
+                "SELECT MIN(id) FROM price_changes WHERE table_name = ?", (self.table,)
+                )[0][0]
+            if change_id < self.change_id or first_id is None or first_id > self.change_id + 1:
+                self.load()
+                self.refreshes += 1
+                return True
+            touched = [r[0] for r in self._execute(
+                "SELECT DISTINCT ticker_id FROM price_changes WHERE table_name = ? AND id > ? AND id <= ?",
+                (self.table, self.change_id, change_id)
+                )]
+            self.change_id = change_id
+            self._splice(touched)
+            self.refreshes += 1
+            logging.info(f"Refreshed {len(touched)} tickers in price panel for {self.table}")
+            return True
+
+    def _splice(self, ticker_ids):
+        """Function to replace the rows of some tickers with fresh reads"""
+        new = self._fetch(ticker_ids)
+        keep = ~np.isin(self.arrays["ticker_id"], np.asarray(ticker_ids, dtype="int32"))
+        cols = ["id","ticker_id","date"] + self.fields
+        merged = {c:np.concatenate([self.arrays[c][keep], new[c]]) for c in cols}
+        #Each ticker's rows come from one side, already in date order
+        order = np.argsort(merged["ticker_id"], kind="stable")
+        self.arrays = self._index({c:v[order] for c,v in merged.items()})
+
+    def _current(self, refresh):
+        if refresh or self.arrays is None:
+            self.refresh()
+        return self.arrays
+
+    @property
+    def tickers(self):
+        return self._current(True)["tickers"]
+
+    def ticker(self, ticker_id, from_date=None, to_date=None, fields=None, refresh=True):
+        """Function to get the history of a ticker as views onto the panel
+
+        args:
+        ----
+        ticker_id - int - the ticker to fetch
+        from_date - datetime:None - the min date for filtering records
+        to_date - datetime:None - the max date for filtering records
+        fields - list:None - the fields to fetch, id, date and all price fields if None
+        refresh - bool:True - check the db for changes first
+
+        returns:
+        ----
+        dict - field name to array ordered by date, empty arrays for an
+            unknown ticker
+        """
+        arrays = self._current(refresh)
+        i = arrays["_pos"].get(int(ticker_id))
+        st, en = (0, 0) if i is None else (int(arrays["offsets"][i]), int(arrays["offsets"][i + 1]))
+        if i is not None and (from_date or to_date):
+            dates = arrays["date"][st:en]
+            if from_date:
+                st += int(np.searchsorted(dates, np.datetime64(pd.Timestamp(from_date).date(), "D"), side="left"))
+            if to_date:
+                en = st + int(np.searchsorted(arrays["date"][st:en], np.datetime64(pd.Timestamp(to_date).date(), "D"), side="right"))
+        fields = ["id","date"] + self.fields if fields is None else fields
+        return {c:arrays[c][st:en] for c in fields}
+
+    def window(self, ticker_id, n, to_date=None, fields=None, refresh=True):
+        """Function to get the latest n rows of a ticker, on or before to_date
+
+        returns:
+        ----
+        dict - field name to array of at most n rows ordered by date
+        """
+        prices = self.ticker(ticker_id, to_date=to_date, fields=fields, refresh=refresh)
+        return {c:v[-int(n):] if n else v[:0] for c,v in prices.items()}
+
+    def asof(self, date, ticker_ids=[], refresh=True):
+        """Function to get the latest prices of each ticker on or before date
+
+        args:
+        ----
+        date - datetime - the date to look up
+        ticker_ids - list:[] - the tickers to include (all if empty)
+        refresh - bool:True - check the db for changes first
+
+        returns:
+        ----
+        pandas dataframe - one row per ticker with prices on or before date
+        """
+        arrays = self._current(refresh)
+        date = np.datetime64(pd.Timestamp(date).date(), "D")
+        tickers = arrays["tickers"] if not len(ticker_ids) else [t for t in ticker_ids if int(t) in arrays["_pos"]]
+        rows = []
+        for t in tickers:
+            i = arrays["_pos"][int(t)]
+            st, en = int(arrays["offsets"][i]), int(arrays["offsets"][i + 1])
+            pos = st + int(np.searchsorted(arrays["date"][st:en], date, side="right")) - 1
+            if pos >= st:
+                rows.append(pos)
+        rows = np.asarray(rows, dtype="int64")
+        return pd.DataFrame({c:arrays[c][rows] for c in ["id","ticker_id","date"] + self.fields})
+
+    def to_df(self, ticker_ids=[], from_date=None, to_date=None, last_n=None, refresh=True):
+        """Function to copy part of the panel into a dataframe ordered by
+        ticker_id then date, in the form returned by fetch_df
+
+        returns:
+        ----
+        pandas dataframe
+        """
+        arrays = self._current(refresh)
+        ticker_ids = arrays["tickers"] if not len(ticker_ids) else ticker_ids
+        parts = []
+        for t in ticker_ids:
+            prices = self.ticker(t, from_date=from_date, to_date=to_date, refresh=False)
+            if last_n:
+                prices = {c:v[-int(last_n):] for c,v in prices.items()}
+            if prices["date"].shape[0]:
+                parts.append(pd.DataFrame(prices).assign(ticker_id=int(t)))
+        if not len(parts):
+            return pd.DataFrame([], columns=["id","date"] + self.fields + ["ticker_id"])
+        df = pd.concat(parts, ignore_index=True)
+        df["date"] = df.date.dt.date
+        return df
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+            self.arrays = None
+            self.data_version = None
+
+#The panels shared by the process, one per table
+_panels = {}
+_panels_lock = threading.Lock()
+
+def get_price_panel(table="daily_price"):
+    """Function to get the process wide panel of a price table, loading it on
+    first use
+
+    args:
+    ----
+    table - str:"daily_price" - "daily_price" or "weekly_price"
+
+    returns:
+    ----
+    PricePanel
+    """
+    with _panels_lock:
+        if table not in _panels:
+            DestClass = {c.__table__.name:c for c in [DailyPrice, WeeklyPrice]}[table]
+            _panels[table] = PricePanel(DestClass)
+        return _panels[table]
+
+def price_panel_loaded(table="daily_price"):
+    """Function to check if the process wide panel of a price table has 
+    already been loaded
+
+    returns:
+    ----
+    bool
+    """
+    with _panels_lock:
+        return table in _panels and _panels[table].arrays is not None
+
+def close_price_panels():
+    with _panels_lock:
+        for panel in _panels.values():
+            panel.close()
+        _panels.clear()
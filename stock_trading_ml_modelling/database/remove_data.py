@@ -0,0 +1,57 @@
+"""Functions for removing data from the prices database"""
+from sqlalchemy import text, select, literal_column
+
+from stock_trading_ml_modelling.database.models import Session as session
+from stock_trading_ml_modelling.database.latest_data import _refresh_latest
+from stock_trading_ml_modelling.database.changes_data import _log_changes_where
+
+def _duplicates_sql(tab_name):
+    """Function to build the query selecting the ids of duplicated prices.
+    Rows are ranked within each (ticker_id, date) by highest volume, then
+    newest id, and every row after the first is a duplicate."""
+    return f"""
+        SELECT id, ticker_id FROM (
+            SELECT id, ticker_id, ROW_NUMBER() OVER (
+                PARTITION BY ticker_id, date
+                ORDER BY volume DESC, id DESC
+            ) AS rn
+            FROM {tab_name}
+            WHERE ticker_id IS NOT NULL
+        )
+        WHERE rn > 1
+    """
+
+def _remove_duplicates(DestClass, dry_run=False, session=session):
+    """Function to delete duplicated prices from a table in one statement,
+    keeping the most recent (found by highest volume) for each ticker and date.
+
+    args:
+    ----
+    DestClass - sqla table class - DailyPrice or WeeklyPrice
+    dry_run - bool:False - only count the duplicates, nothing is deleted
+    session - sqla session:None - the db session object
+
+    returns:
+    ----
+    dict -
+        duplicates - the number of rows found to delete
+        tickers - the number of tickers they belong to
+        deleted - the number of rows deleted, 0 on a dry run
+    """
+    dup_sql = _duplicates_sql(DestClass.__table__.name)
+    counts = session.execute(text(
+        f"SELECT COUNT(*), COUNT(DISTINCT ticker_id) FROM ({dup_sql})"
+        )).one()
+    out = {"duplicates":counts[0], "tickers":counts[1], "deleted":0}
+    if dry_run or not out["duplicates"]:
+        return out
+    touched = [r[0] for r in session.execute(text(f"SELECT DISTINCT ticker_id FROM ({dup_sql})"))]
+    dup_ids = select(literal_column("id")).select_from(text(f"({dup_sql}) AS dup"))
+    _log_changes_where(DestClass, DestClass.id.in_(dup_ids), session=session)
+    result = session.execute(text(
+        f"DELETE FROM {DestClass.__table__.name} WHERE id IN (SELECT id FROM ({dup_sql}))"
+        ))
+    out["deleted"] = result.rowcount
+    _refresh_latest(DestClass, touched, session=session)
+    session.commit()
+    return out
@@ -1,18 +1,101 @@
 """Functions for updating data in the prices database"""
 import re
+from sqlalchemy import Table, Column, MetaData, update, select, and_
 
+from stock_trading_ml_modelling.config import DB_BULK_INSERT, DB_CHUNK_SIZE
 from stock_trading_ml_modelling.utils.data import overlap
 
 from stock_trading_ml_modelling.database.models import Session as session
 from stock_trading_ml_modelling.database.models.prices import Ticker, TickerMarket, DailyPrice, WeeklyPrice
 
-def _update_df(df, DestClass, session=session):
-    """Function for updating records from a dataframe"""
+#UPDATE ... FROM was added to sqlite in 3.33.0
+UPDATE_FROM_MIN_VERSION = (3, 33, 0)
+
+def _update_df(df, DestClass, session=session, bulk=DB_BULK_INSERT, chunk_size=DB_CHUNK_SIZE, commit=True):
+    """Function for updating records from a dataframe, matched on the primary
+    key.
+
+    args:
+    ----
+    df - pandas dataframe - the records to be updated, must include the primary key
+    DestClass - sqla table class - the class of the table to update
+    session - sqla session:None - the db session object
+    bulk - bool:DB_BULK_INSERT - update through a temp table join rather than
+        one statement per row
+    chunk_size - int:DB_CHUNK_SIZE - the number of rows sent in each executemany
+    commit - bool:True - commit the session once the rows are updated
+
+    returns:
+    ----
+    int - the number of rows updated
+    """
     #Get table columns
     tab_cols = DestClass.__table__.columns
     #Remove table name prefix
     tab_name = DestClass.__table__.name
     tab_cols = [re.sub(fr"^{tab_name}\.", "", str(c)) for c in tab_cols]
     cols = overlap([tab_cols, df.columns])
-    session.bulk_update_mappings(DestClass, df[cols].to_dict(orient="records"))
-    session.commit()
+    if bulk:
+        count = _bulk_update_df(df[cols], DestClass, session=session, chunk_size=chunk_size)
+    else:
+        session.bulk_update_mappings(DestClass, df[cols].to_dict(orient="records"))
+        count = df.shape[0]
+    if commit:
+        session.commit()
+    return count
+
+def _bulk_update_df(df, DestClass, session=session, chunk_size=DB_CHUNK_SIZE, update_from=None):
+    """Function to update records from a dataframe with a single statement. 
+    The rows are loaded into a temp table with chunked executemany calls and
+    joined to the table on the primary key with UPDATE ... FROM, or with
+    correlated subqueries on sqlite older than 3.33. Does not commit.
+
+    args:
+    ----
+    df - pandas dataframe - the records to be updated, columns must match the table
+    DestClass - sqla table class - the class of the table to update
+    session - sqla session:None - the db session object
+    chunk_size - int:DB_CHUNK_SIZE - the number of rows sent in each executemany
+    update_from - bool:None - use UPDATE ... FROM, found from the sqlite 
+        version if None
+
+    returns:
+    ----
+    int - the number of rows updated
+    """
+    if not df.shape[0]:
+        return 0
+    table = DestClass.__table__
+    key = [c.name for c in table.primary_key.columns]
+    if not set(key).issubset(df.columns):
+        raise ValueError(f"Updating {table.name} needs the primary key columns {key}")
+    set_cols = [c for c in df.columns if c not in key]
+    if not len(set_cols):
+        return 0
+    #Temp tables belong to the connection so stay on the session's one
+    conn = session.connection()
+    if update_from is None:
+        update_from = conn.dialect.dbapi.sqlite_version_info >= UPDATE_FROM_MIN_VERSION
+    tmp = Table(
+        f"tmp_update_{table.name}",
+        MetaData(),
+        *[Column(c, table.c[c].type, primary_key=c in key) for c in df.columns],
+        prefixes=["TEMPORARY"]
+        )
+    tmp.drop(conn, checkfirst=True)
+    tmp.create(conn)
+    try:
+        chunk_size = max(int(chunk_size), 1)
+        for st in range(0, df.shape[0], chunk_size):
+            conn.execute(tmp.insert(), df.iloc[st:st + chunk_size].to_dict(orient="records"))
+        match = and_(*[table.c[k] == tmp.c[k] for k in key])
+        if update_from:
+            stmt = update(table).values({c:tmp.c[c] for c in set_cols}).where(match)
+        else:
+            stmt = update(table) \
+                .values({c:select(tmp.c[c]).where(match).scalar_subquery() for c in set_cols}) \
+                .where(select(tmp).where(match).exists())
+        result = conn.execute(stmt)
+    finally:
+        tmp.drop(conn)
+    return result.rowcount
@@ -0,0 +1,53 @@
+"""Functions for upserting data in the prices database"""
+import re
+from sqlalchemy.dialects.sqlite import insert
+
+from stock_trading_ml_modelling.config import DB_CHUNK_SIZE
+from stock_trading_ml_modelling.utils.data import overlap
+
+from stock_trading_ml_modelling.database.models import Session as session
+
+def _upsert_df(df, DestClass, index_elements, session=session, chunk_size=DB_CHUNK_SIZE, commit=True):
+    """Generic function for inserting or updating records from a dataframe in a
+    single statement batch using INSERT ... ON CONFLICT DO UPDATE.
+
+    Rows which clash with an existing record on index_elements update that
+    record in place, all others are inserted. The table must have a unique
+    index on index_elements.
+
+    args:
+    ----
+    df - pandas dataframe - the records to be upserted
+    DestClass - sqla table class - the class of the receiving table
+    index_elements - list - the columns making up the conflict target
+    session - sqla session:None - the db session object
+    chunk_size - int:DB_CHUNK_SIZE - the number of rows sent in each executemany
+    commit - bool:True - commit the session once the rows are sent
+
+    returns:
+    ----
+    int - the number of rows sent to the database
+    """
+    if not df.shape[0]:
+        return 0
+    #Get table columns
+    tab_cols = DestClass.__table__.columns
+    #Remove table name prefix
+    tab_name = DestClass.__table__.name
+    tab_cols = [re.sub(fr"^{tab_name}\.", "", str(c)) for c in tab_cols]
+    #The primary key is left to the database
+    cols = [c for c in overlap([tab_cols, df.columns]) if c != "id"]
+    df = df[cols]
+    #Build the statement
+    stmt = insert(DestClass.__table__)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=index_elements,
+        set_={c:stmt.excluded[c] for c in cols if c not in index_elements}
+    )
+    chunk_size = max(int(chunk_size), 1)
+    for st in range(0, df.shape[0], chunk_size):
+        records = df.iloc[st:st + chunk_size].to_dict(orient="records")
+        session.execute(stmt, records)
+    if commit:
+        session.commit()
+    return df.shape[0]
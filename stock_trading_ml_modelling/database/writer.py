@@ -0,0 +1,186 @@
+"""Background writer which batches price upserts into large transactions"""
+import time
+import queue
+import atexit
+import logging
+import threading
+import pandas as pd
+
+from stock_trading_ml_modelling.config import DB_WRITER_MAX_ROWS, DB_WRITER_MAX_SECONDS, DB_WRITER_MAX_QUEUE
+from stock_trading_ml_modelling.database.models import Session
+
+_STOP = object()
+
+def _ticker_ids(df):
+    if "ticker_id" not in getattr(df, "columns", []):
+        return []
+    return sorted({int(v) for v in df.ticker_id.dropna()})
+
+def _split_tickers(batch):
+    """Split the queued dataframes into one dataframe per ticker"""
+    for df in batch:
+        if "ticker_id" in getattr(df, "columns", []):
+            for _, part in df.groupby("ticker_id", dropna=False):
+                yield part
+        else:
+            yield df
+
+class PriceWriter:
+    def __init__(self,
+        price_cl,
+        max_rows=DB_WRITER_MAX_ROWS,
+        max_seconds=DB_WRITER_MAX_SECONDS,
+        max_queue=DB_WRITER_MAX_QUEUE,
+        session=Session
+        ):
+        """Writer thread for a price table. Dataframes put on the queue are
+        coalesced and upserted together once max_rows rows are waiting or the
+        oldest has waited max_seconds. put blocks while max_queue dataframes
+        are waiting so scrapers cannot run far ahead of the disk.
+
+        Use as a context manager, everything queued is written before the
+        block exits. Writers left open are flushed when the interpreter exits.
+
+        A batch which fails is retried one ticker at a time so a bad dataframe
+        only loses its own tickers, errors name the ticker_ids not written.
+
+        args:
+        ----
+        price_cl - DailyPriceCl or WeeklyPriceCl - the class used to upsert
+        max_rows - int:DB_WRITER_MAX_ROWS - the rows which trigger a write
+        max_seconds - float:DB_WRITER_MAX_SECONDS - the max time rows wait before a write
+        max_queue - int:DB_WRITER_MAX_QUEUE - the number of waiting dataframes before put blocks
+        session - sqla scoped session:Session - the session used by the writer thread
+        """
+        self.price_cl = price_cl
+        self.max_rows = max_rows
+        self.max_seconds = max_seconds
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.session = session
+        self.thread = None
+        self.failure = None
+        self.errors = []
+        self.rows_written = 0
+        self.batches = 0
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._run, name="PriceWriter", daemon=True)
+            self.thread.start()
+            atexit.register(self.close)
+        return self
+
+    def _put(self, item):
+        """Queue an item, blocking while the queue is full but failing if the
+        writer thread has died rather than waiting forever"""
+        while True:
+            if not self.thread.is_alive():
+                raise RuntimeError("PriceWriter thread has stopped") from self.failure
+            try:
+                self.queue.put(item, timeout=1)
+                return
+            except queue.Full:
+                continue
+
+    def put(self, df):
+        """Function to queue a dataframe for upserting, blocks while the queue
+        is full"""
+        if self.thread is None:
+            raise RuntimeError("PriceWriter has not been started")
+        if df is not None and df.shape[0]:
+            self._put(df)
+
+    def close(self):
+        """Function to write everything queued and stop the thread
+
+        returns:
+        ----
+        dict - rows_written, batches and errors
+        """
+        if self.thread is not None:
+            try:
+                self._put(_STOP)
+            except RuntimeError:
+                #Nothing left to stop, the failure is in errors
+                pass
+            self.thread.join()
+            self.thread = None
+            atexit.unregister(self.close)
+        return self.stats()
+
+    def stats(self):
+        return {"rows_written":self.rows_written, "batches":self.batches, "errors":len(self.errors)}
+
+    def ticker_errors(self, tickers={}):
+        """Function to list the tickers not written, one record per ticker
+
+        args:
+        ----
+        tickers - dict:{} - ticker_id to ticker, used to name the tickers
+
+        returns:
+        ----
+        list of dicts - ticker_id, ticker and error
+        """
+        return [{'ticker_id':ticker_id, 'ticker':tickers.get(ticker_id, 'WRITER'), "error":e["error"]}
+            for e in self.errors for ticker_id in (e["ticker_ids"] or [None])]
+
+    def _write(self, batch):
+        if not len(batch):
+            return
+        try:
+            df = pd.concat(batch, ignore_index=True)
+            self.rows_written += self.price_cl.upsert_df(df, session=self.session)
+            self.batches += 1
+            return
+        except Exception as e:
+            self.session.rollback()
+            logging.error(f"PriceWriter failed to write a batch of {sum(len(b) for b in batch)} rows, retrying by ticker -> {e}")
+        #Retry each ticker alone so one bad dataframe cannot sink the others
+        for part in _split_tickers(batch):
+            try:
+                self.rows_written += self.price_cl.upsert_df(part, session=self.session)
+            except Exception as e:
+                #Keep writing later batches, the caller reads errors once closed
+                self.session.rollback()
+                ticker_ids = _ticker_ids(part)
+                logging.error(f"PriceWriter failed to write {part.shape[0]} rows for tickers {ticker_ids} -> {e}")
+                self.errors.append({"ticker_ids":ticker_ids, "rows":part.shape[0], "error":e})
+        self.batches += 1
+
+    def _run(self):
+        batch = []
+        batch_rows = 0
+        batch_st = None
+        try:
+            while True:
+                timeout = None if batch_st is None else max(batch_st + self.max_seconds - time.monotonic(), 0)
+                try:
+                    item = self.queue.get(timeout=timeout)
+                except queue.Empty:
+                    item = None
+                if item is _STOP:
+                    break
+                if item is not None:
+                    batch.append(item)
+                    batch_rows += item.shape[0]
+                    batch_st = batch_st or time.monotonic()
+                if batch_rows >= self.max_rows \
+                    or (batch_st is not None and time.monotonic() - batch_st >= self.max_seconds):
+                    self._write(batch)
+                    batch, batch_rows, batch_st = [], 0, None
+            self._write(batch)
+        except Exception as e:
+            #put and close check for a dead thread so callers do not hang
+            self.failure = e
+            logging.error(f"PriceWriter stopped -> {e}")
+            self.errors.append({"ticker_ids":[], "rows":batch_rows, "error":e})
+        finally:
+            #The session belongs to this thread
+            self.session.remove()
@@ -5,11 +5,14 @@ from pathlib import Path
 from stock_trading_ml_modelling.database.models import engine
 from stock_trading_ml_modelling.database.models import Session as session
 from stock_trading_ml_modelling.database.models.prices import create_db
+from stock_trading_ml_modelling.database.array_store import refresh_price_arrays
 from stock_trading_ml_modelling.scrapping import full_scrape
+from stock_trading_ml_modelling.scrapping.database import prepare_db
 from stock_trading_ml_modelling.utils.log import logger
 from stock_trading_ml_modelling.libs.stock_filtering import filter_stocks
 from stock_trading_ml_modelling.manage_data import remove_duplicate_daily_prices, \
-    remove_duplicate_weekly_prices, fill_price_gaps
+    remove_duplicate_weekly_prices, fill_price_gaps, migrate_price_indexes, sync_price_store, \
+    rebuild_ticker_latest, migrate_price_dates
 
 from stock_trading_ml_modelling.config import CONFIG
 
@@ -20,12 +23,32 @@ def run_full_scrape():
     logger.set_logger("_run_full_scrape")
     full_scrape()
 
-def remove_duplicate_prices():
+def remove_duplicate_prices(dry_run=False):
     logger.set_logger("_remove_duplicate_prices")
     #Remove daily price duplicates
-    remove_duplicate_daily_prices()
+    remove_duplicate_daily_prices(dry_run=dry_run)
     #Remove weekly price duplicates
-    remove_duplicate_weekly_prices()
+    remove_duplicate_weekly_prices(dry_run=dry_run)
+
+def migrate_database():
+    logger.set_logger("_migrate_database")
+    migrate_price_indexes()
+
+def convert_price_dates():
+    logger.set_logger("_convert_price_dates")
+    migrate_price_dates()
+
+def rebuild_latest_prices():
+    logger.set_logger("_rebuild_latest_prices")
+    rebuild_ticker_latest()
+
+def sync_parquet_store(full=False):
+    logger.set_logger("_sync_parquet_store")
+    sync_price_store(full=full)
+
+def build_price_arrays():
+    logger.set_logger("_build_price_arrays")
+    logger.info(refresh_price_arrays())
 
 def fill_all_price_gaps():
     logger.set_logger("_fill_price_gaps")
@@ -33,14 +56,18 @@ def fill_all_price_gaps():
 
 def find_buys():
     logger.set_logger("_find_buys")
+    #The price panel reads price_changes
+    prepare_db()
     buy_df = filter_stocks()
     today_str = dt.datetime.strftime(dt.datetime.today(), "%Y%m%d")
     buy_df.to_csv(Path(f"out/buys{today_str}.csv"), index=None)
 
 if __name__ == "__main__":
     # create_database()
+    # migrate_database()
     # remove_duplicate_prices()
     run_full_scrape()
+    # sync_parquet_store()
     # fill_all_price_gaps()
     find_buys()
     exit()
@@ -5,8 +5,8 @@ import pandas as pd
 from stock_trading_ml_modelling.utils.date import create_full_year_days, calc_wk_st_date
 from stock_trading_ml_modelling.utils.log import logger
 from stock_trading_ml_modelling.scrapping.scrape_data import get_public_holidays
-from stock_trading_ml_modelling.database.get_data import sqlaq_to_df
-from stock_trading_ml_modelling.database import daily_price, weekly_price
+from stock_trading_ml_modelling.utils.data import row_fingerprints
+from stock_trading_ml_modelling.database.get_data import PRICE_FIELDS
 
 def filter_year_dates(year, year_dates):
     """Function to filter out weekends and bank holidays from year dates
@@ -54,132 +54,91 @@ def create_filtered_year_dates(year, from_date=None, to_date=None):
     return year_dates
 
 #Create a weekly table
-def daily_to_weekly_price_conversion(dp_df):
-    """Function to convert the daily prices into weekly prices
+def aggregate_weekly_prices(dp_df):
+    """Function to aggregate daily prices into weekly prices in a single 
+    groupby over (ticker_id, ISO week).
+
+    Only positive prices and volumes are used, the open is the first open of
+    the week, the close the last close, with high, low and volume the max, 
+    min and sum. Weeks are dated by their monday.
     
     args:
     ------
-    dp_df - pandas dataframe - the daily prices
+    dp_df - pandas dataframe - the daily prices, ticker_id, date and prices
 
     returns:
     ------
-    pandas dataframe
+    pandas dataframe - ticker_id, date, open, high, low, close, change, volume
     """
-    logger.info('Converting daily prices to weekly prices')
-    #Mark the week identifier
-    dp_df['isocalendar'] = [x.isocalendar()[:2] for x in dp_df['date']]
-    #Get highs and lows
-    high_df = dp_df.loc[dp_df['high'] > 0, ['high','ticker_id','isocalendar']] \
-        .groupby(['ticker_id','isocalendar'], as_index=False) \
-        .max()
-    low_df = dp_df.loc[dp_df['low'] > 0, ['low','ticker_id','isocalendar']] \
-        .groupby(['ticker_id','isocalendar'], as_index=False) \
-        .min()
-    #Get total volume for the week
-    vol_df = dp_df.loc[dp_df['volume'] > 0, ['volume','ticker_id','isocalendar']] \
-        .groupby(['ticker_id','isocalendar'], as_index=False) \
-        .sum()
-    #Get max and min week days
-    max_wk_day = dp_df.loc[dp_df['close'] > 0, ['date','ticker_id','isocalendar']] \
-        .groupby(['ticker_id','isocalendar'], as_index=False) \
-        .max()
-    min_wk_day = dp_df.loc[dp_df['open'] > 0, ['date','ticker_id','isocalendar']] \
-        .groupby(['ticker_id','isocalendar'], as_index=False) \
-        .min()
-    #Get open price
-    open_df = pd.merge(dp_df[['date','open']], min_wk_day, on='date')
-    #Get close price
-    close_df = pd.merge(dp_df[['date','close']], max_wk_day, on='date')
-    #Form the final df
-    wp_df = dp_df[['ticker_id','isocalendar']]
-    wp_df = pd.merge(wp_df, min_wk_day, on=['ticker_id','isocalendar'], how="left") #date
-    wp_df = pd.merge(wp_df, high_df, on=['ticker_id','isocalendar'], how="left") #high
-    wp_df = pd.merge(wp_df, low_df, on=['ticker_id','isocalendar'], how="left") #low
-    wp_df = pd.merge(wp_df, vol_df, on=['ticker_id','isocalendar'], how="left") #volume
-    wp_df = pd.merge(wp_df, open_df[['ticker_id','isocalendar','open']], on=['ticker_id','isocalendar'], how="left") #open
-    wp_df = pd.merge(wp_df, close_df[['ticker_id','isocalendar','close']], on=['ticker_id','isocalendar'], how="left") #close
+    cols = ['ticker_id','date','open','high','low','close','change','volume']
+    if not dp_df.shape[0]:
+        return pd.DataFrame([], columns=cols)
+    dp_df = dp_df[['ticker_id','date','open','high','low','close','volume']].copy()
+    dp_df['date'] = pd.to_datetime(dp_df.date)
+    #Ignore non-positive values as the conversion has always done
+    for c in ['open','high','low','close','volume']:
+        dp_df[c] = dp_df[c].where(dp_df[c] > 0)
+    #The monday of the ISO week
+    dp_df['week'] = dp_df.date - pd.to_timedelta(dp_df.date.dt.weekday, unit='D')
+    wp_df = dp_df.sort_values(['ticker_id','date']) \
+        .groupby(['ticker_id','week'], sort=True) \
+        .agg(
+            open=('open','first'),
+            high=('high','max'),
+            low=('low','min'),
+            close=('close','last'),
+            volume=('volume','sum'),
+        ) \
+        .reset_index() \
+        .rename(columns={'week':'date'})
     wp_df['change'] = wp_df['close'] - wp_df['open']
-    wp_df = wp_df.drop_duplicates() \
-        .reset_index(drop=True)
-    #Get the monday of each week
-    wp_df['date'] = [calc_wk_st_date(x) for x in wp_df.date]
-    wp_df = wp_df.drop(columns=['isocalendar'])
+    wp_df['date'] = wp_df.date.dt.date
     #Fill missing values
     wp_df = wp_df.fillna(0)
-    return True, wp_df
+    return wp_df[cols]
 
-def split_day_prices(new_dp_df, ticker_ids=[], from_date=None, to_date=None):
-    """Function to split daily prices into update and append records
+def split_changed_prices(new_df, old_df, fields=PRICE_FIELDS, key=['ticker_id','date']):
+    """Function to drop the prices which match what is already stored, by 
+    comparing a fingerprint of the price fields of each row.
     
     args:
     ------
-    new_dp_df - pandas dataframe - the dataframe with daily prices which have been scraped
-    ticker_ids - list:[] - the ids of tickers to be fetched (if [] then all are fetched)
-    from_date - datetime:None - the min date of prices to be fetched (if None then all are fetched)
-    to_date - datetime:None - the max date of prices to be fetched (if None then all are fetched)
+    new_df - pandas dataframe - the scraped prices
+    old_df - pandas dataframe - the stored prices covering the same dates
+    fields - list:PRICE_FIELDS - the columns compared
+    key - list:['ticker_id','date'] - the columns matching new rows to stored rows
 
     returns:
     ------
-    pandas dataframe, pandas dataframe
+    tuple - (pandas dataframe of the new and changed rows, 
+        dict of new, changed and unchanged counts)
     """
-    #Grab the existing data from the table
-    dp_df = sqlaq_to_df(daily_price.fetch(
-        ticker_ids=ticker_ids,
-        from_date=from_date,
-        to_date=to_date
-        ))
-    dp_df["date"] = dp_df.date.astype("datetime64")
-    #Mark for insert or update
-    dp_df["flag"] = 1
-    new_dp_df = pd.merge(new_dp_df, dp_df[["ticker_id","date","id","flag"]], on=["ticker_id",'date'], how='left')
-    mask = new_dp_df.flag == 1
-    update_df = new_dp_df[mask]
-    append_df = new_dp_df[~mask]
-    return [
-        update_df,
-        append_df
-    ]
+    new_df = new_df.drop_duplicates(subset=key, keep='last')
+    if not old_df.shape[0]:
+        return new_df, {"new":new_df.shape[0], "changed":0, "unchanged":0}
+    def _keyed(df):
+        out = df[key].copy()
+        out['date'] = pd.to_datetime(out.date)
+        out['fp'] = row_fingerprints(df, fields).values
+        return out
+    #Stored prices may hold duplicates where they have not been removed yet
+    old_keyed = _keyed(old_df).drop_duplicates(subset=key, keep='last')
+    merged = pd.merge(_keyed(new_df), old_keyed, on=key, how='left', suffixes=('','_old'), validate='m:1')
+    is_new = merged.fp_old.isnull().values
+    unchanged = ~is_new & (merged.fp == merged.fp_old).values
+    counts = {"new":int(is_new.sum()), "changed":int((~is_new & ~unchanged).sum()), "unchanged":int(unchanged.sum())}
+    return new_df[~unchanged], counts
 
-def split_week_prices(ticker_ids=[], from_date=None, to_date=None):
-    """Function to convert the daily prices into weekly prices and then split
-    into update and append records
+def daily_to_weekly_price_conversion(dp_df):
+    """Function to convert the daily prices into weekly prices
     
     args:
     ------
-    ticker_ids - list:[] - the ids of tickers to be fetched (if [] then all are fetched)
-    from_date - datetime:None - the min date of prices to be fetched (if None then all are fetched)
-    to_date - datetime:None - the max date of prices to be fetched (if None then all are fetched)
+    dp_df - pandas dataframe - the daily prices
 
     returns:
     ------
-    pandas dataframe, pandas dataframe
+    bool, pandas dataframe
     """
-    dp_df = sqlaq_to_df(daily_price.fetch(
-        ticker_ids=ticker_ids,
-        from_date=from_date,
-        to_date=to_date
-        ))
-    _, new_wp_df = daily_to_weekly_price_conversion(dp_df, )
-
-    #Grab the existing data from the table
-    wp_df = sqlaq_to_df(weekly_price.fetch(
-        ticker_ids=ticker_ids,
-        from_date=from_date,
-        to_date=to_date
-        ))
-    wp_df["date"] = wp_df.date.astype("datetime64")
-    #Mark for insert or update
-    wp_df["flag"] = 1
-    new_wp_df = pd.merge(new_wp_df, wp_df[["ticker_id","date","id","flag"]], on=["ticker_id",'date'], how='left')
-    mask = new_wp_df.flag == 1
-    update_df = new_wp_df[mask]
-    append_df = new_wp_df[~mask]
-    return [
-        update_df,
-        append_df
-    ]
-
-
-
-
-
+    logger.info('Converting daily prices to weekly prices')
+    return True, aggregate_weekly_prices(dp_df)
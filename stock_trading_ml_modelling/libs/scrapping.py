@@ -1,16 +1,34 @@
 #Import libraries
+import queue
+import asyncio
 import pandas as pd
 import numpy as np
 import datetime as dt
+from tqdm import tqdm
 
-from stock_trading_ml_modelling.config import CONFIG
+from stock_trading_ml_modelling.config import CONFIG, DB_CHUNK_SIZE, DB_SKIP_UNCHANGED
 from stock_trading_ml_modelling.utils.log import logger
 from stock_trading_ml_modelling.utils.date import create_sec_ref_li, conv_dt
 from stock_trading_ml_modelling.utils.str_formatting import str_to_float_format
-from stock_trading_ml_modelling.database import daily_price, weekly_price
-from stock_trading_ml_modelling.libs.manage_data import split_day_prices, split_week_prices
+from stock_trading_ml_modelling.database import daily_price, weekly_price, price_changes
+from stock_trading_ml_modelling.database.get_data import sqlaq_to_df_by_ticker
+from stock_trading_ml_modelling.libs.manage_data import aggregate_weekly_prices, split_changed_prices
 
 from stock_trading_ml_modelling.scrapping.scrapes import ScrapePrices 
+from stock_trading_ml_modelling.scrapping.engine import get_scrape_engine, ScrapeError
+
+def error_record(ticker, e):
+    """Function to describe the failure of a ticker, with the url, http 
+    status, attempts and reason when the scrape failed
+
+    returns:
+    ----
+    dict
+    """
+    record = {'ticker':ticker, "error":e}
+    if isinstance(e, ScrapeError):
+        record.update(e.to_dict())
+    return record
 
 #Get the price history for a specific ticker
 def get_day_prices(ticker:str, st_date:None, en_date:None):
@@ -29,6 +47,20 @@ def get_day_prices(ticker:str, st_date:None, en_date:None):
     logger.info(f'Getting DAILY prices for -> {ticker} from {str(st_date)} to {str(en_date)}')
     #Perform async scrapes
     tick_df = ScrapePrices(ticker, st_date, en_date).scrape()
+    return prepare_day_prices(ticker, tick_df)
+
+def prepare_day_prices(ticker:str, tick_df):
+    """Function to clean the raw scraped daily prices of a ticker
+    
+    args:
+    ------
+    ticker - str - the identifier for the stock
+    tick_df - pandas dataframe - the rows scraped
+
+    returns:
+    ------
+    tuple - (bool, pandas dataframe) False and None if nothing was scraped
+    """
     #Check for rows - if none then return
     if not tick_df.shape[0]:
         logger.warning("Early exit due to no new records being found")
@@ -67,17 +99,63 @@ def get_day_prices(ticker:str, st_date:None, en_date:None):
     tick_df = tick_df[['ticker','date','week_start_date','open','close','high','low','change','volume']]
     return True, tick_df
 
+def write_daily_prices(
+    ticker,
+    ticker_id,
+    new_prices_df,
+    writer=None,
+    skip_unchanged=DB_SKIP_UNCHANGED
+    ):
+    """Function to upsert the scraped prices of a ticker into the db 
+    (existing (ticker_id, date) records are updated, new ones are added).
+    Rows matching the stored prices are not written.
+    
+    args:
+    ----
+    ticker - str - the ticker the prices were scraped for
+    ticker_id - int - the ticker id in the db
+    new_prices_df - pandas dataframe - the prices from prepare_day_prices
+    writer - PriceWriter:None - queue the prices on this writer rather than 
+        upserting them before returning
+    skip_unchanged - bool:DB_SKIP_UNCHANGED - only write new rows and rows 
+        whose prices differ from those stored
+
+    returns:
+    ----
+    date - the first date upserted or queued, None if nothing was written
+    """
+    new_prices_df['ticker_id'] = ticker_id
+    if skip_unchanged:
+        old_prices_df = daily_price.fetch_df(
+            ticker_ids=[ticker_id],
+            from_date=new_prices_df.date.min(),
+            to_date=new_prices_df.date.max(),
+            cache=False
+            )
+        new_prices_df, counts = split_changed_prices(new_prices_df, old_prices_df)
+        logger.info(f"{ticker} daily prices -> {counts['new']} new, {counts['changed']} changed, {counts['unchanged']} unchanged")
+        if not new_prices_df.shape[0]:
+            return None
+    #Add/update prices in the sql database
+    if writer is not None:
+        writer.put(new_prices_df)
+        count = new_prices_df.shape[0]
+        logger.info(f"\nQUEUED {count} RECORDS FOR daily_price: \n\tFROM {new_prices_df.date.min()} \n\tTO {new_prices_df.date.max()}")
+    else:
+        count = daily_price.upsert_df(new_prices_df)
+        logger.info(f"\nUPSERTED {count} RECORDS IN daily_price: \n\tFROM {new_prices_df.date.min()} \n\tTO {new_prices_df.date.max()}")
+    return new_prices_df.date.min() if count else None
+
 def process_daily_prices(
     ticker,
     ticker_id,
     st_date=None,
     en_date=None,
-    split_from_date=None,
-    split_to_date=None
+    writer=None,
+    skip_unchanged=DB_SKIP_UNCHANGED
     ):
     """Function to scrape prices for a ticker between selected dates, then
-    split into update and add records, then perform those split/add functions 
-    on the db.
+    write them with write_daily_prices.
     
     args:
     ----
@@ -85,60 +163,147 @@ def process_daily_prices(
     ticker_id - int - the ticker id in the db
     st_date - datetime - the date to start the scrape
     en_date - datetime - the date to end the scrape
-    split_from_date - datetime - the date to start the split
-    split_to_date - datetime - the date to end the split
-    logger - logger
+    writer - PriceWriter:None - queue the prices on this writer rather than 
+        upserting them before returning
+    skip_unchanged - bool:DB_SKIP_UNCHANGED - only write new rows and rows 
+        whose prices differ from those stored
+
+    returns:
+    ----
+    date - the first date upserted or queued, None if nothing was written
     """
     #Get new price data if neccesary
     if not st_date  or st_date < en_date:
         check, new_prices_df = get_day_prices(ticker, st_date, en_date, )
         if check:
-            new_prices_df['ticker_id'] = ticker_id
-            update_df, append_df = split_day_prices(
-                new_prices_df,
-                ticker_ids=[ticker_id],
-                from_date=split_from_date,
-                to_date=split_to_date
-            )
-            #Update existing prices in the sql database
-            daily_price.update_df(update_df)
-            logger.info(f"\nUPDATED {update_df.shape[0]} RECORDS IN daily_price: \n\tFROM {update_df.date.min()} \n\tTO {update_df.date.max()}")
-            #Add new prices to the sql database
-            daily_price.add_df(append_df)
-            logger.info(f"\nADDED {append_df.shape[0]} NEW RECORDS TO daily_price: \n\tFROM {append_df.date.min()} \n\tTO {append_df.date.max()}")
+            return write_daily_prices(ticker, ticker_id, new_prices_df, writer=writer, skip_unchanged=skip_unchanged)
         else:
             logger.info('No new records found')
     else:
         logger.info('No new records to collect')
+    return None
+
+def scrape_daily_prices(jobs, writer=None, engine=None):
+    """Function to scrape the daily prices of many tickers in one concurrent
+    run. Every ticker's urls are planned up front and fetched together on the
+    scrape engine, which bounds how many are in flight. Each ticker is 
+    cleaned and written as soon as all of its urls are back.
     
-def process_weekly_prices(
-    ticker_id,
-    split_from_date=None,
-    split_to_date=None
-    ):
-    """Function to fetch prices for a ticker between selected dates, then
-    split into update and add records, then perform those split/add functions 
-    on the db.
+    args:
+    ----
+    jobs - list of dicts - ticker, ticker_id, st_date and en_date of each scrape
+    writer - PriceWriter:None - queue the prices on this writer rather than 
+        upserting them as they arrive
+    engine - ScrapeEngine:None - the engine to scrape on, the process wide
+        engine if None
+
+    returns:
+    ----
+    list of dicts - the error_record of each failed ticker
+    """
+    engine = engine or get_scrape_engine()
+    jobs = [j for j in jobs if not j["st_date"] or j["st_date"] < j["en_date"]]
+    results = queue.Queue()
+
+    async def _scrape(job):
+        try:
+            tick_df = await ScrapePrices(job["ticker"], job["st_date"], job["en_date"]).scrape_async(engine)
+            results.put((job, tick_df, None))
+        except Exception as e:
+            results.put((job, None, e))
+
+    async def _scrape_all():
+        await asyncio.gather(*[_scrape(j) for j in jobs])
+
+    logger.info(f"Scraping DAILY prices for {len(jobs)} tickers")
+    future = engine.submit(_scrape_all())
+    errors = []
+    for _ in tqdm(range(len(jobs)), desc="Scrape daily prices"):
+        #Wait for the next ticker, stop if the run itself has failed
+        while True:
+            try:
+                job, tick_df, error = results.get(timeout=1)
+                break
+            except queue.Empty:
+                if future.done():
+                    future.result()
+                    raise RuntimeError("Scrape run ended before every ticker was returned")
+        if error is None:
+            try:
+                check, new_prices_df = prepare_day_prices(job["ticker"], tick_df)
+                if check:
+                    write_daily_prices(job["ticker"], job["ticker_id"], new_prices_df, writer=writer)
+            except Exception as e:
+                error = e
+        if error is not None:
+            logger.error(f"{job['ticker']} -> {error}")
+            errors.append(error_record(job["ticker"], error))
+    future.result()
+    logger.info(f"Scrape engine stats - {engine.stats()}")
+    return errors
+    
+#The most distinct week starts filtered in one query by update_weekly_prices
+WEEK_STARTS_PER_QUERY = 200
+
+def update_weekly_prices(touched, chunk_size=DB_CHUNK_SIZE):
+    """Function to rebuild only the weekly prices whose ISO weeks hold daily 
+    prices written since the last update. The daily prices of every affected 
+    ticker are streamed in ordered queries, each ticker from the monday of its
+    own first touched week, aggregated a ticker at a time and upserted in 
+    batches.
     
     args:
     ----
-    ticker_id - int - the ticker id in the db
-    split_from_date - datetime - the date to start the split
-    split_to_date - datetime - the date to end the split
-    logger - logger
+    touched - dict - ticker_id to the first daily date written for it
+    chunk_size - int:DB_CHUNK_SIZE - the number of weekly rows per upsert
+
+    returns:
+    ----
+    int - the number of weekly rows upserted
     """
-    #Get new price data if neccesary
-    update_df, append_df = split_week_prices(
-        ticker_ids=[ticker_id],
-        from_date=split_from_date,
-        to_date=split_to_date,
-        
-    )
-
-    #Update existing records
-    weekly_price.update_df(update_df)
-    logger.info(f"\nUPDATED {update_df.shape[0]} RECORDS IN weekly_price: \n\tFROM {update_df.date.min()} \n\tTO {update_df.date.max()}")
-
-    #Add new prices to the sql database
-    weekly_price.add_df(append_df)
-    logger.info(f"\nADDED {append_df.shape[0]} NEW RECORDS TO weekly_price: \n\tFROM {append_df.date.min()} \n\tTO {append_df.date.max()}")
+    touched = {int(k):pd.Timestamp(v) for k,v in touched.items() if v is not None and pd.notnull(v)}
+    if not len(touched):
+        logger.info('No weekly prices to update')
+        return 0
+    #Recompute from the monday of the first touched week of each ticker, each
+    #ticker is filtered from its own week in sql
+    week_starts = {k:(v - pd.Timedelta(days=v.weekday())).date() for k,v in touched.items()}
+    #Bound the OR terms per query, tickers never span two queries
+    starts = sorted(set(week_starts.values()))
+    count = 0
+    batch = []
+    batch_rows = 0
+    for i in range(0, len(starts), WEEK_STARTS_PER_QUERY):
+        part = set(starts[i:i + WEEK_STARTS_PER_QUERY])
+        query = daily_price.fetch(
+            from_dates={k:v for k,v in week_starts.items() if v in part},
+            ordered=True
+            )
+        for ticker_id, dp_df in sqlaq_to_df_by_ticker(query):
+            wp_df = aggregate_weekly_prices(dp_df)
+            batch.append(wp_df)
+            batch_rows += wp_df.shape[0]
+            if batch_rows >= chunk_size:
+                count += weekly_price.upsert_df(pd.concat(batch, ignore_index=True))
+                batch, batch_rows = [], 0
+    if len(batch):
+        count += weekly_price.upsert_df(pd.concat(batch, ignore_index=True))
+    logger.info(f"\nUPSERTED {count} RECORDS IN weekly_price FOR {len(touched)} TICKERS")
+    return count
+
+def update_weekly_prices_from_changes(consumer="weekly_price", chunk_size=DB_CHUNK_SIZE):
+    """Function to rebuild the weekly prices of every daily price change 
+    logged since this consumer last ran, whichever process wrote them.
+    
+    args:
+    ----
+    consumer - str:"weekly_price" - the name the watermark is kept under
+    chunk_size - int:DB_CHUNK_SIZE - the number of weekly rows per upsert
+
+    returns:
+    ----
+    int - the number of weekly rows upserted
+    """
+    with price_changes.consume(consumer, "daily_price") as changes:
+        count = update_weekly_prices(dict(zip(changes.ticker_id, changes.min_date)), chunk_size=chunk_size)
+    return count
@@ -1,45 +1,71 @@
 import pandas as pd
 from tqdm import tqdm
 
+from stock_trading_ml_modelling.config import PRICE_PANEL_ENABLED
 from stock_trading_ml_modelling.utils.log import logger
-from stock_trading_ml_modelling.database.get_data import sqlaq_to_df
+from stock_trading_ml_modelling.database.get_data import sqlaq_to_df, sqlaq_to_df_by_ticker
 from stock_trading_ml_modelling.database import ticker, ticker_market, daily_price, weekly_price
+from stock_trading_ml_modelling.database.models import Session as session
+from stock_trading_ml_modelling.database.price_panel import get_price_panel, price_panel_loaded
 from stock_trading_ml_modelling.libs.data import DataSet
 
-def filter_stocks(from_date=None, to_date=None):
+def _iter_ticker_prices(ticker_ids, from_date=None, to_date=None, panel=False):
+    """Generator of the close prices of each ticker, from the shared price
+    panel or streamed from the db a ticker at a time
+
+    yields:
+    ----
+    tuple - (ticker_id, pandas dataframe with a close column)
+    """
+    if panel:
+        price_panel = get_price_panel()
+        for ticker_id in ticker_ids:
+            prices = price_panel.ticker(ticker_id, from_date=from_date, to_date=to_date, fields=["close"])
+            if prices["close"].shape[0]:
+                yield ticker_id, pd.DataFrame({"close":prices["close"]})
+        return
+    query = daily_price.fetch(
+        ticker_ids=ticker_ids,
+        from_date=from_date,
+        to_date=to_date,
+        ordered=True
+        )
+    for ticker_id, tick_prices in sqlaq_to_df_by_ticker(query):
+        yield ticker_id, tick_prices
+
+def filter_stocks(from_date=None, to_date=None, panel=None):
     """Function to search for shares to buy
     
     args:
     ----
     from_date - datetime:None - a bounding minimum date (if neccesary)
     to_date - datetime:None - a bounding maximum date (if neccesary)
+    panel - bool:None - read prices from the shared price panel, if None the
+        panel is read when PRICE_PANEL_ENABLED or it is already loaded
     
     returns:
     ----
     pandas dataframe
     """
-    #Fetch prices
-    prices_df = sqlaq_to_df(daily_price.fetch(from_date=from_date, to_date=to_date))
-    ticker_df = sqlaq_to_df(ticker.fetch()) \
-        .rename(columns={"id":"ticker_id"})
-
+    if panel is None:
+        panel = PRICE_PANEL_ENABLED or price_panel_loaded()
     #Filter to keep only items which are current
-    max_date = prices_df.date.max()
-    ticks = prices_df[prices_df.date == max_date] \
-        .ticker_id \
-        .drop_duplicates()
-    ticks = pd.merge(ticks.to_frame(), ticker_df[["ticker_id","ticker"]], on=["ticker_id"])
+    ticks = sqlaq_to_df(daily_price.fetch_latest(session, from_date=from_date, to_date=to_date)) \
+        .rename(columns={"id":"ticker_id"})
+    max_date = ticks.max_date.max()
+    ticks = ticks.loc[ticks.max_date == max_date, ["ticker_id","ticker"]] \
+        .set_index("ticker_id")
 
     #Setup variables
     buy = []
     sell = []
-    
-    prices_df = prices_df.sort_values(['ticker_id','date']) \
-        .reset_index(drop=True)
+
+    #Prices are read a ticker at a time
+    tick_iter = _iter_ticker_prices(ticks.index.to_list(), from_date=from_date, to_date=to_date, panel=panel)
 
     #Loop ticks and get results
-    for _,r in tqdm(ticks.iterrows(), total=ticks.shape[0], desc="Loop stock to find buy signals"):
-        tick_prices = prices_df[prices_df.ticker_id == r.ticker_id]
+    for ticker_id, tick_prices in tqdm(tick_iter, total=ticks.shape[0], desc="Loop stock to find buy signals"):
+        r = pd.Series({"ticker_id":ticker_id, "ticker":ticks.ticker[ticker_id]})
         dataset = DataSet()
         dataset.add_dataset(tick_prices.close, "close")
         # #Calculate the short macd
@@ -1,79 +1,102 @@
 """Functions for managing the database"""
 from tqdm import tqdm
 import datetime as dt
+import numpy as np
 import pandas as pd
 
-from stock_trading_ml_modelling.config import WEB_SCRAPE_MAX_DAYS
+from stock_trading_ml_modelling.config import WEB_SCRAPE_MAX_DAYS, DB_DATE_STORAGE
 from stock_trading_ml_modelling.utils.log import logger
 from stock_trading_ml_modelling.utils.date import calc_date_window
 from stock_trading_ml_modelling.utils.timing import ProcessTime
 from stock_trading_ml_modelling.database.get_data import sqlaq_to_df
-from stock_trading_ml_modelling.database import ticker, ticker_market, daily_price, weekly_price
-from stock_trading_ml_modelling.libs.scrapping import get_day_prices, process_daily_prices, process_weekly_prices
+from stock_trading_ml_modelling.database import ticker, ticker_market, daily_price, weekly_price, ticker_latest
+from stock_trading_ml_modelling.database.models import engine
+from stock_trading_ml_modelling.database.writer import PriceWriter
+from stock_trading_ml_modelling.database.price_panel import get_price_panel
+from stock_trading_ml_modelling.database.models.prices import create_db, create_indexes, convert_date_storage, \
+    migrate_price_changes, DailyPrice, WeeklyPrice
+from stock_trading_ml_modelling.libs.scrapping import get_day_prices, process_daily_prices, \
+    update_weekly_prices_from_changes
 
 from stock_trading_ml_modelling.libs.manage_data import create_filtered_year_dates
+from stock_trading_ml_modelling.scrapping.database import prepare_db
 
-def _find_duplicates(prices):
-    """Find duplicate prices
-    
-    args:
-    ----
-    prices - pandas dataframe
+def _remove_duplicate_prices(price_cl, dry_run=False):
+    """Remove the duplicated prices of a table and log the counts"""
+    tab_name = "daily_price" if price_cl is daily_price else "weekly_price"
+    run_time = ProcessTime()
+    counts = price_cl.remove_duplicates(dry_run=dry_run)
+    if dry_run:
+        logger.info(f"DRY RUN - found {counts['duplicates']} duplicate records in {tab_name} across {counts['tickers']} tickers")
+    else:
+        logger.info(f"Deleted {counts['deleted']} duplicate records from {tab_name} across {counts['tickers']} tickers")
+    logger.info(f"Run time - {run_time.end()}")
+    return counts
 
-    returns:
+def remove_duplicate_daily_prices(dry_run=False):
+    """Function for removing any duplicated prices in the database
+    keeping the most recent (found by highest volume).
+
+    args:
     ----
-    pands dataframe
+    dry_run - bool:False - only report the number of duplicates
     """
-    #Find duplicate dates
-    dates = prices.date.value_counts()
-    dates.name = "date_count"
-    dates.index.name = "date"
-    dates = dates[dates > 1] \
-        .to_frame() \
-        .reset_index()
-    #Isolate those dates in the prices dataframe
-    dups = prices[prices.date.isin(dates.date)]
-    dups = dups.sort_values(["date","volume"], ascending=[True,False])
-    #Keep the first for each date
-    mask = dups.date != dups.date.shift(1)
-    del_df = dups[~mask]
-    return del_df
+    return _remove_duplicate_prices(daily_price, dry_run=dry_run)
 
-def remove_duplicate_daily_prices():
+def remove_duplicate_weekly_prices(dry_run=False):
     """Function for removing any duplicated prices in the database
     keeping the most recent (found by highest volume).
+
+    args:
+    ----
+    dry_run - bool:False - only report the number of duplicates
     """
-    #Fetch all the tickers
-    tickers = sqlaq_to_df(ticker.fetch())
-    #Loop through tickers
-    for id in tqdm(tickers.id, total=tickers.shape[0], desc="Remove duplicate daily prices"):
-        #Fetch all prices
-        dp = sqlaq_to_df(daily_price.fetch(ticker_ids=[id]))
-        #Find duplicate dates
-        dp_del = _find_duplicates(dp)
-        #Delete the others
-        if daily_price.remove(dp_del.id.to_list()):
-            logger.info(f"Delted {dp_del.shape[0]} records from daily_price, ticker_id -> {id}")
-        else:
-            logger.error(f"Unable to delete {dp_del.shape[0]} records from daily_price, ticker_id -> {id}")
+    return _remove_duplicate_prices(weekly_price, dry_run=dry_run)
 
-def remove_duplicate_weekly_prices():
-    """Function for removing any duplicated prices in the database
-    keeping the most recent (found by highest volume).
+def migrate_price_indexes():
+    """Function for bringing an existing database up to the current indexes.
+    Duplicate prices are removed first as the unique (ticker_id, date) 
+    indexes cannot be built over them.
     """
-    #Fetch all the tickers
-    tickers = sqlaq_to_df(ticker.fetch())
-    #Loop through tickers
-    for id in tqdm(tickers.id, total=tickers.shape[0], desc="Remove duplicate weekly prices"):
-        #Fetch all prices
-        wp = sqlaq_to_df(weekly_price.fetch(ticker_ids=[id]))
-        #Find duplicate dates
-        wp_del = _find_duplicates(wp)
-        #Delete the others
-        if weekly_price.remove(wp_del.id.to_list()):
-            logger.info(f"Delted {wp_del.shape[0]} records from weekly_price, ticker_id -> {id}")
-        else:
-            logger.error(f"Unable to delete {wp_del.shape[0]} records from weekly_price, ticker_id -> {id}")
+    #Create any missing tables, eg ticker_latest which the price deletes update
+    create_db(engine)
+    if migrate_price_changes(engine):
+        logger.info("Rebuilt price_changes with AUTOINCREMENT ids")
+    #Duplicates are found by date so every date must be in the same form
+    migrate_price_dates()
+    logger.info("Removing duplicate prices ahead of creating unique indexes")
+    remove_duplicate_daily_prices()
+    remove_duplicate_weekly_prices()
+    logger.info("Creating missing indexes")
+    create_indexes(engine)
+    rebuild_ticker_latest()
+
+def migrate_price_dates(storage=DB_DATE_STORAGE):
+    """Function to convert the stored price dates to the form set by 
+    db_schema.date_storage in config.json, "iso" or "epoch"
+    """
+    logger.info(f"Converting price dates to {storage} storage")
+    counts = convert_date_storage(engine, storage)
+    for k, v in counts.items():
+        logger.info(f"Converted {v} dates in {k}")
+    return counts
+
+def rebuild_ticker_latest():
+    """Function for rebuilding the ticker_latest summary from the price tables,
+    to be run if the summary has drifted from the prices.
+    """
+    count = ticker_latest.rebuild()
+    logger.info(f"Rebuilt ticker_latest for {count} tickers")
+
+def sync_price_store(full=False):
+    """Function for exporting the price tables from the db to the parquet 
+    price store. Only partitions changed since the last sync, as logged in
+    price_changes, are rewritten unless full is True.
+    """
+    from stock_trading_ml_modelling.database.parquet_store import ParquetPriceStore
+    for DestClass in [DailyPrice, WeeklyPrice]:
+        store = ParquetPriceStore(DestClass.__table__.name)
+        store.sync_from_db(DestClass, full=full)
 
 def fill_price_gaps(
     from_date=dt.datetime(1970,1,1),
@@ -82,6 +105,7 @@ def fill_price_gaps(
     """Function for finding missing prices in tickers and filling them.
     Looks at both daily and weekly price tables.
     """
+    prepare_db()
     #Create a collection of years
     years = []
     cur_year = from_date.year
@@ -101,30 +125,37 @@ def fill_price_gaps(
     #Order the dates (just in case)
     all_year_dates = all_year_dates.sort_values(["date"]) \
         .reset_index(drop=True)
+    all_dates = all_year_dates.date.values.astype("datetime64[D]")
     #Fetch all the tickers
     tickers = sqlaq_to_df(ticker.fetch())
     #Loop through tickers
     errors = []
+    #The dates held for every ticker, read from the db once. The loop reads
+    #without refreshing, the writer's commits are not needed to find gaps and
+    #would otherwise rebuild the panel after every batch
+    price_panel = get_price_panel()
+    price_panel.refresh()
     run_time = ProcessTime()
+    #Prices are written in batches by a writer thread while scraping continues
+    writer = PriceWriter(daily_price).start()
     for _,r in tqdm(tickers[["id","ticker"]].iterrows(), total=tickers.shape[0], desc="Filling in gaps"):
         logger.info(f"Filling gaps in {r.id} -> {r.ticker}")
         try:
-            #Fetch all prices
-            dp = sqlaq_to_df(daily_price.fetch(ticker_ids=[r.id]))
-            dp["date"] = dp.date.astype("datetime64[ns]")
+            #Fetch the dates of all prices
+            dp_dates = price_panel.ticker(r.id, fields=["date"], refresh=False)["date"]
             #Identify missing dates
-            missing_dates = pd.merge(all_year_dates, dp[["date","id"]], on=["date"], how="left")
-            #Identify the start date and remove all missing date before that
-            start_date = missing_dates[~missing_dates.id.isnull()].date.min()
-            missing_dates = missing_dates[missing_dates.date > start_date]
-            #Remove all other items which have dates
-            missing_dates = missing_dates[missing_dates.id.isnull()]
-            #Order remaining dates
-            missing_dates = missing_dates.sort_values("date")
+            has_price = np.isin(all_dates, dp_dates)
+            #Identify the start date and remove all missing date before that,
+            #keeping the remaining dates without prices (already in order)
+            if has_price.any():
+                start_date = all_dates[has_price].min()
+                missing_dates = all_dates[(all_dates > start_date) & ~has_price]
+            else:
+                missing_dates = all_dates[:0]
             #Create groupings no larger than max_days (in config)
             st_d = None
             date_groups = []
-            missing_dates = missing_dates.date.to_list()
+            missing_dates = pd.to_datetime(missing_dates).to_list()
             if len(missing_dates):
                 for i,d in enumerate(missing_dates):
                     if not st_d:
@@ -148,24 +179,29 @@ def fill_price_gaps(
                             r.id,
                             st_date=dates[0],
                             en_date=dates[1],
-                            
+                            writer=writer
                             )
                 except Exception as e:
                     logger.error(e)
                     errors.append({'ticker_id':r.id, 'ticker':r.ticker, "error":e, "st_date":dates[0], "en_dates":dates[1]})
-                #Run an update on th weekly prices
-                process_weekly_prices(
-                    r.id,
-                    
-                    )
         except Exception as e:
             logger.error(e)
             errors.append({'ticker_id':r.id, 'ticker':r.ticker, "error":e})
         #Lap
         logger.info(run_time.lap())
         logger.info(run_time.show_latest_lap_time(show_time=True))
+    #Write everything queued before building the weekly prices
+    logger.info(f"DAILY PRICES WRITTEN - {writer.close()}")
+    errors += writer.ticker_errors(dict(zip(tickers.id, tickers.ticker)))
     logger.info(f"GAP FILL RUN TIME - {run_time.end()}")
 
+    #Run an update on the weekly prices of the filled weeks
+    try:
+        update_weekly_prices_from_changes()
+    except Exception as e:
+        logger.error(e)
+        errors.append({'ticker_id':None, 'ticker':'ALL', "error":e})
+
     logger.info(f'\nGAP FILL ERROR COUNT -> {len(errors)}')
     if len(errors) > 0:
         logger.info('GAP FILL ERRORS ->')
@@ -41,15 +41,20 @@ class DataBuilder:
         self.window = window
         self.ticker_ids = ticker_ids
 
-    def get_price_data(self, weeks=52*10, force:bool=False):
+    def get_price_data(self, weeks=52*10, force:bool=False, last_n:int=None):
         if self.prices is None or force:
             price_data = PriceData()
-            self.prices = price_data.get_prices(ticker_ids=self.ticker_ids, weeks=weeks)
+            self.prices = price_data.get_prices(ticker_ids=self.ticker_ids, weeks=weeks, last_n=last_n)
 
-    def create_data(self, weeks=52*10, force=False):
+    def create_data(self, weeks=52*10, force=False, stream=False):
+        if stream:
+            return self.create_data_stream(weeks=weeks)
         self.get_price_data(weeks=weeks, force=force)
-        #Create labels
-        self.prices["signal"] = self.identify_signals_gain_loss(self.prices.close, self.period)
+        #Create labels, each ticker from its own prices
+        self.prices["signal"] = pd.concat([
+            self.identify_signals_gain_loss(close, self.period)
+            for _, close in self.prices.groupby("ticker_id", sort=False).close
+            ])
         self.prices["encoded_signal"], self.labels = self.encode_labels(self.prices.signal)
         #Loop tickers
         ticker_ids = self.prices.ticker_id.unique()
@@ -66,6 +71,31 @@ class DataBuilder:
         self.test_train_split()
         self.signals, _ = self.decode_labels(self.y)
 
+    def create_data_stream(self, weeks=52*10):
+        """Create the data streaming prices from the db a ticker at a time. 
+        Only one ticker's prices are held in memory so self.prices is left 
+        as None.
+        """
+        self.labels = {}
+        X, y, prices_ids = [], [], []
+        price_data = PriceData()
+        for _, tick_prices in tqdm(price_data.iter_prices(ticker_ids=self.ticker_ids, weeks=weeks), desc="Create data for tickers"):
+            #Create labels
+            tick_prices["signal"] = self.identify_signals_gain_loss(tick_prices.close, self.period)
+            tick_prices["encoded_signal"] = self.update_labels(tick_prices.signal)
+            prices_id, encoded_signal, tick_data = self.create_ticker_data(tick_prices)
+            X.append(self.zip_data(tick_data))
+            y.append(encoded_signal)
+            prices_ids.append(prices_id)
+        if not len(X):
+            return
+        self.X = np.concatenate(X, axis=0)
+        self.y = np.concatenate(y, axis=None)
+        self.prices_id = np.concatenate(prices_ids, axis=None)
+        #Split data
+        self.test_train_split()
+        self.signals, _ = self.decode_labels(self.y)
+
     def create_ticker_data(self, tick_prices):
         _, close = self.create_data_max_min_norm(tick_prices.close, name="close")
         _, _open = self.create_data_max_min_norm(tick_prices.open, name="_open")
@@ -218,6 +248,14 @@ class DataBuilder:
         labels = {k:v for v,k in enumerate(uni_classes)}
         return labels
 
+    def update_labels(self, s):
+        """Encode s adding any unseen classes to self.labels in the order they
+        appear, matches create_labels when called over the same rows in order"""
+        for k in s.unique():
+            if k not in self.labels:
+                self.labels[k] = len(self.labels)
+        return np.vectorize(self.labels.get)(s.values)
+
     def encode_labels(self, s):
         labels = self.create_labels(s)
         encoded_s = np.vectorize(labels.get)(s.values)
@@ -1,21 +1,76 @@
 
 from datetime import datetime, timedelta
 
+from stock_trading_ml_modelling.config import PRICE_PANEL_ENABLED
 from stock_trading_ml_modelling.database import daily_price
-from stock_trading_ml_modelling.database.get_data import sqlaq_to_df
+from stock_trading_ml_modelling.database.price_panel import get_price_panel, price_panel_loaded
+from stock_trading_ml_modelling.database.get_data import sqlaq_to_df, sqlaq_to_df_by_ticker
+from stock_trading_ml_modelling.database.array_store import PriceArrayStore
+
+def lookback_from_date(weeks):
+    """Function to get the first date of a lookback of weeks, prices on the 
+    day the lookback starts are excluded
+
+    returns:
+    ----
+    date - None if weeks is None
+    """
+    return (datetime.now() - timedelta(weeks=weeks)).date() + timedelta(days=1) \
+        if weeks else None
 
 class PriceData:
     def __init__(self):
-        pass
-
-    def get_prices(self, ticker_ids=[], weeks=52*10):
-        """Function to fetch the pricing data"""
-        #Get the price data
-        prices = sqlaq_to_df(daily_price.fetch(ticker_ids=ticker_ids))
-        #Limit dates
-        st_date = (datetime.now() - timedelta(weeks=weeks)).date()
-        prices = prices[prices.date > st_date]
-        #Ensure they are in date order - async fetching may have prevented this
-        prices = prices.sort_values(["ticker_id","date"]) \
-            .reset_index(drop=True)
+        self.array_store = None
+
+    def get_prices(self, ticker_ids=[], weeks=52*10, last_n=None, panel=None):
+        """Function to fetch the pricing data ordered by ticker_id then date. 
+        The lookback and ordering are applied by the database, or by the 
+        shared price panel.
+        
+        args:
+        ----
+        ticker_ids - list:[] - the ids of the tickers to fetch (all if empty)
+        weeks - int:520 - the number of weeks of prices to fetch, None for all
+        last_n - int:None - only fetch the latest last_n prices of each ticker
+        panel - bool:None - read from the process wide price panel, if None 
+            the panel is read when PRICE_PANEL_ENABLED or it is already loaded
+        """
+        #Prices after the start date
+        from_date = lookback_from_date(weeks)
+        if panel is None:
+            panel = PRICE_PANEL_ENABLED or price_panel_loaded()
+        if panel:
+            return get_price_panel().to_df(ticker_ids=ticker_ids, from_date=from_date, last_n=last_n)
+        prices = daily_price.fetch_df(ticker_ids=ticker_ids, from_date=from_date, 
+            ordered=True, last_n=last_n)
         return prices
+
+    def iter_prices(self, ticker_ids=[], weeks=52*10):
+        """Generator to stream the pricing data one ticker at a time
+        
+        yields:
+        ----
+        tuple - (ticker_id, pandas dataframe ordered by date)
+        """
+        query = daily_price.fetch(ticker_ids=ticker_ids, from_date=lookback_from_date(weeks), ordered=True)
+        for ticker_id, prices in sqlaq_to_df_by_ticker(query):
+            yield ticker_id, prices
+
+    def iter_arrays(self, ticker_ids=[], weeks=52*10, fields=None):
+        """Generator to stream the pricing data one ticker at a time from the 
+        memory mapped price arrays, built by refresh_price_arrays. Each array 
+        is a read only view onto the store, nothing is copied.
+        
+        yields:
+        ----
+        tuple - (ticker_id, dict of field name to array ordered by date)
+        """
+        if self.array_store is None:
+            self.array_store = PriceArrayStore("daily_price").load()
+        from_date = lookback_from_date(weeks)
+        ticker_ids = ticker_ids if len(ticker_ids) else self.array_store.tickers
+        for ticker_id in ticker_ids:
+            prices = self.array_store.get(ticker_id, fields=fields, from_date=from_date)
+            if not len(next(iter(prices.values()), [])):
+                continue
+            yield int(ticker_id), prices
@@ -30,20 +30,45 @@ import pandas as pd
 import datetime as dt
 from tqdm import tqdm
 
-from stock_trading_ml_modelling.config import WEB_SCRAPE_MODE
+from stock_trading_ml_modelling.config import WEB_SCRAPE_MODE, WEB_SCRAPE_BATCH, PRICE_ARRAYS_REFRESH
 from stock_trading_ml_modelling.utils.log import logger
 from stock_trading_ml_modelling.utils.timing import ProcessTime
 from stock_trading_ml_modelling.utils.date import calc_en_date, calc_st_date
 from stock_trading_ml_modelling.database.get_data import sqlaq_to_df
-from stock_trading_ml_modelling.database import ticker, daily_price, weekly_price
-from stock_trading_ml_modelling.database.models import Session as session
+from stock_trading_ml_modelling.database import ticker, daily_price, weekly_price, price_changes
+from stock_trading_ml_modelling.database.changes_data import new_run
+from stock_trading_ml_modelling.database.models import Session as session, db_profile
+from stock_trading_ml_modelling.database.array_store import refresh_price_arrays
+from stock_trading_ml_modelling.database.writer import PriceWriter
 
 from stock_trading_ml_modelling.scrapping.scrape_data import get_tickers
-from stock_trading_ml_modelling.libs.scrapping import process_daily_prices, process_weekly_prices
-from stock_trading_ml_modelling.scrapping.database import create_new_tickers, create_new_ticker_markets
+from stock_trading_ml_modelling.libs.scrapping import process_daily_prices, scrape_daily_prices, \
+    update_weekly_prices_from_changes, error_record
+from stock_trading_ml_modelling.scrapping.database import create_new_tickers, create_new_ticker_markets, \
+    prepare_db
 
 def full_scrape():
-    """Function to perform a full scrape of all available prices"""
+    """Function to perform a full scrape of all available prices. In full mode 
+    the price tables are rebuilt so the db runs under the bulk_load profile.
+    """
+    logger.info(f"RUN ID - {new_run()}")
+    prepare_db()
+    if str(WEB_SCRAPE_MODE).lower() == 'update':
+        _full_scrape()
+    else:
+        with db_profile("bulk_load"):
+            _full_scrape()
+    #Rebuild the memory mapped price arrays from the updated tables. Every 
+    #build rewrites the whole store so it is off by default, build_price_arrays
+    #rebuilds it on demand
+    if PRICE_ARRAYS_REFRESH:
+        logger.info("\nREFRESHING PRICE ARRAYS")
+        logger.info(refresh_price_arrays())
+    #Drop the changes every consumer has processed
+    logger.info(f"PRUNED {price_changes.prune()} PRICE CHANGES")
+
+def _full_scrape():
+    """Function to scrape tickers then daily prices and build weekly prices"""
 
     #########################
     ### SCRAPPING TICKERS ###
@@ -67,7 +92,7 @@ def full_scrape():
 
     #Make a call for all the latest dates
     latest_dates_df = sqlaq_to_df(daily_price.fetch_latest(session, ticker_ids=ticker_ids))
-    latest_dates_df["max_date"] = latest_dates_df.max_date.astype("datetime64")
+    latest_dates_df["max_date"] = latest_dates_df.max_date.astype("datetime64[ns]")
     #Calc the en_date for today
     en_date = calc_en_date()
     if str(WEB_SCRAPE_MODE).lower() == 'update':
@@ -82,60 +107,54 @@ def full_scrape():
     #Scrape all new data and add to the database.
     dp_errors = []
     run_time = ProcessTime()
-    for _,r in tqdm(latest_dates_df.iterrows(), total=latest_dates_df.shape[0], desc="Scrape daily prices"):
-        logger.info(f'\n{len(run_time.lap_li)} RUNNING FOR -> {r.id}, {r.ticker}')
-        logger.info(f'Latst date - {r.max_date}')
-        try:
-            #Get new price data if neccesary and add/update the database
-            process_daily_prices(
-                r.ticker,
-                r.id,
-                st_date=r.st_date,
-                en_date=en_date,
-                split_from_date=r.max_date,
-                split_to_date=None
-                )
-        except Exception as e:
-            logger.error(e)
-            dp_errors.append({'ticker':r.ticker, "error":e})
-        #Lap
-        logger.info(run_time.lap())
-        logger.info(run_time.show_latest_lap_time(show_time=True))
+    #Prices are written in batches by a writer thread while scraping continues
+    with PriceWriter(daily_price) as writer:
+        if WEB_SCRAPE_BATCH:
+            #Scrape every ticker in one concurrent run on the scrape engine
+            jobs = [{
+                "ticker":r.ticker,
+                "ticker_id":r.id,
+                "st_date":r.st_date,
+                "en_date":en_date,
+                } for _,r in latest_dates_df.iterrows()]
+            dp_errors += scrape_daily_prices(jobs, writer=writer)
+        else:
+            for _,r in tqdm(latest_dates_df.iterrows(), total=latest_dates_df.shape[0], desc="Scrape daily prices"):
+                logger.info(f'\n{len(run_time.lap_li)} RUNNING FOR -> {r.id}, {r.ticker}')
+                logger.info(f'Latst date - {r.max_date}')
+                try:
+                    #Get new price data if neccesary and queue it for the database
+                    process_daily_prices(
+                        r.ticker,
+                        r.id,
+                        st_date=r.st_date,
+                        en_date=en_date,
+                        writer=writer
+                        )
+                except Exception as e:
+                    logger.error(e)
+                    dp_errors.append(error_record(r.ticker, e))
+                #Lap
+                logger.info(run_time.lap())
+                logger.info(run_time.show_latest_lap_time(show_time=True))
+    logger.info(f"DAILY PRICES WRITTEN - {writer.stats()}")
+    dp_errors += writer.ticker_errors(dict(zip(latest_dates_df.id, latest_dates_df.ticker)))
     logger.info(f"DAILY SCRAPE RUN TIME - {run_time.end()}")
 
     #####################
     ### WEEKLY PRICES ###
     #####################
-    logger.info("\nSCRAPPING WEEKLY PRICES")
-
-    #Make a call for all the latest dates
-    latest_dates_df = sqlaq_to_df(weekly_price.fetch_latest(session, ticker_ids=ticker_ids))
-    latest_dates_df["max_date"] = latest_dates_df.max_date.astype("datetime64")
+    logger.info("\nBUILDING WEEKLY PRICES")
 
-    #Loop through the tickers in tick_ftse and for each one get the latest date of scrape.
-    #Convert this date into a timestamp.
-    #Scrape all new data and add to the database.
+    #Rebuild the weeks holding daily prices changed since the last build, for
+    #all tickers at once
     wp_errors = []
     run_time = ProcessTime()
-    for _,r in tqdm(latest_dates_df.iterrows(), total=latest_dates_df.shape[0], desc="Process weekly prices"):
-        logger.info(f'\n{len(run_time.lap_li)} RUNNING FOR -> {r.id}, {r.ticker}')
-        try:
-            #Get new price data if neccesary
-            if r.max_date < en_date:
-                process_weekly_prices(
-                    r.id,
-                    split_from_date=r.max_date,
-                    
-                    )
-            else:
-                logger.info('No new records to collect')
-                continue
-        except Exception as e:
-            logger.error(e)
-            wp_errors.append({'ticker':r.ticker,"error":e})
-        #Lap
-        logger.info(run_time.lap())
-        logger.info(run_time.show_latest_lap_time(show_time=True))
+    try:
+        update_weekly_prices_from_changes()
+    except Exception as e:
+        logger.error(e)
+        wp_errors.append({'ticker':'ALL',"error":e})
     logger.info('\n\n')
     logger.info(f"WEEKLY SCRAPE RUN TIME - {run_time.end()}")
 
@@ -144,6 +163,9 @@ def full_scrape():
     ####################
 
     logger.info(f'\nDAILY ERROR COUNT -> {len(dp_errors)}')
+    scrape_statuses = pd.Series([e["status"] or "no response" for e in dp_errors if "url" in e], dtype=object)
+    if scrape_statuses.shape[0]:
+        logger.info(f'SCRAPE FAILURES BY STATUS -> {scrape_statuses.value_counts().to_dict()}')
     if len(dp_errors) > 0:
         logger.info('DALIY ERRORS ->')
         for e in dp_errors:
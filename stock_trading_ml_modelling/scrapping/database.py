@@ -1,10 +1,36 @@
 """Functions for adding data to the database"""
 import pandas as pd
+from sqlalchemy import func
 
 from stock_trading_ml_modelling.database.get_data import sqlaq_to_df
 from stock_trading_ml_modelling.database import ticker, ticker_market, daily_price, weekly_price
+from stock_trading_ml_modelling.database.models import engine, Session as session
+from stock_trading_ml_modelling.database.models.prices import create_db, migrate_price_changes, TickerLatest
+from stock_trading_ml_modelling.database.latest_data import _rebuild_latest
 from stock_trading_ml_modelling.utils.log import logger
 
+def prepare_db(engine=engine, session=session):
+    """Function to bring the database up to what the scrape needs so no 
+    separate migration has to be run first. The ticker_latest summary and 
+    the price_changes journal are created if missing, price_changes is moved
+    to AUTOINCREMENT ids and an empty ticker_latest is filled from the price
+    tables (otherwise every ticker would be scraped from 1970).
+    
+    args:
+    ----
+    engine - sqla engine:engine - the database to prepare
+    session - sqla session:None - the db session object
+
+    returns:
+    ----
+    None
+    """
+    create_db(engine)
+    if migrate_price_changes(engine):
+        logger.info("Rebuilt price_changes with AUTOINCREMENT ids")
+    if not session.query(func.count(TickerLatest.ticker_id)).scalar():
+        logger.info(f"Built ticker_latest for {_rebuild_latest(session=session)} tickers")
+
 def create_new_tickers(tick_scrape):
     """Function to find tickers whcih have not bee seen before and add to the
     database.
@@ -0,0 +1,439 @@
+"""Shared engine for the async web scrapes
+
+The engine owns one event loop, run in a background thread, and one
+long-lived aiohttp session on it so connections, keep-alive and the DNS
+cache are reused by every scrape in the process. Requests are limited by a
+global and a per host semaphore, and the start of requests to each host by
+a token bucket. Throttled and failed requests are retried with exponential
+backoff and jitter, honouring any Retry-After header. A url which still
+fails raises ScrapeError. The engine keeps throughput counters.
+
+Given a ResponseCache the engine serves urls from it before going to the
+network and caches every body fetched.
+
+CPU bound work, such as parsing the pages, is run off the loop with
+run_cpu on the engine's parse pool so it overlaps the requests in flight.
+
+Synchronous code runs coroutines on the engine with run:
+    engine = get_scrape_engine()
+    body = engine.run(engine.fetch(url))
+"""
+import os
+import time
+import atexit
+import random
+import asyncio
+import threading
+import multiprocessing
+import datetime as dt
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+import aiohttp
+
+from stock_trading_ml_modelling.config import WEB_SCRAPE_CONCURRENCY, WEB_SCRAPE_PER_HOST, \
+    WEB_SCRAPE_POOL_SIZE, WEB_SCRAPE_TIMEOUT, WEB_SCRAPE_CONNECT_TIMEOUT, WEB_SCRAPE_KEEPALIVE, \
+    WEB_SCRAPE_DNS_TTL, WEB_SCRAPE_ATTEMPTS, WEB_SCRAPE_BACKOFF_BASE, WEB_SCRAPE_BACKOFF_MAX, \
+    WEB_SCRAPE_RATE_LIMIT, WEB_SCRAPE_CACHE_ENABLED, WEB_SCRAPE_CACHE_REPLAY, WEB_SCRAPE_PARSE_POOL, \
+    WEB_SCRAPE_PARSE_WORKERS
+from stock_trading_ml_modelling.utils.log import logger
+from stock_trading_ml_modelling.scrapping.response_cache import ResponseCache
+
+HEADERS = {'User-Agent': 'Mozilla/5.0'}
+COOKIES = dict(BCPermissionLevel='PERSONAL')
+#Responses worth trying again, anything else other than 200 is permanent
+RETRY_STATUSES = {408, 425, 429, 500, 502, 503, 504}
+
+class ScrapeError(Exception):
+    """A url which could not be fetched"""
+    def __init__(self, url, status=None, attempts=0, reason=None):
+        """
+        args:
+        ----
+        url - str - the url requested
+        status - int:None - the last http status, None if no response came back
+        attempts - int:0 - the requests made
+        reason - str:None - the last connection error
+        """
+        self.url = url
+        self.status = status
+        self.attempts = attempts
+        self.reason = reason or (f"HTTP {status}" if status else None)
+        super().__init__(f"{url} failed after {attempts} attempts -> {self.reason}")
+
+    def to_dict(self):
+        return {"url":self.url, "status":self.status, "attempts":self.attempts, "reason":self.reason}
+
+class TokenBucket:
+    def __init__(self, rate=None, burst=1):
+        """Limits how often requests start, tokens are added at rate per second
+        up to burst and each request takes one
+
+        args:
+        ----
+        rate - float:None - the tokens added per second, unlimited if None or 0
+        burst - int:1 - the most tokens held
+        """
+        self.rate = rate
+        self.burst = max(burst or 1, 1)
+        self.tokens = float(self.burst)
+        self.updated = time.monotonic()
+        self.paused_until = 0.
+
+    def pause(self, seconds):
+        """Function to hold back every request for seconds, then restart from
+        an empty bucket"""
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+        self.tokens = 0.
+        self.updated = self.paused_until
+
+    async def acquire(self):
+        """Wait for a token
+
+        returns:
+        ----
+        float - the seconds waited
+        """
+        waited = 0.
+        while True:
+            now = time.monotonic()
+            if now < self.paused_until:
+                delay = self.paused_until - now
+            elif not self.rate:
+                return waited
+            else:
+                self.tokens = min(self.burst, self.tokens + max(now - self.updated, 0.) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return waited
+                delay = (1 - self.tokens) / self.rate
+            await asyncio.sleep(delay)
+            waited += delay
+
+def parse_retry_after(value):
+    """Function to read a Retry-After header, given in seconds or as a date
+
+    returns:
+    ----
+    float - the seconds to wait, None if missing or unreadable
+    """
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.)
+    except ValueError:
+        pass
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=dt.timezone.utc)
+    return max((when - dt.datetime.now(dt.timezone.utc)).total_seconds(), 0.)
+
+class ScrapeEngine:
+    def __init__(self,
+        concurrency=WEB_SCRAPE_CONCURRENCY,
+        per_host=WEB_SCRAPE_PER_HOST,
+        pool_size=WEB_SCRAPE_POOL_SIZE,
+        timeout=WEB_SCRAPE_TIMEOUT,
+        connect_timeout=WEB_SCRAPE_CONNECT_TIMEOUT,
+        keepalive_timeout=WEB_SCRAPE_KEEPALIVE,
+        dns_cache_ttl=WEB_SCRAPE_DNS_TTL,
+        attempts=WEB_SCRAPE_ATTEMPTS,
+        backoff_base=WEB_SCRAPE_BACKOFF_BASE,
+        backoff_max=WEB_SCRAPE_BACKOFF_MAX,
+        rate_limit=WEB_SCRAPE_RATE_LIMIT,
+        cache=None,
+        parse_pool=WEB_SCRAPE_PARSE_POOL,
+        parse_workers=WEB_SCRAPE_PARSE_WORKERS
+        ):
+        """
+        args:
+        ----
+        concurrency - int:WEB_SCRAPE_CONCURRENCY - the max requests in flight
+        per_host - int:WEB_SCRAPE_PER_HOST - the max requests in flight to one host
+        pool_size - int:WEB_SCRAPE_POOL_SIZE - the max open connections
+        timeout - float:WEB_SCRAPE_TIMEOUT - the seconds allowed for each request
+        connect_timeout - float:WEB_SCRAPE_CONNECT_TIMEOUT - the seconds allowed to connect
+        keepalive_timeout - float:WEB_SCRAPE_KEEPALIVE - the seconds idle connections are kept
+        dns_cache_ttl - int:WEB_SCRAPE_DNS_TTL - the seconds host lookups are cached
+        attempts - int:WEB_SCRAPE_ATTEMPTS - the tries made for each url
+        backoff_base - float:WEB_SCRAPE_BACKOFF_BASE - the seconds the backoff 
+            starts from, doubled after each attempt
+        backoff_max - float:WEB_SCRAPE_BACKOFF_MAX - the most seconds waited 
+            between attempts, including for Retry-After
+        rate_limit - dict:WEB_SCRAPE_RATE_LIMIT - rate and burst of each 
+            host's token bucket, with overrides by host name under hosts
+        cache - ResponseCache:None - the cache urls are served from and 
+            bodies are saved to
+        parse_pool - str:WEB_SCRAPE_PARSE_POOL - where run_cpu runs work, 
+            "process" for a process pool, "thread" for a thread pool (for 
+            parsers which release the GIL) or "none" to run on the loop
+        parse_workers - int:WEB_SCRAPE_PARSE_WORKERS - the size of the parse
+            pool, the cpu count if None
+        """
+        self.concurrency = concurrency
+        self.per_host = per_host
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout
+        self.keepalive_timeout = keepalive_timeout
+        self.dns_cache_ttl = dns_cache_ttl
+        self.attempts = attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.rate_limit = rate_limit or {}
+        self.cache = cache
+        self.parse_pool = str(parse_pool).lower()
+        self.parse_workers = parse_workers or os.cpu_count()
+        self._executor = None
+        self.loop = None
+        self.thread = None
+        self.session = None
+        self._semaphore = None
+        self._host_semaphores = {}
+        self._buckets = {}
+        self._lock = threading.Lock()
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.requests = 0
+        self.responses = 0
+        self.failures = 0
+        self.cache_hits = 0
+        self.retries = 0
+        self.throttled = 0
+        self.rate_wait = 0.
+        self.bytes = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.request_time = 0.
+        self.started = time.monotonic()
+
+    def stats(self):
+        """Function to get the throughput counters since the last reset
+
+        returns:
+        ----
+        dict - requests, responses, failures, cache_hits, retries, throttled (429 
+            responses), rate_wait (seconds held by the token buckets), bytes,
+            max_in_flight, elapsed, requests_per_sec, mb_per_sec and 
+            mean_latency (seconds)
+        """
+        elapsed = max(time.monotonic() - self.started, 1e-9)
+        return {
+            "requests":self.requests,
+            "responses":self.responses,
+            "failures":self.failures,
+            "cache_hits":self.cache_hits,
+            "retries":self.retries,
+            "throttled":self.throttled,
+            "rate_wait":round(self.rate_wait, 3),
+            "bytes":self.bytes,
+            "max_in_flight":self.max_in_flight,
+            "elapsed":round(elapsed, 3),
+            "requests_per_sec":round(self.requests / elapsed, 3),
+            "mb_per_sec":round(self.bytes / elapsed / 1024 ** 2, 3),
+            "mean_latency":round(self.request_time / self.requests, 3) if self.requests else None,
+            }
+
+    def start(self):
+        """Function to start the engine's event loop thread and open the
+        session on it"""
+        with self._lock:
+            if self.thread is None:
+                self.loop = asyncio.new_event_loop()
+                self._executor = self._new_executor()
+                self.thread = threading.Thread(target=self.loop.run_forever, name="ScrapeEngine", daemon=True)
+                self.thread.start()
+                asyncio.run_coroutine_threadsafe(self._open(), self.loop).result()
+                atexit.register(self.close)
+        return self
+
+    def _new_executor(self):
+        if self.parse_pool == "process":
+            #Spawn rather than fork, the process already runs the loop thread
+            return ProcessPoolExecutor(self.parse_workers, mp_context=multiprocessing.get_context("spawn"))
+        if self.parse_pool == "thread":
+            return ThreadPoolExecutor(self.parse_workers, thread_name_prefix="ScrapeParse")
+        return None
+
+    async def _open(self):
+        connector = aiohttp.TCPConnector(
+            limit=self.pool_size,
+            limit_per_host=self.per_host,
+            ttl_dns_cache=self.dns_cache_ttl,
+            keepalive_timeout=self.keepalive_timeout
+            )
+        self.session = aiohttp.ClientSession(
+            connector=connector,
+            headers=HEADERS,
+            cookies=COOKIES,
+            timeout=aiohttp.ClientTimeout(total=self.timeout, connect=self.connect_timeout)
+            )
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        self._host_semaphores = {}
+        self._buckets = {}
+
+    def submit(self, coro):
+        """Function to schedule a coroutine on the engine without waiting
+
+        returns:
+        ----
+        concurrent.futures.Future
+        """
+        self.start()
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def run(self, coro):
+        """Function to run a coroutine on the engine and wait for its result,
+        from any thread other than the engine's own"""
+        return self.submit(coro).result()
+
+    def close(self):
+        """Function to close the session and stop the loop thread"""
+        with self._lock:
+            if self.thread is None:
+                return
+            asyncio.run_coroutine_threadsafe(self.session.close(), self.loop).result()
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.thread.join()
+            self.loop.close()
+            if self._executor is not None:
+                self._executor.shutdown(cancel_futures=True)
+            self.thread, self.loop, self.session, self._executor = None, None, None, None
+            atexit.unregister(self.close)
+
+    async def run_cpu(self, func, *args):
+        """Function to run CPU bound work on the parse pool, or inline if there
+        is no pool. With a process pool func and args must be picklable.
+
+        returns:
+        ----
+        the result of func(*args)
+        """
+        if self._executor is None:
+            return func(*args)
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    def _host_semaphore(self, url):
+        host = urlsplit(url).netloc
+        if host not in self._host_semaphores:
+            self._host_semaphores[host] = asyncio.Semaphore(self.per_host)
+        return self._host_semaphores[host]
+
+    def _bucket(self, url):
+        host = urlsplit(url).netloc
+        if host not in self._buckets:
+            limits = {k:v for k,v in self.rate_limit.items() if k != "hosts"}
+            limits.update(self.rate_limit.get("hosts", {}).get(urlsplit(url).hostname, {}))
+            self._buckets[host] = TokenBucket(limits.get("rate"), limits.get("burst", 1))
+        return self._buckets[host]
+
+    def backoff(self, attempt, retry_after=None):
+        """Function to get the seconds to wait before trying again, Retry-After
+        if the server gave one otherwise exponential backoff with full jitter
+
+        args:
+        ----
+        attempt - int - the attempts made so far, from 1
+        retry_after - float:None - the seconds asked for by the server
+
+        returns:
+        ----
+        float
+        """
+        if retry_after is not None:
+            return min(retry_after, self.backoff_max)
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** (attempt - 1)))
+
+    async def _request(self, url):
+        """Make one request within the concurrency and rate limits"""
+        async with self._host_semaphore(url):
+            self.rate_wait += await self._bucket(url).acquire()
+            async with self._semaphore:
+                self.requests += 1
+                self.in_flight += 1
+                self.max_in_flight = max(self.max_in_flight, self.in_flight)
+                st = time.monotonic()
+                try:
+                    async with self.session.get(url) as resp:
+                        body = await resp.read() if resp.status == 200 else None
+                        return resp.status, body, parse_retry_after(resp.headers.get("Retry-After"))
+                finally:
+                    self.in_flight -= 1
+                    self.request_time += time.monotonic() - st
+
+    async def fetch(self, url):
+        """Function to get the body of a url. Connection errors and throttled
+        or server error responses are tried again, up to attempts times, 
+        after a backoff. A 429 response also pauses the host's token bucket.
+        Cached urls are returned without a request, in replay mode urls not 
+        in the cache fail.
+
+        returns:
+        ----
+        str - the decoded body
+
+        raises:
+        ----
+        ScrapeError - on a permanent error response or once every attempt 
+            has failed
+        """
+        loop = asyncio.get_running_loop()
+        if self.cache is not None:
+            #The cache reads and writes files so is kept off the loop
+            body = await loop.run_in_executor(None, self.cache.get, url)
+            if body is not None:
+                self.cache_hits += 1
+                return body.decode("utf-8")
+            if self.cache.replay:
+                self.failures += 1
+                raise ScrapeError(url, attempts=0, reason="not in the replay cache")
+        status, reason = None, None
+        for attempt in range(1, self.attempts + 1):
+            retry_after = None
+            try:
+                status, body, retry_after = await self._request(url)
+                reason = None
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                status, reason = None, repr(e)
+                logger.debug(f"Request to {url} failed -> {reason}")
+            if status == 200:
+                self.responses += 1
+                self.bytes += len(body)
+                if self.cache is not None:
+                    await loop.run_in_executor(None, self.cache.put, url, body)
+                return body.decode("utf-8")
+            if status is not None and status not in RETRY_STATUSES:
+                break
+            if attempt == self.attempts:
+                break
+            delay = self.backoff(attempt, retry_after)
+            if status == 429:
+                self.throttled += 1
+                self._bucket(url).pause(delay)
+            logger.debug(f"Retrying {url} in {delay:.2f}s -> {reason or status}")
+            self.retries += 1
+            await asyncio.sleep(delay)
+        self.failures += 1
+        raise ScrapeError(url, status=status, attempts=attempt, reason=reason)
+
+#The engine shared by the process
+_engine = {"engine":None}
+_engine_lock = threading.Lock()
+
+def get_scrape_engine():
+    """Function to get the process wide scrape engine, started on first use
+
+    returns:
+    ----
+    ScrapeEngine
+    """
+    with _engine_lock:
+        if _engine["engine"] is None:
+            cache = ResponseCache() if WEB_SCRAPE_CACHE_ENABLED or WEB_SCRAPE_CACHE_REPLAY else None
+            _engine["engine"] = ScrapeEngine(cache=cache)
+        return _engine["engine"].start()
@@ -0,0 +1,210 @@
+"""On disk cache of the responses fetched by the scrape engine
+
+Bodies are zlib compressed and stored once per distinct content, named by
+the sha256 of the body:
+    <WEB_SCRAPE_CACHE_PATH>/blobs/<digest[:2]>/<digest>.z
+    <WEB_SCRAPE_CACHE_PATH>/index.db
+
+The sqlite index maps each url to its blob with the time it was fetched, when
+it expires and when it was last read. Price pages whose window ends before
+today never change so are kept until evicted, any other url expires after
+recent_ttl seconds. Once the blobs pass max_bytes the least recently read
+urls are evicted.
+
+In replay mode entries are served whatever their age and nothing is fetched,
+so a cache filled by a real run can be replayed offline by tests and
+benchmarks.
+"""
+import os
+import time
+import zlib
+import sqlite3
+import hashlib
+import threading
+import datetime as dt
+from urllib.parse import urlsplit, parse_qs
+
+from stock_trading_ml_modelling.config import WEB_SCRAPE_CACHE_PATH, WEB_SCRAPE_CACHE_MAX_BYTES, \
+    WEB_SCRAPE_CACHE_RECENT_TTL, WEB_SCRAPE_CACHE_REPLAY
+
+def window_end(url):
+    """Function to get the end of the date window of a price url, from its
+    period2 parameter (seconds since 1970-01-01)
+
+    returns:
+    ----
+    datetime - None if the url has no window
+    """
+    period2 = parse_qs(urlsplit(url).query).get("period2")
+    try:
+        return dt.datetime.fromtimestamp(int(period2[0]))
+    except (TypeError, ValueError, OverflowError, OSError):
+        return None
+
+class ResponseCache:
+    def __init__(self,
+        path=WEB_SCRAPE_CACHE_PATH,
+        max_bytes=WEB_SCRAPE_CACHE_MAX_BYTES,
+        recent_ttl=WEB_SCRAPE_CACHE_RECENT_TTL,
+        replay=WEB_SCRAPE_CACHE_REPLAY
+        ):
+        """
+        args:
+        ----
+        path - str:WEB_SCRAPE_CACHE_PATH - the folder holding the cache
+        max_bytes - int:WEB_SCRAPE_CACHE_MAX_BYTES - the max total size of the
+            compressed bodies
+        recent_ttl - float:WEB_SCRAPE_CACHE_RECENT_TTL - the seconds a url is
+            kept unless its window ends before today
+        replay - bool:WEB_SCRAPE_CACHE_REPLAY - serve entries whatever their
+            age and never fetch
+        """
+        self.path = path
+        self.max_bytes = max_bytes
+        self.recent_ttl = recent_ttl
+        self.replay = replay
+        self._lock = threading.Lock()
+        os.makedirs(os.path.join(path, "blobs"), exist_ok=True)
+        self._conn = sqlite3.connect(os.path.join(path, "index.db"), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""CREATE TABLE IF NOT EXISTS entries (
+            url TEXT PRIMARY KEY,
+            digest TEXT NOT NULL,
+            fetched_at REAL NOT NULL,
+            expires_at REAL,
+            accessed_at REAL NOT NULL
+            )""")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS ix_entries_accessed ON entries (accessed_at)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS ix_entries_digest ON entries (digest)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS blobs (digest TEXT PRIMARY KEY, size INTEGER NOT NULL)")
+        self._conn.commit()
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.evictions = 0
+
+    def _blob_path(self, digest):
+        return os.path.join(self.path, "blobs", digest[:2], f"{digest}.z")
+
+    def ttl(self, url):
+        """Function to get the seconds a url is kept, None to keep it until
+        evicted because its window is entirely in the past"""
+        end = window_end(url)
+        if end is not None and end.date() < dt.date.today():
+            return None
+        return self.recent_ttl
+
+    @property
+    def bytes(self):
+        with self._lock:
+            return self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM blobs").fetchone()[0]
+
+    def stats(self):
+        return {"hits":self.hits, "misses":self.misses, "stale":self.stale,
+            "evictions":self.evictions, "bytes":self.bytes}
+
+    def get(self, url):
+        """Function to get the cached body of a url
+
+        returns:
+        ----
+        bytes - None if not cached or expired
+        """
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT digest, expires_at FROM entries WHERE url = ?", (url,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            digest, expires_at = row
+            if not self.replay and expires_at is not None and expires_at < now:
+                self.stale += 1
+                self.misses += 1
+                return None
+            try:
+                with open(self._blob_path(digest), "rb") as f:
+                    body = zlib.decompress(f.read())
+            except (OSError, zlib.error):
+                #The blob has gone, drop the entry
+                self._conn.execute("DELETE FROM entries WHERE url = ?", (url,))
+                self._drop_orphan(digest)
+                self._conn.commit()
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE entries SET accessed_at = ? WHERE url = ?", (now, url))
+            self._conn.commit()
+            self.hits += 1
+            return body
+
+    def put(self, url, body, ttl=-1):
+        """Function to cache the body of a url, then evict the least recently
+        read urls while the cache is over max_bytes
+
+        args:
+        ----
+        url - str - the url fetched
+        body - bytes - the response body
+        ttl - float:-1 - the seconds to keep the url, None to keep it until
+            evicted, from the ttl policy if -1
+        """
+        ttl = self.ttl(url) if ttl == -1 else ttl
+        now = time.time()
+        digest = hashlib.sha256(body).hexdigest()
+        fp = self._blob_path(digest)
+        with self._lock:
+            if not self._conn.execute("SELECT 1 FROM blobs WHERE digest = ?", (digest,)).fetchone() \
+                or not os.path.isfile(fp):
+                data = zlib.compress(body)
+                os.makedirs(os.path.dirname(fp), exist_ok=True)
+                tmp = f"{fp}.{os.getpid()}.{threading.get_ident()}.tmp"
+                with open(tmp, "wb") as f:
+                    f.write(data)
+                os.replace(tmp, fp)
+                self._conn.execute("INSERT OR REPLACE INTO blobs (digest, size) VALUES (?, ?)", (digest, len(data)))
+            old = self._conn.execute("SELECT digest FROM entries WHERE url = ?", (url,)).fetchone()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO entries (url, digest, fetched_at, expires_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                (url, digest, now, None if ttl is None else now + ttl, now)
+                )
+            if old is not None and old[0] != digest:
+                self._drop_orphan(old[0])
+            self._evict()
+            self._conn.commit()
+
+    def _drop_orphan(self, digest):
+        """Function to delete a blob no url points at"""
+        if self._conn.execute("SELECT 1 FROM entries WHERE digest = ? LIMIT 1", (digest,)).fetchone():
+            return
+        self._conn.execute("DELETE FROM blobs WHERE digest = ?", (digest,))
+        try:
+            os.remove(self._blob_path(digest))
+        except FileNotFoundError:
+            pass
+
+    def _evict(self):
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM blobs").fetchone()[0]
+        while total > self.max_bytes:
+            row = self._conn.execute("SELECT url, digest FROM entries ORDER BY accessed_at LIMIT 1").fetchone()
+            if row is None:
+                break
+            self._conn.execute("DELETE FROM entries WHERE url = ?", (row[0],))
+            self._drop_orphan(row[1])
+            self.evictions += 1
+            total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM blobs").fetchone()[0]
+
+    def clear(self):
+        """Function to delete every entry and blob"""
+        with self._lock:
+            for (digest,) in self._conn.execute("SELECT digest FROM blobs").fetchall():
+                try:
+                    os.remove(self._blob_path(digest))
+                except FileNotFoundError:
+                    pass
+            self._conn.execute("DELETE FROM entries")
+            self._conn.execute("DELETE FROM blobs")
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
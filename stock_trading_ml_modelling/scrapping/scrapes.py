@@ -3,16 +3,15 @@ import re
 from tqdm import tqdm
 import pandas as pd
 import asyncio
-import nest_asyncio
-import aiohttp
 from bs4 import BeautifulSoup as bs
 
-from stock_trading_ml_modelling.config import WEB_ADDRS
+from stock_trading_ml_modelling.config import WEB_ADDRS, WEB_SCRAPE_MAX_DAYS
 from stock_trading_ml_modelling.utils.date import create_sec_ref_li
 from stock_trading_ml_modelling.utils.data import flatten_one
 from stock_trading_ml_modelling.utils.log import logger
 from stock_trading_ml_modelling.utils.scrape import get_soup, refine_soup
 from stock_trading_ml_modelling.utils.str_formatting import clean_col_name
+from stock_trading_ml_modelling.scrapping.engine import get_scrape_engine
 
 def scrape_num_pages(parent:dict=WEB_ADDRS, ref:str="ftse100"):
     #Fetch the data for ftse 100
@@ -22,65 +21,58 @@ def scrape_num_pages(parent:dict=WEB_ADDRS, ref:str="ftse100"):
     num_pages = int(re.sub('[^0-9]','', last_page.text))
     return num_pages
 
+def parse_page(func, content):
+    """Function to parse a page and run func on its soup, kept at module level
+    so it can be sent to a process pool"""
+    return func(bs(content, 'html.parser'))
+
 class AsyncScrape:
-    def __init__(self, func, urls, desc=None):
+    def __init__(self, func, urls, desc=None, engine=None):
         """
         args:
         ----
-        func - callable - the function to run the scrape
-            MUST BE ASYNC FUNCTION
+        func - callable - the function run on the soup of each url, it must 
+            be picklable when the engine parses in a process pool
         urls - list - a list of urls to be scraped
         desc - str:None - the description to be usedin the tqdm
+        engine - ScrapeEngine:None - the engine making the requests, the 
+            process wide engine if None
         """
         self.func = func
         self.urls = urls
         self.desc = desc
-
-    async def async_request(self, session, url):
-        for i in range(5):
-            # try:
-            async with session.get(url) as resp:
-                if resp.status == 200:
-                    body = await resp.content.read()
-                    body = body.decode("utf-8")
-                    return body
-            # except Exception as e:
-            #     print(f"Error encountered in attempt {i} for url {url}")
-            #     print(e)
-            #     continue
-            # else:
-            #     raise Exception(f"Failed to get a response from url {url}")
-
-    async def get_soup(self, session, url):
-        content = await self.async_request(session, url)
-        soup = bs(content, 'html.parser')
-        return soup
-    
-    async def run_func(self, session, url):
-        soup = await self.get_soup(session, url)
-        return self.func(soup)
-
-    async def run_tasks(self):
-        tasks = []
-        semaphore = asyncio.Semaphore(1)
-        hdr = {'User-Agent': 'Mozilla/5.0'}
-        cookies = dict(BCPermissionLevel='PERSONAL')
-        async with semaphore:
-            async with aiohttp.ClientSession(headers=hdr, cookies=cookies) as session:
-                for url in tqdm(self.urls, total=len(self.urls), desc=self.desc):
-                    #fa will be a list of arguments
-                    tasks.append(
-                        self.run_func(session, url)
-                    )
+        self.engine = engine
+
+    async def async_request(self, url):
+        return await self.engine.fetch(url)
+
+    async def run_func(self, url):
+        """Fetch the url then parse it and run func on the engine's parse 
+        pool, so the loop keeps making requests meanwhile"""
+        content = await self.async_request(url)
+        return await self.engine.run_cpu(parse_page, self.func, content)
+
+    async def run_tasks(self, progress=True):
+        """Run every url through the engine, the engine limits how many are 
+        in flight. Results are returned in the order of the urls. The first
+        ScrapeError cancels the urls not yet fetched and is raised."""
+        tasks = [asyncio.ensure_future(self.run_func(url)) for url in self.urls]
+        with tqdm(total=len(tasks), desc=self.desc, disable=not progress) as pbar:
+            for task in tasks:
+                task.add_done_callback(lambda _: pbar.update(1))
+            try:
                 return await asyncio.gather(*tasks)
+            except BaseException:
+                for task in tasks:
+                    task.cancel()
+                raise
 
     def get_resps(self):
-        """Creaes an event loop and starts the async scrape"""
-        loop = asyncio.get_event_loop()
-        if isinstance(loop, asyncio.BaseEventLoop):
-            nest_asyncio.apply()
-        coro = self.run_tasks()
-        resps = loop.run_until_complete(coro)
+        """Runs the async scrape on the engine's event loop and waits for it"""
+        if self.engine is None:
+            self.engine = get_scrape_engine()
+        resps = self.engine.run(self.run_tasks())
+        logger.info(f"Scrape engine stats - {self.engine.stats()}")
         return resps
 
 class ScrapeTickers:
@@ -168,17 +160,27 @@ class ScrapePrices:
                 data.append({c:x.text for c,x in zip(cols, td)})
         return data
 
+    def urls(self):
+        """Function to plan the urls covering the dates, one per window of 
+        max_days"""
+        sec_ref_li = create_sec_ref_li(self.st_date, self.en_date, days=WEB_ADDRS.get("max_days", WEB_SCRAPE_MAX_DAYS))
+        return [WEB_ADDRS["share_price"].format(self.ticker, secs[0], secs[1], self.interval, self.interval) for secs in sec_ref_li]
+
     def scrape(self):
-        #clean ticker
-        sec_ref_li = create_sec_ref_li(self.st_date, self.en_date, days=WEB_ADDRS["max_days"])
-        #Prep urls
-        urls = [WEB_ADDRS["share_price"].format(self.ticker, secs[0], secs[1], self.interval, self.interval) for secs in sec_ref_li]
         #Scrape asyncronously
-        async_scrape = AsyncScrape(self.process_soup, urls)
+        async_scrape = AsyncScrape(self.process_soup, self.urls())
         data = flatten_one(async_scrape.get_resps())
         tick_df = pd.DataFrame(data)
         return tick_df
 
+    async def scrape_async(self, engine):
+        """Coroutine to scrape the prices on the engine's loop, alongside the
+        scrapes of other tickers"""
+        async_scrape = AsyncScrape(self.process_soup, self.urls(), engine=engine)
+        data = flatten_one(await async_scrape.run_tasks(progress=False))
+        tick_df = pd.DataFrame(data)
+        return tick_df
+
 class ScrapeBankHolidays:
     def __init__(self, year):
         self.year = year
@@ -1,4 +1,5 @@
 import numpy as np
+import pandas as pd
 
 def overlap(li:list):
     out = [v for v in li[0] if v in li[1]]
@@ -36,4 +37,21 @@ def np_count_values(np_array):
     x = np.array([1,1,1,2,2,2,5,25,1,1])
     y = np.bincount(x)
     ii = np.nonzero(y)[0]
-    return np.vstack((ii,y[ii])).T
\ No newline at end of file
+    return np.vstack((ii,y[ii])).T
+
+
+def row_fingerprints(df, cols, decimals=6):
+    """Function to hash the values of each row in cols. Values are rounded 
+    first so float noise from parsing or storage does not change the hash.
+    
+    args:
+    ----
+    df - pandas dataframe - the rows to hash
+    cols - list - the numeric columns to include
+    decimals - int:6 - the decimal places kept before hashing
+
+    returns:
+    ----
+    pandas series - uint64 hashes aligned to df
+    """
+    return pd.util.hash_pandas_object(df[cols].astype("float64").round(decimals), index=False)
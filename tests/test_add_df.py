@@ -0,0 +1,79 @@
+import datetime as dt
+
+import numpy as np
+import pandas as pd
+import pytest
+from sqlalchemy import create_engine, select
+from sqlalchemy.orm import sessionmaker, scoped_session
+
+from stock_trading_ml_modelling.database import daily_price
+from stock_trading_ml_modelling.database.add_data import _bulk_insert_df
+from stock_trading_ml_modelling.database.models.prices import create_db, DailyPrice
+
+
+def make_session(path):
+    engine = create_engine(f"sqlite:///{path}")
+    create_db(engine)
+    with engine.begin() as conn:
+        conn.exec_driver_sql("INSERT INTO ticker (id, ticker, company) VALUES (1, 'AAA', 'A'), (2, 'BBB', 'B')")
+    return scoped_session(sessionmaker(bind=engine))
+
+
+@pytest.fixture
+def sessions(tmp_path):
+    sessions = [make_session(tmp_path / "bulk.db"), make_session(tmp_path / "orm.db")]
+    yield sessions
+    for session in sessions:
+        engine = session.bind
+        session.remove()
+        engine.dispose()
+
+
+def make_prices():
+    dates = pd.to_datetime([dt.date(2020, 1, 6), dt.date(2020, 1, 7), dt.date(2020, 1, 8)])
+    return pd.DataFrame({
+        "date":list(dates) * 2,
+        "open":[1., 2., 3., 4., 5., 6.],
+        "high":2., "low":.5, "close":1.5, "change":.5, "volume":100.,
+        "week_start_date":pd.Timestamp("2020-01-06"),
+        #A missing ticker makes the column float
+        "ticker_id":[1, 1, 1, 2, 2, np.nan],
+        })
+
+
+def read_rows(session):
+    return session.execute(
+        select(DailyPrice.date, DailyPrice.week_start_date, DailyPrice.ticker_id, DailyPrice.open)
+            .order_by(DailyPrice.id)
+        ).all()
+
+
+def test_bulk_insert_matches_orm(sessions):
+    bulk, orm = sessions
+    df = make_prices()
+    #Chunks smaller than the frame
+    assert _bulk_insert_df(df, DailyPrice, session=bulk, chunk_size=4) == 6
+    bulk.commit()
+    daily_price.add_df(df, session=orm, bulk=False)
+
+    rows = read_rows(bulk)
+    assert rows == read_rows(orm)
+    assert len(rows) == 6
+    #Dates come back as dates and NaN is stored as NULL
+    assert rows[0] == (dt.date(2020, 1, 6), dt.date(2020, 1, 6), 1, 1.)
+    assert rows[-1] == (dt.date(2020, 1, 8), dt.date(2020, 1, 6), None, 6.)
+    with bulk.bind.connect() as conn:
+        assert conn.exec_driver_sql("SELECT COUNT(*) FROM daily_price WHERE ticker_id IS NULL").scalar() == 1
+
+
+def test_add_df_bulk_matches_orm(sessions):
+    bulk, orm = sessions
+    df = make_prices()
+    daily_price.add_df(df, session=bulk, bulk=True, chunk_size=4)
+    daily_price.add_df(df, session=orm, bulk=False)
+    assert read_rows(bulk) == read_rows(orm)
+    #The latest summary is kept for the tickers written
+    latest = "SELECT ticker_id, last_daily_date, daily_count FROM ticker_latest ORDER BY ticker_id"
+    with bulk.bind.connect() as b, orm.bind.connect() as o:
+        assert b.exec_driver_sql(latest).all() == o.exec_driver_sql(latest).all()
+        assert b.exec_driver_sql(latest).all() == [(1, "2020-01-08", 3), (2, "2020-01-07", 2)]
@@ -0,0 +1,45 @@
+import datetime as dt
+
+import pandas as pd
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker, scoped_session
+
+from stock_trading_ml_modelling.database.models.prices import create_db, DailyPrice
+from stock_trading_ml_modelling.database.update_data import _update_df, _bulk_update_df
+
+
+@pytest.fixture
+def session():
+    engine = create_engine("sqlite://")
+    create_db(engine)
+    session = scoped_session(sessionmaker(bind=engine))
+    session.execute(DailyPrice.__table__.insert(), [{
+        "ticker_id":1, "date":dt.date(2020, 1, d), "week_start_date":dt.date(2020, 1, 6),
+        "open":1., "high":1., "low":1., "close":1., "change":0., "volume":1.,
+        } for d in range(6, 11)])
+    session.commit()
+    yield session
+    session.remove()
+    engine.dispose()
+
+
+def closes(session):
+    return [r.close for r in session.query(DailyPrice).order_by(DailyPrice.id)]
+
+
+@pytest.mark.parametrize("update_from", [True, False])
+def test_bulk_update(session, update_from):
+    df = pd.DataFrame({"id":[2, 3, 99], "close":[5., 6., 7.]})
+    assert _bulk_update_df(df, DailyPrice, session=session, update_from=update_from) == 2
+    session.commit()
+    assert closes(session) == [1., 5., 6., 1., 1.]
+
+
+def test_update_modes_match(session):
+    df = pd.DataFrame({"id":[1, 5], "close":[3., 4.], "date":pd.to_datetime(["2020-01-06", "2020-01-10"])})
+    _update_df(df, DailyPrice, session=session, bulk=True)
+    bulk = closes(session)
+    _update_df(df.assign(close=1.), DailyPrice, session=session, bulk=False)
+    _update_df(df, DailyPrice, session=session, bulk=False)
+    assert closes(session) == bulk == [3., 1., 1., 1., 4.]
@@ -0,0 +1,85 @@
+import sqlite3
+
+import pytest
+
+from stock_trading_ml_modelling.copy_db import backup_db, attach_copy_db
+
+LEGACY_SCHEMA = """
+CREATE TABLE ticker (id INTEGER PRIMARY KEY, ticker VARCHAR NOT NULL, company VARCHAR NOT NULL, last_seen_date DATE);
+CREATE TABLE daily_price (id INTEGER PRIMARY KEY, date DATE NOT NULL, open FLOAT NOT NULL, high FLOAT NOT NULL,
+    low FLOAT NOT NULL, close FLOAT NOT NULL, change FLOAT NOT NULL, volume FLOAT NOT NULL,
+    week_start_date DATE NOT NULL, ticker_id INTEGER REFERENCES ticker (id));
+CREATE TABLE weekly_price (id INTEGER PRIMARY KEY, date DATE NOT NULL, open FLOAT NOT NULL, high FLOAT NOT NULL,
+    low FLOAT NOT NULL, close FLOAT NOT NULL, change FLOAT NOT NULL, volume FLOAT NOT NULL,
+    ticker_id INTEGER REFERENCES ticker (id));
+"""
+
+DAILY = [
+    #id, ticker_id, date, volume
+    (1, 1, "2020-01-02", 10.),
+    (2, 1, "2020-01-03", 10.),
+    (3, 2, "2020-01-02", 10.),
+    #Duplicate of id 1 with more volume, kept
+    (4, 1, "2020-01-02", 20.),
+    #Duplicate of id 3 with less volume, dropped
+    (5, 2, "2020-01-02", 5.),
+    ]
+
+
+@pytest.fixture
+def old_db(tmp_path):
+    path = tmp_path / "prices_old.db"
+    conn = sqlite3.connect(path)
+    conn.executescript(LEGACY_SCHEMA)
+    conn.execute("INSERT INTO ticker (id, ticker, company) VALUES (1, 'AAA', 'A'), (2, 'BBB', 'B')")
+    conn.executemany(
+        "INSERT INTO daily_price VALUES (?, ?, 1, 1, 1, 1, 0, ?, '2019-12-30', ?)",
+        [(i, d, v, t) for i, t, d, v in DAILY]
+        )
+    conn.execute("INSERT INTO weekly_price VALUES (1, '2019-12-30', 1, 1, 1, 1, 0, 30, 1)")
+    conn.commit()
+    conn.close()
+    return path
+
+
+def read(path, sql):
+    conn = sqlite3.connect(path)
+    try:
+        return conn.execute(sql).fetchall()
+    finally:
+        conn.close()
+
+
+def check_upgraded(path):
+    #Duplicates dropped, keeping the highest volume
+    assert read(path, "SELECT id FROM daily_price ORDER BY id") == [(2,), (3,), (4,)]
+    #Current schema, with the unique indexes and summary tables built
+    indexes = {r[0] for r in read(path, "SELECT name FROM sqlite_master WHERE type = 'index'")}
+    assert {"uix_daily_price_ticker_id_date", "uix_weekly_price_ticker_id_date"} <= indexes
+    assert "AUTOINCREMENT" in read(path, "SELECT sql FROM sqlite_master WHERE name = 'price_changes'")[0][0]
+    assert read(path, "SELECT ticker_id, daily_count, weekly_count FROM ticker_latest ORDER BY ticker_id") \
+        == [(1, 2, 1), (2, 1, 0)]
+
+
+def test_backup_db(old_db, tmp_path):
+    dest = tmp_path / "prices.db"
+    backup_db(str(old_db), str(dest))
+    #A plain backup is a page copy of the source
+    assert read(dest, "SELECT COUNT(*) FROM daily_price") == [(5,)]
+    assert read(dest, "SELECT name FROM sqlite_master WHERE name = 'ticker_latest'") == []
+
+    dest = tmp_path / "prices_upgraded.db"
+    backup_db(str(old_db), str(dest), upgrade=True)
+    check_upgraded(dest)
+    #The source is untouched
+    assert read(old_db, "SELECT COUNT(*) FROM daily_price") == [(5,)]
+
+
+def test_attach_copy_db(old_db, tmp_path):
+    dest = tmp_path / "prices.db"
+    counts = attach_copy_db(str(old_db), str(dest), chunk_rows=2)
+    assert counts == {"ticker":2, "daily_price":3, "weekly_price":1}
+    check_upgraded(dest)
+    assert read(dest, "SELECT id, ticker_id, volume FROM daily_price WHERE id = 4") == [(4, 1, 20.)]
+    with pytest.raises(FileExistsError):
+        attach_copy_db(str(old_db), str(dest))
@@ -0,0 +1,43 @@
+import datetime as dt
+
+import numpy as np
+import pandas as pd
+import pytest
+
+pytest.importorskip("pandas_ta")
+pytest.importorskip("sklearn")
+
+from stock_trading_ml_modelling.modelling.data_builder import DataBuilder
+from stock_trading_ml_modelling.modelling.price_data import PriceData
+
+
+def make_prices():
+    #Ticker 1 rises and ticker 2 starts lower, so looking ahead from the end
+    #of ticker 1 into ticker 2 would see a fall
+    rows = []
+    for ticker_id, closes in [(1, np.linspace(10, 20, 40)), (2, np.linspace(5, 8, 40))]:
+        for i, close in enumerate(closes):
+            rows.append({
+                "id":ticker_id * 1000 + i, "ticker_id":ticker_id, "date":dt.date(2020, 1, 1) + dt.timedelta(days=i),
+                "open":close - .5, "high":close + 1, "low":close - 1, "close":close, "change":.5, "volume":100.,
+                })
+    return pd.DataFrame(rows)
+
+
+def test_stream_matches_in_memory(monkeypatch):
+    prices = make_prices()
+    monkeypatch.setattr(PriceData, "get_prices", lambda self, **kwargs: prices.copy())
+    monkeypatch.setattr(PriceData, "iter_prices",
+        lambda self, **kwargs: ((t, df.reset_index(drop=True)) for t, df in prices.copy().groupby("ticker_id")))
+
+    in_memory = DataBuilder(window=5)
+    in_memory.create_data()
+    stream = DataBuilder(window=5)
+    stream.create_data(stream=True)
+
+    #No sell signal is taken from the next ticker's prices
+    assert "sell" not in in_memory.prices.loc[in_memory.prices.ticker_id == 1, "signal"].tolist()
+    assert in_memory.labels == stream.labels
+    np.testing.assert_array_equal(in_memory.prices_id, stream.prices_id)
+    np.testing.assert_array_equal(in_memory.y, stream.y)
+    np.testing.assert_allclose(in_memory.X, stream.X)
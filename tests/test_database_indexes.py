@@ -0,0 +1,125 @@
+import datetime as dt
+
+import pytest
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker, scoped_session
+
+from stock_trading_ml_modelling.database import daily_price, weekly_price
+from stock_trading_ml_modelling.database.get_data import sqlaq_to_df
+from stock_trading_ml_modelling.database.models.prices import create_db, create_indexes, Ticker
+
+
+@pytest.fixture
+def db():
+    """In memory database which records the sql of every statement run"""
+    engine = create_engine("sqlite://")
+    create_db(engine)
+    statements = []
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _record(conn, cursor, statement, parameters, context, executemany):
+        statements.append((statement, parameters))
+
+    session = scoped_session(sessionmaker(bind=engine))
+    yield engine, session, statements
+    session.remove()
+    engine.dispose()
+
+
+def query_plan(engine, statement, parameters):
+    with engine.connect() as conn:
+        rows = conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {statement}", parameters).fetchall()
+    return [r[-1] for r in rows]
+
+
+def run_and_explain(db, query):
+    engine, session, statements = db
+    session.execute(query.statement).fetchall()
+    return query_plan(engine, *statements[-1])
+
+
+INDEXES = {"uix_daily_price_ticker_id_date", "uix_weekly_price_ticker_id_date", "ix_ticker_ticker"}
+
+
+def index_names(engine):
+    with engine.connect() as conn:
+        return {r[0] for r in conn.exec_driver_sql("SELECT name FROM sqlite_master WHERE type = 'index'")}
+
+
+def test_price_indexes_created(db):
+    engine, _, _ = db
+    assert INDEXES <= index_names(engine)
+
+
+def test_create_indexes_on_existing_db(db):
+    engine, _, _ = db
+    #Mimic a database built before the indexes existed
+    with engine.begin() as conn:
+        for name in INDEXES:
+            conn.exec_driver_sql(f"DROP INDEX {name}")
+    assert not INDEXES & index_names(engine)
+    create_indexes(engine)
+    assert INDEXES <= index_names(engine)
+    #Safe to re-run
+    create_indexes(engine)
+
+
+@pytest.mark.parametrize("price_cl,index", [
+    (daily_price, "uix_daily_price_ticker_id_date"),
+    (weekly_price, "uix_weekly_price_ticker_id_date"),
+])
+def test_fetch_uses_index(db, price_cl, index):
+    query = price_cl.fetch(ticker_ids=[1, 2], from_date=dt.date(2020, 1, 1))
+    plan = run_and_explain(db, query)
+    assert any(p.startswith("SEARCH") and index in p for p in plan), plan
+
+
+@pytest.mark.parametrize("price_cl,index", [
+    (daily_price, "uix_daily_price_ticker_id_date"),
+    (weekly_price, "uix_weekly_price_ticker_id_date"),
+])
+def test_fetch_latest_uses_index(db, price_cl, index):
+    _, session, _ = db
+    #A to_date cannot be answered by ticker_latest so reads the price table
+    query = price_cl.fetch_latest(session, ticker_ids=[1, 2], to_date=dt.date(2020, 1, 1))
+    plan = run_and_explain(db, query)
+    assert any(index in p for p in plan), plan
+    assert not any(p.startswith("USE TEMP B-TREE FOR GROUP BY") for p in plan), plan
+
+
+def test_ticker_lookup_uses_index(db):
+    _, session, _ = db
+    query = session.query(Ticker).filter(Ticker.ticker == "ABC")
+    plan = run_and_explain(db, query)
+    assert any(p.startswith("SEARCH") and "ix_ticker_ticker" in p for p in plan), plan
+
+
+@pytest.mark.parametrize("price_cl", [daily_price, weekly_price])
+def test_fetch_latest_reads_summary(db, price_cl):
+    _, session, _ = db
+    query = price_cl.fetch_latest(session, ticker_ids=[1, 2])
+    plan = run_and_explain(db, query)
+    assert not any(p.startswith("SCAN") and "price" in p for p in plan), plan
+
+
+@pytest.mark.parametrize("price_cl,index", [
+    (daily_price, "uix_daily_price_ticker_id_date"),
+    (weekly_price, "uix_weekly_price_ticker_id_date"),
+])
+def test_fetch_last_n(db, price_cl, index):
+    engine, session, _ = db
+    tab = "daily_price" if price_cl is daily_price else "weekly_price"
+    extra = ", week_start_date" if tab == "daily_price" else ""
+    with engine.begin() as conn:
+        for ticker_id in [1, 2, 3]:
+            for day in range(1, 11):
+                conn.exec_driver_sql(
+                    f"INSERT INTO {tab} (ticker_id, date, open, high, low, close, change, volume{extra}) "
+                    f"VALUES (?, ?, 1, 1, 1, ?, 0, 1{', ?' if extra else ''})",
+                    (ticker_id, f"2020-01-{day:02d}", day) + ((f"2020-01-{day:02d}",) if extra else ())
+                    )
+    query = price_cl.fetch(ticker_ids=[2, 1], last_n=3, ordered=True)
+    df = sqlaq_to_df(query, session=session)
+    assert list(zip(df.ticker_id, df.close)) == [(1, 8), (1, 9), (1, 10), (2, 8), (2, 9), (2, 10)]
+    plan = run_and_explain(db, query)
+    assert any(p.startswith("SEARCH") and index in p for p in plan), plan
@@ -0,0 +1,46 @@
+import datetime as dt
+
+import numpy as np
+from sqlalchemy import create_engine, Column, Integer, MetaData, Table, select
+
+from stock_trading_ml_modelling.database.models.prices import create_db, convert_date_storage
+from stock_trading_ml_modelling.database.models.types import EpochDate, to_epoch_day, date_to_db, \
+    db_to_datetime64
+
+
+def test_epoch_date_round_trip():
+    engine = create_engine("sqlite://")
+    table = Table("t", MetaData(), Column("id", Integer, primary_key=True), Column("date", EpochDate))
+    table.metadata.create_all(engine)
+    with engine.begin() as conn:
+        conn.execute(table.insert(), [{"date":dt.date(2020, 1, 6)}, {"date":"2020-01-07"}])
+        assert conn.exec_driver_sql("SELECT date FROM t ORDER BY id").scalars().all() == [18267, 18268]
+        assert conn.execute(select(table.c.date).where(table.c.date >= dt.datetime(2020, 1, 7))).scalars().all() \
+            == [dt.date(2020, 1, 7)]
+
+
+def test_conversions():
+    assert to_epoch_day(np.datetime64("2020-01-06")) == 18267
+    assert date_to_db("2020-01-06 10:00", "epoch") == 18267
+    assert date_to_db(dt.datetime(2020, 1, 6, 10), "iso") == "2020-01-06"
+    assert (db_to_datetime64([18267], "epoch") == db_to_datetime64(["2020-01-06"], "iso")).all()
+
+
+def test_convert_date_storage():
+    engine = create_engine("sqlite://")
+    create_db(engine)
+    with engine.begin() as conn:
+        conn.exec_driver_sql("INSERT INTO ticker (id, ticker, company) VALUES (1, 'AAA', 'A')")
+        conn.exec_driver_sql(
+            "INSERT INTO daily_price (ticker_id, date, week_start_date, open, high, low, close, change, volume) "
+            "VALUES (1, '2020-01-07', '2020-01-06', 1, 1, 1, 1, 0, 1)"
+            )
+    assert convert_date_storage(engine, "epoch")["daily_price.date"] == 1
+    #Re-running leaves converted values alone
+    assert convert_date_storage(engine, "epoch")["daily_price.date"] == 0
+    with engine.connect() as conn:
+        assert conn.exec_driver_sql("SELECT date, week_start_date FROM daily_price").one() == (18268, 18267)
+    convert_date_storage(engine, "iso")
+    with engine.connect() as conn:
+        assert conn.exec_driver_sql("SELECT date, week_start_date FROM daily_price").one() \
+            == ("2020-01-07", "2020-01-06")
@@ -0,0 +1,74 @@
+import sqlite3
+
+import pytest
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker, scoped_session
+
+from stock_trading_ml_modelling.config import DB_TUNING_PROFILE, DB_TUNING_PROFILES
+from stock_trading_ml_modelling.database.models import apply_pragmas, db_profile, set_db_profile, _db_profile
+
+SYNCHRONOUS = {"OFF":0, "NORMAL":1, "FULL":2, "EXTRA":3}
+
+
+def read_pragmas(conn):
+    return {
+        "journal_mode":conn.execute("PRAGMA journal_mode").fetchone()[0].upper(),
+        "synchronous":conn.execute("PRAGMA synchronous").fetchone()[0],
+        "cache_size":conn.execute("PRAGMA cache_size").fetchone()[0],
+        }
+
+
+def expected(profile):
+    pragmas = DB_TUNING_PROFILES[profile]
+    return {
+        "journal_mode":str(pragmas["journal_mode"]).upper(),
+        "synchronous":SYNCHRONOUS[str(pragmas["synchronous"]).upper()],
+        "cache_size":int(pragmas["cache_size"]),
+        }
+
+
+@pytest.mark.parametrize("profile", list(DB_TUNING_PROFILES))
+def test_apply_pragmas(tmp_path, profile):
+    conn = sqlite3.connect(tmp_path / "prices.db")
+    try:
+        apply_pragmas(conn, profile)
+        assert read_pragmas(conn) == expected(profile)
+    finally:
+        conn.close()
+
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'prices.db'}")
+    #Tuned with the active profile, as the package engine is
+    event.listen(engine, "connect", lambda dbapi_conn, _: apply_pragmas(dbapi_conn))
+    yield engine
+    engine.dispose()
+
+
+def engine_pragmas(engine):
+    with engine.connect() as conn:
+        return read_pragmas(conn.connection.driver_connection)
+
+
+def test_db_profile_switches_and_restores(engine):
+    session = scoped_session(sessionmaker(bind=engine))
+    assert _db_profile["name"] == DB_TUNING_PROFILE
+    assert engine_pragmas(engine) == expected(DB_TUNING_PROFILE)
+    with db_profile("bulk_load", engine=engine, session=session):
+        assert _db_profile["name"] == "bulk_load"
+        #Pooled connections were dropped so new ones use the bulk pragmas
+        assert engine_pragmas(engine) == expected("bulk_load")
+    assert _db_profile["name"] == DB_TUNING_PROFILE
+    assert engine_pragmas(engine) == expected(DB_TUNING_PROFILE)
+
+    #Restored when the block raises
+    with pytest.raises(RuntimeError):
+        with db_profile("bulk_load", engine=engine, session=session):
+            raise RuntimeError
+    assert _db_profile["name"] == DB_TUNING_PROFILE
+    assert engine_pragmas(engine) == expected(DB_TUNING_PROFILE)
+
+    with pytest.raises(ValueError):
+        set_db_profile("missing", engine=engine, session=session)
+    assert _db_profile["name"] == DB_TUNING_PROFILE
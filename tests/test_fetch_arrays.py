@@ -0,0 +1,78 @@
+import datetime as dt
+
+import numpy as np
+import pandas as pd
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker, scoped_session
+
+import stock_trading_ml_modelling.database as database
+from stock_trading_ml_modelling.database import daily_price, weekly_price
+from stock_trading_ml_modelling.database.get_data import sqlaq_to_df, PRICE_FIELDS
+from stock_trading_ml_modelling.database.models.prices import create_db
+
+
+@pytest.fixture
+def session(tmp_path, monkeypatch):
+    engine = create_engine(f"sqlite:///{tmp_path / 'prices.db'}")
+    create_db(engine)
+    session = scoped_session(sessionmaker(bind=engine))
+    with engine.begin() as conn:
+        conn.exec_driver_sql("INSERT INTO ticker (id, ticker, company) VALUES (1, 'AAA', 'A'), (2, 'BBB', 'B'), (3, 'CCC', 'C')")
+    #Point fetch_df at the test db
+    monkeypatch.setattr(database, "session", session)
+    monkeypatch.setattr(database, "sqlaq_to_df", lambda query: sqlaq_to_df(query, session=session))
+    yield session
+    session.remove()
+    engine.dispose()
+
+
+def add_prices(session, table, ticker_id, dates):
+    df = pd.DataFrame([{
+        "ticker_id":ticker_id, "date":d,
+        "open":i + .1, "high":i + 1.2, "low":i - .3, "close":i + .4, "change":.5 * i, "volume":1000. * i,
+        } for i, d in enumerate(dates)])
+    if table == "daily_price":
+        df["week_start_date"] = [d - dt.timedelta(days=d.weekday()) for d in dates]
+    df.to_sql(table, con=session.bind, if_exists="append", index=False)
+
+
+def check_matches(arrays, df, dtype):
+    df = df.sort_values(["ticker_id","date"]).reset_index(drop=True)
+    assert arrays["ticker_id"].dtype == np.int32
+    assert arrays["date"].dtype == np.dtype("datetime64[D]")
+    assert arrays["offsets"].dtype == np.int64
+    for c in PRICE_FIELDS:
+        assert arrays[c].dtype == np.dtype(dtype)
+        np.testing.assert_allclose(arrays[c], df[c].values, rtol=1e-6)
+    assert arrays["ticker_id"].tolist() == df.ticker_id.tolist()
+    assert arrays["date"].tolist() == pd.to_datetime(df.date).dt.date.tolist()
+    #Each ticker covers offsets[i]:offsets[i+1]
+    sizes = df.groupby("ticker_id", sort=True).size()
+    assert arrays["tickers"].tolist() == sizes.index.tolist()
+    assert arrays["offsets"].tolist() == [0] + np.cumsum(sizes.values).tolist()
+
+
+@pytest.mark.parametrize("table, price_cl", [("daily_price", daily_price), ("weekly_price", weekly_price)])
+def test_fetch_arrays_matches_fetch_df(session, table, price_cl):
+    st = dt.date(2020, 1, 1)
+    #Inserted out of ticker order, with ticker 3 only before from_date
+    add_prices(session, table, 2, [st + dt.timedelta(days=i) for i in range(5)])
+    add_prices(session, table, 1, [st + dt.timedelta(days=i) for i in range(12)])
+    add_prices(session, table, 3, [st - dt.timedelta(days=i) for i in range(1, 4)])
+
+    for kwargs in [
+        {},
+        {"ticker_ids":[2, 3]},
+        {"from_date":st + dt.timedelta(days=2), "to_date":st + dt.timedelta(days=8)},
+        ]:
+        df = price_cl.fetch_df(ordered=True, cache=False, **kwargs)
+        assert df.shape[0]
+        check_matches(price_cl.fetch_arrays(session=session, **kwargs), df, "float32")
+        check_matches(price_cl.fetch_arrays(session=session, dtype="float64", **kwargs), df, "float64")
+
+    empty = price_cl.fetch_arrays(ticker_ids=[3], from_date=st, session=session)
+    assert empty["ticker_id"].shape == (0,)
+    assert empty["close"].dtype == np.float32
+    assert empty["offsets"].tolist() == [0]
+    assert empty["tickers"].tolist() == []
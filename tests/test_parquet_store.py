@@ -0,0 +1,83 @@
+import datetime as dt
+
+import pandas as pd
+import pytest
+from sqlalchemy import create_engine, delete
+from sqlalchemy.orm import sessionmaker, scoped_session
+
+from stock_trading_ml_modelling.database import daily_price
+from stock_trading_ml_modelling.database.changes_data import _log_changes_where
+from stock_trading_ml_modelling.database.models.prices import create_db, DailyPrice
+from stock_trading_ml_modelling.database.parquet_store import ParquetPriceStore
+
+FIELDS = ["ticker_id","date","close"]
+
+
+@pytest.fixture
+def session(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'prices.db'}")
+    create_db(engine)
+    session = scoped_session(sessionmaker(bind=engine))
+    with engine.begin() as conn:
+        conn.exec_driver_sql("INSERT INTO ticker (id, ticker, company) VALUES (1, 'AAA', 'A'), (2, 'BBB', 'B')")
+    yield session
+    session.remove()
+    engine.dispose()
+
+
+def make_prices(ticker_id, dates, close=1.):
+    return pd.DataFrame([{
+        "ticker_id":ticker_id, "date":d, "week_start_date":d,
+        "open":1., "high":1., "low":1., "close":close, "change":0., "volume":1.,
+        } for d in dates])
+
+
+def db_prices(session):
+    df = pd.read_sql("SELECT ticker_id, date, close FROM daily_price ORDER BY ticker_id, date", con=session.bind)
+    df["date"] = pd.to_datetime(df.date).dt.date
+    return df
+
+
+def store_prices(store):
+    df = store.fetch_df(columns=FIELDS)
+    df["date"] = pd.to_datetime(df.date).dt.date
+    return df
+
+
+def test_add_and_fetch(tmp_path):
+    store = ParquetPriceStore("daily_price", path=str(tmp_path))
+    assert store.add_df(pd.concat([
+        make_prices(1, [dt.date(2019, 12, 31), dt.date(2020, 1, 2)]),
+        make_prices(2, [dt.date(2020, 1, 2)]),
+        ])) == 3
+    #Matching (ticker_id, date) rows are overwritten
+    assert store.add_df(make_prices(1, [dt.date(2020, 1, 2), dt.date(2020, 1, 3)], close=2.)) == 1
+    df = store.fetch_df(ticker_ids=[1], from_date=dt.date(2020, 1, 1), columns=["date","close"])
+    assert df.values.tolist() == [[dt.date(2020, 1, 2), 2.], [dt.date(2020, 1, 3), 2.]]
+    df = store.fetch_df(to_date=dt.date(2020, 1, 2), columns=FIELDS)
+    assert df.values.tolist() == [
+        [1, dt.date(2019, 12, 31), 1.], [1, dt.date(2020, 1, 2), 2.], [2, dt.date(2020, 1, 2), 1.]]
+    assert store.fetch_df(ticker_ids=[3]).shape[0] == 0
+
+
+def test_sync_follows_updates_and_deletes(session, tmp_path):
+    store = ParquetPriceStore("daily_price", path=str(tmp_path / "parquet"))
+    daily_price.upsert_df(pd.concat([
+        make_prices(1, [dt.date(2019, 6, 3), dt.date(2020, 1, 2), dt.date(2020, 1, 3)]),
+        make_prices(2, [dt.date(2020, 1, 2)]),
+        ]), session=session)
+    #The first sync is a full export
+    assert store.sync_from_db(DailyPrice, session=session) == 3
+    pd.testing.assert_frame_equal(store_prices(store), db_prices(session), check_dtype=False)
+    assert store.sync_from_db(DailyPrice, session=session) == 0
+    #An update to an old row keeps its id
+    daily_price.upsert_df(make_prices(1, [dt.date(2019, 6, 3)], close=5.), session=session)
+    #Delete a ticker's only year and a single row of another
+    for where in [DailyPrice.ticker_id == 2, DailyPrice.date == dt.date(2020, 1, 3)]:
+        _log_changes_where(DailyPrice, where, session=session)
+        session.execute(delete(DailyPrice).where(where))
+    session.commit()
+    assert store.sync_from_db(DailyPrice, session=session) == 3
+    pd.testing.assert_frame_equal(store_prices(store), db_prices(session), check_dtype=False)
+    assert store.fetch_df(ticker_ids=[2]).shape[0] == 0
+    assert not (tmp_path / "parquet" / "daily_price" / "ticker_id=2").exists()
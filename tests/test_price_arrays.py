@@ -0,0 +1,71 @@
+import datetime as dt
+
+import numpy as np
+import pandas as pd
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker, scoped_session
+
+from stock_trading_ml_modelling.database.array_store import PriceArrayStore
+from stock_trading_ml_modelling.database.models.prices import create_db, DailyPrice
+from stock_trading_ml_modelling.modelling.price_data import PriceData
+
+
+@pytest.fixture
+def session(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'prices.db'}")
+    create_db(engine)
+    session = scoped_session(sessionmaker(bind=engine))
+    with engine.begin() as conn:
+        conn.exec_driver_sql("INSERT INTO ticker (id, ticker, company) VALUES (1, 'AAA', 'A'), (2, 'BBB', 'B'), (3, 'CCC', 'C')")
+    yield session
+    session.remove()
+    engine.dispose()
+
+
+def add_prices(session, ticker_id, dates):
+    pd.DataFrame([{
+        "ticker_id":ticker_id, "date":d, "week_start_date":d - dt.timedelta(days=d.weekday()),
+        "open":i, "high":i + 1, "low":i - 1, "close":i + .5, "change":0., "volume":100. * i,
+        } for i, d in enumerate(dates)]).to_sql("daily_price", con=session.bind, if_exists="append", index=False)
+
+
+def test_build_load_and_read(tmp_path, session):
+    today = dt.date.today()
+    dates_1 = [today - dt.timedelta(days=i) for i in range(10, 0, -1)]
+    dates_2 = [today - dt.timedelta(days=i) for i in range(3, 0, -1)]
+    #Insert out of order, the store is ordered by ticker_id then date
+    add_prices(session, 2, dates_2)
+    add_prices(session, 1, dates_1)
+
+    store = PriceArrayStore("daily_price", path=str(tmp_path / "arrays"))
+    assert store.build(DailyPrice, session=session, chunksize=4) == 13
+    store.load()
+    assert store.tickers.tolist() == [1, 2]
+    assert store.offsets.tolist() == [0, 10, 13]
+    assert store.arrays["close"].dtype == np.float32
+
+    prices = store.get(1, fields=["date","close"])
+    assert prices["date"].tolist() == dates_1
+    assert prices["close"].tolist() == [i + .5 for i in range(10)]
+    #Views onto the read only memory map
+    assert not prices["close"].flags.writeable
+    prices = store.get(1, fields=["date"], from_date=dates_1[2], to_date=dates_1[5])
+    assert prices["date"].tolist() == dates_1[2:6]
+    assert store.get(3, fields=["close"])["close"].shape == (0,)
+
+    windows = store.windows(1, "open", 4)
+    assert windows.shape == (7, 4)
+    assert windows[2].tolist() == [2, 3, 4, 5]
+    assert store.windows(2, "open", 4).shape == (0, 4)
+
+    #A rebuild swaps in the new rows
+    add_prices(session, 3, dates_2)
+    assert store.build(DailyPrice, session=session) == 16
+    assert store.load().tickers.tolist() == [1, 2, 3]
+
+    price_data = PriceData()
+    price_data.array_store = store
+    streamed = {t:p["date"].tolist() for t, p in price_data.iter_arrays(weeks=1, fields=["date"])}
+    #The day a week ago is before the lookback, as in get_prices
+    assert streamed == {1:dates_1[4:], 2:dates_2, 3:dates_2}
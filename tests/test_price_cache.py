@@ -0,0 +1,52 @@
+import datetime as dt
+
+import pandas as pd
+
+from stock_trading_ml_modelling.database.cache import QueryCache, make_key
+
+
+def frame(n):
+    return pd.DataFrame({"close":[1.0] * n})
+
+
+def test_key_ignores_ticker_order_and_date_type():
+    assert make_key("daily_price", [2, 1], dt.date(2020, 1, 1)) == make_key("daily_price", [1, 2], "2020-01-01")
+    assert make_key("daily_price", [1]) != make_key("weekly_price", [1])
+
+
+def test_hits_misses_and_copies():
+    cache = QueryCache(max_bytes=10**6)
+    key = make_key("daily_price", [1])
+    assert cache.get(key) is None
+    cache.put(key, frame(3))
+    df = cache.get(key)
+    df["close"] = 0.0
+    assert cache.get(key).close.tolist() == [1.0] * 3
+    assert cache.stats()["hits"] == 2 and cache.stats()["misses"] == 1
+
+
+def test_lru_eviction_by_bytes():
+    size = int(frame(100).memory_usage(index=True, deep=True).sum())
+    cache = QueryCache(max_bytes=size * 2)
+    keys = [make_key("daily_price", [i]) for i in range(3)]
+    cache.put(keys[0], frame(100))
+    cache.put(keys[1], frame(100))
+    cache.get(keys[0])
+    cache.put(keys[2], frame(100))
+    assert cache.get(keys[1]) is None
+    assert cache.get(keys[0]) is not None
+    assert cache.stats()["evictions"] == 1
+    assert cache.stats()["bytes"] <= size * 2
+
+
+def test_invalidate_by_table_and_tickers():
+    cache = QueryCache(max_bytes=10**6)
+    cache.put(make_key("daily_price", [1]), frame(1))
+    cache.put(make_key("daily_price", [2]), frame(1))
+    cache.put(make_key("daily_price", []), frame(1))
+    cache.put(make_key("weekly_price", [1]), frame(1))
+    #Queries over all tickers are dropped with those for the ticker written
+    assert cache.invalidate("daily_price", [1]) == 2
+    assert cache.get(make_key("daily_price", [2])) is not None
+    assert cache.get(make_key("weekly_price", [1])) is not None
+    assert cache.invalidate("daily_price") == 1
@@ -0,0 +1,78 @@
+import datetime as dt
+
+import pandas as pd
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker, scoped_session
+
+from stock_trading_ml_modelling.database import daily_price, price_changes
+from stock_trading_ml_modelling.database.models.prices import create_db, PriceChange
+
+
+@pytest.fixture
+def session():
+    engine = create_engine("sqlite://")
+    create_db(engine)
+    session = scoped_session(sessionmaker(bind=engine))
+    with engine.begin() as conn:
+        conn.exec_driver_sql("INSERT INTO ticker (id, ticker, company) VALUES (1, 'AAA', 'A'), (2, 'BBB', 'B')")
+    yield session
+    session.remove()
+    engine.dispose()
+
+
+def make_prices(ticker_id, days):
+    return pd.DataFrame([{
+        "ticker_id":ticker_id, "date":dt.date(2020, 1, d), "week_start_date":dt.date(2020, 1, 6),
+        "open":1., "high":1., "low":1., "close":1., "change":0., "volume":1.,
+        } for d in days])
+
+
+def test_writes_are_logged_per_ticker(session):
+    daily_price.upsert_df(pd.concat([make_prices(1, [6, 7, 8]), make_prices(2, [9])]), session=session)
+    changes = price_changes.pending("test", "daily_price", session=session)
+    assert changes[["ticker_id","min_date","max_date"]].values.tolist() == [
+        [1, dt.date(2020, 1, 6), dt.date(2020, 1, 8)],
+        [2, dt.date(2020, 1, 9), dt.date(2020, 1, 9)],
+        ]
+
+
+def test_consumer_watermark(session):
+    daily_price.upsert_df(make_prices(1, [6, 7]), session=session)
+    with price_changes.consume("test", "daily_price", session=session) as changes:
+        assert changes.shape[0] == 1
+    assert not price_changes.pending("test", "daily_price", session=session).shape[0]
+    #A failed consumer leaves its changes pending
+    daily_price.upsert_df(make_prices(2, [8]), session=session)
+    with pytest.raises(RuntimeError):
+        with price_changes.consume("test", "daily_price", session=session) as changes:
+            raise RuntimeError
+    assert price_changes.pending("test", "daily_price", session=session).ticker_id.tolist() == [2]
+    #Other consumers keep their own watermark
+    assert price_changes.pending("other", "daily_price", session=session).shape[0] == 2
+    price_changes.acknowledge("other", "daily_price", 1, session=session)
+    assert price_changes.prune(session=session) == 1
+    assert session.query(PriceChange).count() == 1
+
+
+def test_migrate_price_changes_keeps_ids_above_watermarks():
+    from stock_trading_ml_modelling.database.models.prices import migrate_price_changes
+    engine = create_engine("sqlite://")
+    create_db(engine)
+    #A journal created before AUTOINCREMENT, pruned empty after consumer ack'd id 5
+    with engine.begin() as conn:
+        conn.exec_driver_sql("DROP TABLE price_changes")
+        conn.exec_driver_sql("DELETE FROM sqlite_sequence")
+        conn.exec_driver_sql("""CREATE TABLE price_changes (id INTEGER NOT NULL PRIMARY KEY, table_name VARCHAR NOT NULL,
+            ticker_id INTEGER NOT NULL, min_date DATE, max_date DATE, run_id VARCHAR, created_at DATETIME)""")
+        conn.exec_driver_sql("INSERT INTO price_changes (id, table_name, ticker_id) VALUES (3, 'daily_price', 1)")
+        conn.exec_driver_sql("INSERT INTO change_consumer (name, table_name, last_change_id) VALUES ('test', 'daily_price', 5)")
+    assert migrate_price_changes(engine)
+    assert not migrate_price_changes(engine)
+    with engine.begin() as conn:
+        assert "AUTOINCREMENT" in conn.exec_driver_sql("SELECT sql FROM sqlite_master WHERE name = 'price_changes'").scalar()
+        assert conn.exec_driver_sql("SELECT id FROM price_changes").scalars().all() == [3]
+        conn.exec_driver_sql("DELETE FROM price_changes")
+        conn.exec_driver_sql("INSERT INTO price_changes (table_name, ticker_id) VALUES ('daily_price', 1)")
+        assert conn.exec_driver_sql("SELECT id FROM price_changes").scalar() == 6
+    engine.dispose()
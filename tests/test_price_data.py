@@ -0,0 +1,59 @@
+import datetime as dt
+
+import pandas as pd
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker, scoped_session
+
+import stock_trading_ml_modelling.database as database
+from stock_trading_ml_modelling.database.cache import price_cache
+from stock_trading_ml_modelling.database.get_data import sqlaq_to_df, sqlaq_to_df_by_ticker
+from stock_trading_ml_modelling.database.models.prices import create_db
+from stock_trading_ml_modelling.modelling import price_data
+from stock_trading_ml_modelling.modelling.price_data import PriceData
+
+
+@pytest.fixture
+def session(tmp_path, monkeypatch):
+    engine = create_engine(f"sqlite:///{tmp_path / 'prices.db'}")
+    create_db(engine)
+    session = scoped_session(sessionmaker(bind=engine))
+    with engine.begin() as conn:
+        conn.exec_driver_sql("INSERT INTO ticker (id, ticker, company) VALUES (1, 'AAA', 'A'), (2, 'BBB', 'B')")
+    #Point the price reads at the test db
+    monkeypatch.setattr(database, "session", session)
+    monkeypatch.setattr(database, "sqlaq_to_df", lambda query: sqlaq_to_df(query, session=session))
+    monkeypatch.setattr(price_data, "sqlaq_to_df_by_ticker", lambda query: sqlaq_to_df_by_ticker(query, session=session))
+    price_cache.clear()
+    yield session
+    price_cache.clear()
+    session.remove()
+    engine.dispose()
+
+
+def test_iter_prices_matches_get_prices(session):
+    today = dt.date.today()
+    dates = [today - dt.timedelta(days=i) for i in range(10, -1, -1)]
+    pd.DataFrame([{
+        "ticker_id":t, "date":d, "week_start_date":d - dt.timedelta(days=d.weekday()),
+        "open":1., "high":1., "low":1., "close":float(i), "change":0., "volume":1.,
+        } for t in [1, 2] for i, d in enumerate(dates)]).to_sql("daily_price", con=session.bind, if_exists="append", index=False)
+
+    prices = PriceData().get_prices(weeks=1, panel=False)
+    #The lookback starts the day after a week ago
+    assert pd.to_datetime(prices.date).dt.date.min() == today - dt.timedelta(days=6)
+    streamed = pd.concat([df for _, df in PriceData().iter_prices(weeks=1)], ignore_index=True)
+    pd.testing.assert_frame_equal(streamed, prices.reset_index(drop=True))
+
+
+def test_get_prices_reads_through_cache(session):
+    d = dt.date.today()
+    pd.DataFrame([{
+        "ticker_id":1, "date":d, "week_start_date":d - dt.timedelta(days=d.weekday()),
+        "open":1., "high":1., "low":1., "close":1., "change":0., "volume":1.,
+        }]).to_sql("daily_price", con=session.bind, if_exists="append", index=False)
+    hits = price_cache.stats()["hits"]
+    first = PriceData().get_prices(ticker_ids=[1], weeks=1)
+    #With the panel disabled the repeat is served from price_cache
+    pd.testing.assert_frame_equal(PriceData().get_prices(ticker_ids=[1], weeks=1), first)
+    assert price_cache.stats()["hits"] == hits + 1
@@ -0,0 +1,79 @@
+import datetime as dt
+
+import pandas as pd
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker, scoped_session
+
+from stock_trading_ml_modelling.database import daily_price
+from stock_trading_ml_modelling.database.changes_data import _ack_changes, _prune_changes
+from stock_trading_ml_modelling.database.models.prices import create_db, DailyPrice
+from stock_trading_ml_modelling.database.price_panel import PricePanel
+
+
+@pytest.fixture
+def session(tmp_path):
+    #data_version needs the writes to come from another connection
+    engine = create_engine(f"sqlite:///{tmp_path / 'prices.db'}")
+    create_db(engine)
+    session = scoped_session(sessionmaker(bind=engine))
+    with engine.begin() as conn:
+        conn.exec_driver_sql("INSERT INTO ticker (id, ticker, company) VALUES (1, 'AAA', 'A'), (2, 'BBB', 'B')")
+    yield session
+    session.remove()
+    engine.dispose()
+
+
+def make_prices(ticker_id, days, close=1.):
+    return pd.DataFrame([{
+        "ticker_id":ticker_id, "date":dt.date(2020, 1, d), "week_start_date":dt.date(2020, 1, 6),
+        "open":1., "high":1., "low":1., "close":close, "change":0., "volume":1.,
+        } for d in days])
+
+
+def test_panel_reads(session):
+    daily_price.upsert_df(pd.concat([make_prices(1, [6, 7, 8]), make_prices(2, [7])]), session=session)
+    panel = PricePanel(DailyPrice, session=session).load()
+    assert panel.ticker(1, from_date=dt.date(2020, 1, 7))["date"].tolist() == [dt.date(2020, 1, 7), dt.date(2020, 1, 8)]
+    assert panel.window(1, 2, to_date=dt.date(2020, 1, 7))["date"].tolist() == [dt.date(2020, 1, 6), dt.date(2020, 1, 7)]
+    assert panel.ticker(3)["close"].shape[0] == 0
+    asof = panel.asof(dt.date(2020, 1, 7))
+    assert asof[["ticker_id","date"]].values.tolist() == [[1, pd.Timestamp("2020-01-07")], [2, pd.Timestamp("2020-01-07")]]
+    panel.close()
+
+
+def test_panel_refreshes_changed_tickers(session):
+    daily_price.upsert_df(pd.concat([make_prices(1, [6, 7]), make_prices(2, [6])]), session=session)
+    panel = PricePanel(DailyPrice, session=session).load()
+    assert not panel.refresh()
+    daily_price.upsert_df(make_prices(2, [7, 8], close=2.), session=session)
+    assert panel.ticker(2)["close"].tolist() == [1., 2., 2.]
+    assert panel.ticker(1)["close"].tolist() == [1., 1.]
+    assert panel.refreshes == 1
+    daily_price.upsert_df(make_prices(1, [6], close=3.), session=session)
+    assert panel.ticker(1)["close"].tolist() == [3., 1.]
+    assert panel.tickers.tolist() == [1, 2]
+    panel.close()
+
+
+def test_panel_splices_after_ack_and_reloads_after_prune(session):
+    daily_price.upsert_df(pd.concat([make_prices(1, [6, 7]), make_prices(2, [6])]), session=session)
+    panel = PricePanel(DailyPrice, session=session).load()
+    #A consumer catching up does not remove the changes the panel needs
+    _ack_changes("weekly_price", "daily_price", panel._db_state()[1] + 100, session=session)
+    daily_price.upsert_df(make_prices(2, [7], close=2.), session=session)
+    loads = []
+    panel.load = lambda: loads.append(1)
+    assert panel.refresh()
+    assert not loads
+    assert panel.ticker(2, refresh=False)["close"].tolist() == [1., 2.]
+    del panel.load
+
+    #Once pruned the unseen changes are gone so the panel reloads
+    daily_price.upsert_df(make_prices(1, [8], close=3.), session=session)
+    _ack_changes("weekly_price", "daily_price", 10 ** 6, session=session)
+    assert _prune_changes(session=session)
+    assert panel.refresh()
+    assert panel.ticker(1, refresh=False)["close"].tolist() == [1., 1., 3.]
+    assert panel.refreshes == 2
+    panel.close()
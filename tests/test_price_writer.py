@@ -0,0 +1,127 @@
+import time
+import datetime as dt
+import threading
+
+import pandas as pd
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker, scoped_session
+
+from stock_trading_ml_modelling.database import daily_price
+from stock_trading_ml_modelling.database.models.prices import create_db
+from stock_trading_ml_modelling.database.writer import PriceWriter
+
+
+@pytest.fixture
+def session(tmp_path):
+    #The writer thread needs its own connection to the same db
+    engine = create_engine(f"sqlite:///{tmp_path / 'prices.db'}")
+    create_db(engine)
+    session = scoped_session(sessionmaker(bind=engine))
+    with engine.begin() as conn:
+        conn.exec_driver_sql("INSERT INTO ticker (id, ticker, company) VALUES (1, 'AAA', 'A'), (2, 'BBB', 'B')")
+    yield session
+    session.remove()
+    engine.dispose()
+
+
+def make_prices(ticker_id, day, close=1.):
+    return pd.DataFrame([{
+        "ticker_id":ticker_id, "date":dt.date(2020, 1, day), "week_start_date":dt.date(2020, 1, 6),
+        "open":1., "high":1., "low":1., "close":close, "change":0., "volume":1.,
+        }])
+
+
+def db_rows(session):
+    return session.bind.connect().exec_driver_sql("SELECT COUNT(*) FROM daily_price").scalar()
+
+
+def wait_for(check, timeout=5):
+    st = time.monotonic()
+    while not check():
+        assert time.monotonic() - st < timeout
+        time.sleep(0.01)
+
+
+class GatedPrices:
+    """Upserts through daily_price once the gate is opened"""
+    def __init__(self):
+        self.gate = threading.Event()
+        self.calls = 0
+
+    def upsert_df(self, df, session):
+        self.calls += 1
+        self.gate.wait()
+        return daily_price.upsert_df(df, session=session)
+
+
+def test_writes_after_max_rows(session):
+    writer = PriceWriter(daily_price, max_rows=3, max_seconds=60, session=session).start()
+    try:
+        for day in [6, 7, 8]:
+            writer.put(make_prices(1, day))
+        wait_for(lambda: writer.batches == 1)
+        assert db_rows(session) == 3
+    finally:
+        writer.close()
+
+
+def test_writes_after_max_seconds(session):
+    writer = PriceWriter(daily_price, max_rows=100, max_seconds=0.1, session=session).start()
+    try:
+        writer.put(make_prices(1, 6))
+        wait_for(lambda: writer.batches == 1)
+        assert db_rows(session) == 1
+    finally:
+        writer.close()
+
+
+def test_close_writes_everything_queued(session):
+    with PriceWriter(daily_price, max_rows=100, max_seconds=60, session=session) as writer:
+        writer.put(make_prices(1, 6))
+        writer.put(make_prices(2, 6))
+    assert writer.stats() == {"rows_written":2, "batches":1, "errors":0}
+    assert db_rows(session) == 2
+
+
+def test_put_blocks_while_queue_is_full(session):
+    price_cl = GatedPrices()
+    writer = PriceWriter(price_cl, max_rows=1, max_seconds=60, max_queue=1, session=session).start()
+    #The first dataframe is being written, the second fills the queue
+    writer.put(make_prices(1, 6))
+    wait_for(lambda: price_cl.calls == 1)
+    writer.put(make_prices(1, 7))
+    blocked = threading.Thread(target=writer.put, args=(make_prices(1, 8),))
+    blocked.start()
+    time.sleep(0.2)
+    assert blocked.is_alive()
+    price_cl.gate.set()
+    blocked.join(timeout=5)
+    assert not blocked.is_alive()
+    assert writer.close()["rows_written"] == 3
+
+
+def test_failed_batch_is_retried_by_ticker(session):
+    with PriceWriter(daily_price, max_rows=100, max_seconds=60, session=session) as writer:
+        writer.put(make_prices(1, 6))
+        #close is NOT NULL
+        writer.put(make_prices(2, 6, close=None))
+    assert writer.rows_written == 1 and db_rows(session) == 1
+    assert [e["ticker_ids"] for e in writer.errors] == [[2]]
+    assert [(e["ticker_id"], e["ticker"]) for e in writer.ticker_errors({1:"AAA", 2:"BBB"})] == [(2, "BBB")]
+
+
+def test_put_fails_once_the_thread_has_died(session):
+    writer = PriceWriter(daily_price, max_rows=1, max_seconds=60, max_queue=1, session=session)
+    def _write(batch):
+        raise ValueError("bad batch")
+    writer._write = _write
+    writer.start()
+    writer.put(make_prices(1, 6))
+    writer.thread.join(timeout=5)
+    with pytest.raises(RuntimeError) as e:
+        for day in [7, 8, 9]:
+            writer.put(make_prices(1, day))
+    assert isinstance(e.value.__cause__, ValueError)
+    writer.close()
+    assert writer.thread is None and len(writer.errors) == 1
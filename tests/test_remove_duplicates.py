@@ -0,0 +1,46 @@
+import pytest
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import sessionmaker, scoped_session
+
+from stock_trading_ml_modelling.database import daily_price, weekly_price
+from stock_trading_ml_modelling.database.models.prices import create_db
+
+
+@pytest.fixture
+def session():
+    """Database built before the unique price indexes, holding duplicates"""
+    engine = create_engine("sqlite://")
+    create_db(engine)
+    with engine.begin() as conn:
+        for tab in ["daily_price", "weekly_price"]:
+            conn.exec_driver_sql(f"DROP INDEX uix_{tab}_ticker_id_date")
+            extra = ", week_start_date" if tab == "daily_price" else ""
+            conn.exec_driver_sql(f"""INSERT INTO {tab} (id, ticker_id, date, open, high, low, close, change, volume{extra})
+                SELECT id, ticker_id, date, 1, 1, 1, 1, 0, volume{extra} FROM (
+                    SELECT 1 AS id, 1 AS ticker_id, '2020-01-01' AS date, 10 AS volume, '2020-01-01' AS week_start_date
+                    UNION ALL SELECT 2, 1, '2020-01-01', 30, '2020-01-01'
+                    UNION ALL SELECT 3, 1, '2020-01-01', 20, '2020-01-01'
+                    UNION ALL SELECT 4, 1, '2020-01-02', 10, '2020-01-01'
+                    UNION ALL SELECT 5, 2, '2020-01-01', 10, '2020-01-01'
+                    UNION ALL SELECT 6, 2, '2020-01-01', 10, '2020-01-01'
+                )""")
+    session = scoped_session(sessionmaker(bind=engine))
+    yield session
+    session.remove()
+    engine.dispose()
+
+
+def table_ids(session, tab):
+    return sorted(r[0] for r in session.execute(text(f"SELECT id FROM {tab}")))
+
+
+@pytest.mark.parametrize("price_cl,tab", [(daily_price, "daily_price"), (weekly_price, "weekly_price")])
+def test_remove_duplicates(session, price_cl, tab):
+    counts = price_cl.remove_duplicates(dry_run=True, session=session)
+    assert counts == {"duplicates":3, "tickers":2, "deleted":0}
+    assert table_ids(session, tab) == [1, 2, 3, 4, 5, 6]
+    counts = price_cl.remove_duplicates(session=session)
+    assert counts == {"duplicates":3, "tickers":2, "deleted":3}
+    #Highest volume is kept, ties keep the newest id
+    assert table_ids(session, tab) == [2, 4, 6]
+    assert price_cl.remove_duplicates(dry_run=True, session=session)["duplicates"] == 0
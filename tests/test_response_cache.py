@@ -0,0 +1,66 @@
+import os
+import time
+import datetime as dt
+
+import pytest
+
+from stock_trading_ml_modelling.scrapping.response_cache import ResponseCache, window_end
+
+
+def price_url(en_date):
+    secs = int(dt.datetime.combine(en_date, dt.time()).timestamp())
+    return f"https://finance.example/quote/A.L/history?period1=0&period2={secs}&interval=1d"
+
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = ResponseCache(path=str(tmp_path / "cache"), max_bytes=10 ** 6, recent_ttl=0.2, replay=False)
+    yield cache
+    cache.close()
+
+
+def test_window_end():
+    assert window_end(price_url(dt.date(2020, 1, 31))).date() == dt.date(2020, 1, 31)
+    assert window_end("https://finance.example/quote/A.L") is None
+
+
+def test_past_windows_never_expire(cache):
+    past, today = price_url(dt.date(2020, 1, 31)), price_url(dt.date.today())
+    assert cache.ttl(past) is None and cache.ttl(today) == 0.2
+    cache.put(past, b"<p>old</p>")
+    cache.put(today, b"<p>new</p>")
+    assert cache.get(past) == b"<p>old</p>" and cache.get(today) == b"<p>new</p>"
+    time.sleep(0.3)
+    assert cache.get(past) == b"<p>old</p>"
+    assert cache.get(today) is None and cache.stale == 1
+    #Expired entries are still served when replaying
+    cache.replay = True
+    assert cache.get(today) == b"<p>new</p>"
+
+
+def test_bodies_are_stored_once(cache):
+    cache.put("https://a/1", b"same" * 100)
+    cache.put("https://a/2", b"same" * 100)
+    blobs = [f for _, _, files in os.walk(os.path.join(cache.path, "blobs")) for f in files]
+    assert len(blobs) == 1
+    assert cache.bytes < 400
+    #Replacing one url keeps the blob the other still points at
+    cache.put("https://a/1", b"other")
+    assert cache.get("https://a/2") == b"same" * 100
+
+
+def test_least_recently_read_are_evicted(tmp_path):
+    bodies = {f"https://a/{i}":os.urandom(1000) for i in range(3)}
+    cache = ResponseCache(path=str(tmp_path), max_bytes=2500, recent_ttl=60, replay=False)
+    try:
+        for url, body in list(bodies.items())[:2]:
+            cache.put(url, body)
+        #Reading 0 leaves 1 as the least recently read
+        assert cache.get("https://a/0") == bodies["https://a/0"]
+        cache.put("https://a/2", bodies["https://a/2"])
+        assert cache.get("https://a/1") is None
+        assert cache.get("https://a/0") == bodies["https://a/0"]
+        assert cache.get("https://a/2") == bodies["https://a/2"]
+        assert cache.evictions == 1 and cache.bytes <= 2500
+    finally:
+        cache.close()
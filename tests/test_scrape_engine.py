@@ -0,0 +1,202 @@
+import time
+import asyncio
+import threading
+
+import pytest
+from concurrent.futures import ProcessPoolExecutor
+from aiohttp import web
+
+from stock_trading_ml_modelling.scrapping.engine import ScrapeEngine, ScrapeError, TokenBucket
+from stock_trading_ml_modelling.scrapping.scrapes import AsyncScrape, ScrapePrices
+
+#A Yahoo historical prices table, the dividend row has too few cells so is skipped
+HISTORY_HTML = """<html><body><table data-test="historical-prices">
+<thead><tr><th>Date</th><th>Open</th><th>High</th><th>Low</th><th>Close*</th><th>Adj Close**</th><th>Volume</th></tr></thead>
+<tbody>
+<tr><td>Jan 03, 2020</td><td>{page}.10</td><td>{page}.50</td><td>{page}.00</td><td>{page}.20</td><td>{page}.20</td><td>1,000</td></tr>
+<tr><td>Jan 02, 2020</td><td colspan="6">0.5 Dividend</td></tr>
+<tr><td>Jan 02, 2020</td><td>{page}.00</td><td>{page}.40</td><td>{page}.00</td><td>{page}.10</td><td>{page}.10</td><td>2,000</td></tr>
+</tbody></table></body></html>"""
+
+
+@pytest.fixture
+def server():
+    """Local price source served from its own event loop thread"""
+    state = {"in_flight":0, "max_in_flight":0, "calls":0, "hits":{}}
+
+    async def page(request):
+        name = request.match_info["name"]
+        state["calls"] += 1
+        state["hits"][name] = state["hits"].get(name, 0) + 1
+        #Throttled or unavailable for the first two requests
+        if name in ("throttled","flaky") and state["hits"][name] <= 2:
+            return web.Response(status=429 if name == "throttled" else 503, headers={"Retry-After":"0.1"})
+        state["in_flight"] += 1
+        state["max_in_flight"] = max(state["max_in_flight"], state["in_flight"])
+        await asyncio.sleep(0.02)
+        state["in_flight"] -= 1
+        if request.match_info["name"] == "missing":
+            return web.Response(status=404)
+        return web.Response(text=f"<p>{request.match_info['name']}</p>")
+
+    async def history(request):
+        return web.Response(text=HISTORY_HTML.format(page=request.match_info["page"]), content_type="text/html")
+
+    loop = asyncio.new_event_loop()
+    app = web.Application()
+    app.router.add_get("/{name}", page)
+    app.router.add_get("/history/{page}", history)
+    runner = web.AppRunner(app)
+    loop.run_until_complete(runner.setup())
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    loop.run_until_complete(site.start())
+    port = site._server.sockets[0].getsockname()[1]
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{port}", state
+    asyncio.run_coroutine_threadsafe(runner.cleanup(), loop).result()
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join()
+    loop.close()
+
+
+def test_engine_limits_concurrency(server):
+    url, state = server
+    engine = ScrapeEngine(concurrency=3, per_host=2, rate_limit={}, parse_pool="thread")
+    try:
+        scrape = AsyncScrape(lambda soup: soup.p.text, [f"{url}/{i}" for i in range(10)], engine=engine)
+        assert scrape.get_resps() == [str(i) for i in range(10)]
+        assert state["max_in_flight"] <= 2
+        stats = engine.stats()
+        assert stats["requests"] == 10 and stats["responses"] == 10
+    finally:
+        engine.close()
+
+
+def test_engine_reuses_session(server):
+    url, state = server
+    engine = ScrapeEngine(attempts=2, rate_limit={})
+    try:
+        assert engine.run(engine.fetch(f"{url}/a")) == "<p>a</p>"
+        session = engine.session
+        with pytest.raises(ScrapeError) as e:
+            engine.run(engine.fetch(f"{url}/missing"))
+        assert engine.session is session
+        #A 404 is permanent so is not tried again
+        assert e.value.to_dict() == {"url":f"{url}/missing", "status":404, "attempts":1, "reason":"HTTP 404"}
+        assert state["hits"]["missing"] == 1
+        assert engine.stats()["failures"] == 1
+    finally:
+        engine.close()
+
+
+def test_scrape_daily_prices_runs_tickers_together(server, monkeypatch):
+    from stock_trading_ml_modelling.libs import scrapping
+    url, state = server
+    written = []
+    monkeypatch.setattr(scrapping.ScrapePrices, "urls",
+        lambda self: [f"{url}/missing"] if self.ticker == "BAD.L" else [f"{url}/{self.ticker}{i}" for i in range(3)])
+    monkeypatch.setattr(scrapping.ScrapePrices, "process_soup", lambda self, soup: [{"p":soup.p.text}])
+    monkeypatch.setattr(scrapping, "prepare_day_prices", lambda ticker, df: (True, df))
+    monkeypatch.setattr(scrapping, "write_daily_prices",
+        lambda ticker, ticker_id, df, writer=None: written.append((ticker, df.p.to_list())))
+    engine = ScrapeEngine(concurrency=8, per_host=8, attempts=1, rate_limit={}, parse_pool="thread")
+    try:
+        jobs = [{"ticker":t, "ticker_id":i, "st_date":None, "en_date":None} for i,t in enumerate(["A","B","C","BAD"])]
+        errors = scrapping.scrape_daily_prices(jobs, engine=engine)
+        #Requests from different tickers were in flight together
+        assert state["max_in_flight"] > 3
+        assert sorted(written) == [(t, [f"{t}.L{i}" for i in range(3)]) for t in ["A","B","C"]]
+        assert [(e["ticker"], e["status"]) for e in errors] == [("BAD", 404)]
+    finally:
+        engine.close()
+
+
+def test_engine_retries_with_retry_after(server):
+    url, state = server
+    engine = ScrapeEngine(attempts=3, backoff_base=10, backoff_max=10, rate_limit={})
+    try:
+        st = time.monotonic()
+        assert engine.run(engine.fetch(f"{url}/throttled")) == "<p>throttled</p>"
+        assert engine.run(engine.fetch(f"{url}/flaky")) == "<p>flaky</p>"
+        #Retry-After is waited rather than the 10 second backoff
+        assert 0.4 <= time.monotonic() - st < 5
+        stats = engine.stats()
+        assert stats["retries"] == 4 and stats["throttled"] == 2
+    finally:
+        engine.close()
+
+
+def test_engine_gives_up_after_attempts(server):
+    url, state = server
+    engine = ScrapeEngine(attempts=2, backoff_max=0.1, rate_limit={})
+    try:
+        with pytest.raises(ScrapeError) as e:
+            engine.run(engine.fetch(f"{url}/flaky"))
+        assert (e.value.status, e.value.attempts) == (503, 2)
+    finally:
+        engine.close()
+
+
+def test_token_bucket_limits_rate():
+    async def take(n):
+        bucket = TokenBucket(rate=20, burst=5)
+        st = time.monotonic()
+        for _ in range(n):
+            await bucket.acquire()
+        return time.monotonic() - st
+    #The burst is immediate, the other 5 tokens come at 20 a second
+    assert 0.2 <= asyncio.run(take(10)) < 1
+
+
+def test_engine_serves_and_replays_from_cache(server, tmp_path):
+    from stock_trading_ml_modelling.scrapping.response_cache import ResponseCache
+    url, state = server
+    cache = ResponseCache(path=str(tmp_path), max_bytes=10 ** 6, recent_ttl=60, replay=False)
+    engine = ScrapeEngine(rate_limit={}, cache=cache)
+    try:
+        for _ in range(2):
+            assert engine.run(engine.fetch(f"{url}/a")) == "<p>a</p>"
+        assert state["hits"]["a"] == 1 and engine.stats()["cache_hits"] == 1
+        #Replaying never goes to the network
+        cache.replay = True
+        with pytest.raises(ScrapeError):
+            engine.run(engine.fetch(f"{url}/b"))
+        assert "b" not in state["hits"]
+    finally:
+        engine.close()
+        cache.close()
+
+
+def test_engine_parses_in_process_pool(server):
+    url, state = server
+    engine = ScrapeEngine(rate_limit={}, parse_pool="process", parse_workers=2)
+    try:
+        #str is picklable so can be run on the soup in the worker processes
+        scrape = AsyncScrape(str, [f"{url}/{i}" for i in range(4)], engine=engine)
+        assert scrape.get_resps() == [f"<p>{i}</p>" for i in range(4)]
+        assert isinstance(engine._executor, ProcessPoolExecutor)
+    finally:
+        engine.close()
+    assert engine._executor is None
+
+
+def test_scrape_prices_parses_in_process_pool(server, monkeypatch):
+    url, state = server
+    monkeypatch.setattr(ScrapePrices, "urls", lambda self: [f"{url}/history/{i}" for i in range(1, 4)])
+    engine = ScrapeEngine(rate_limit={}, parse_pool="process", parse_workers=2)
+    try:
+        #The bound process_soup is pickled with its ScrapePrices to the workers
+        tick_df = engine.run(ScrapePrices("A.B").scrape_async(engine))
+        assert isinstance(engine._executor, ProcessPoolExecutor)
+    finally:
+        engine.close()
+    assert tick_df.columns.tolist() == ["date","open","high","low","close","adj_close","volume"]
+    assert tick_df.values.tolist() == [
+        row
+        for i in range(1, 4)
+        for row in [
+            ["Jan 03, 2020", f"{i}.10", f"{i}.50", f"{i}.00", f"{i}.20", f"{i}.20", "1,000"],
+            ["Jan 02, 2020", f"{i}.00", f"{i}.40", f"{i}.00", f"{i}.10", f"{i}.10", "2,000"],
+            ]
+        ]
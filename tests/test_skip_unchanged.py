@@ -0,0 +1,38 @@
+import datetime as dt
+
+import pandas as pd
+
+import stock_trading_ml_modelling.scrapping
+from stock_trading_ml_modelling.libs.manage_data import split_changed_prices
+
+
+def make_prices(closes, st=6):
+    return pd.DataFrame({
+        "ticker_id":1, "date":[dt.date(2020, 1, st + i) for i in range(len(closes))],
+        "open":1., "high":2., "low":.5, "close":closes, "change":0., "volume":10.,
+        })
+
+
+def test_split_changed_prices():
+    old = make_prices([1.5, 1.6, 1.7])
+    new = make_prices([1.5 + 1e-12, 1.65, 1.7, 1.8])
+    new["date"] = pd.to_datetime(new.date)
+    df, counts = split_changed_prices(new, old)
+    assert counts == {"new":1, "changed":1, "unchanged":2}
+    assert df.close.tolist() == [1.65, 1.8]
+
+
+def test_split_changed_prices_nothing_stored():
+    new = make_prices([1., 2.])
+    df, counts = split_changed_prices(new, new.iloc[:0])
+    assert counts == {"new":2, "changed":0, "unchanged":0}
+    assert df.shape[0] == 2
+
+
+def test_split_changed_prices_duplicate_stored_rows():
+    #Ticker 1 on the 6th is stored twice, the last copy is compared
+    old = pd.concat([make_prices([9.]), make_prices([1.5, 1.6])], ignore_index=True)
+    new = make_prices([1.5, 1.7])
+    df, counts = split_changed_prices(new, old)
+    assert counts == {"new":0, "changed":1, "unchanged":1}
+    assert df.close.tolist() == [1.7]
@@ -0,0 +1,87 @@
+import datetime as dt
+
+import pandas as pd
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker, scoped_session
+
+from stock_trading_ml_modelling.database import daily_price, ticker_latest
+from stock_trading_ml_modelling.database.get_data import sqlaq_to_df
+from stock_trading_ml_modelling.database.models.prices import create_db, TickerLatest
+
+
+@pytest.fixture
+def session():
+    engine = create_engine("sqlite://")
+    create_db(engine)
+    session = scoped_session(sessionmaker(bind=engine))
+    with engine.begin() as conn:
+        conn.exec_driver_sql("INSERT INTO ticker (id, ticker, company) VALUES (1, 'AAA', 'A'), (2, 'BBB', 'B')")
+    yield session
+    session.remove()
+    engine.dispose()
+
+
+def make_prices(ticker_id, dates):
+    return pd.DataFrame([{
+        "ticker_id":ticker_id, "date":d, "week_start_date":d,
+        "open":1., "high":1., "low":1., "close":1., "change":0., "volume":1.,
+        } for d in dates])
+
+
+def latest(session):
+    return {r.ticker_id:(r.last_daily_date, r.daily_count) for r in session.query(TickerLatest)}
+
+
+def test_upsert_maintains_summary(session):
+    dates = [dt.date(2020, 1, d) for d in range(1, 6)]
+    daily_price.upsert_df(make_prices(1, dates), session=session)
+    assert latest(session) == {1:(dt.date(2020, 1, 5), 5)}
+    #Overlapping rows update in place
+    daily_price.upsert_df(make_prices(1, dates[-2:] + [dt.date(2020, 1, 6)]), session=session)
+    daily_price.add_df(make_prices(2, dates[:2]), session=session)
+    assert latest(session) == {1:(dt.date(2020, 1, 6), 6), 2:(dt.date(2020, 1, 2), 2)}
+
+
+def test_fetch_latest_matches_prices(session):
+    daily_price.upsert_df(make_prices(1, [dt.date(2020, 1, 1), dt.date(2020, 1, 3)]), session=session)
+    df = sqlaq_to_df(daily_price.fetch_latest(session), session=session).set_index("id")
+    assert df.max_date[1] == dt.date(2020, 1, 3)
+    assert pd.isnull(df.max_date[2])
+    #Tickers with no prices since from_date have no max_date
+    df = sqlaq_to_df(daily_price.fetch_latest(session, from_date=dt.date(2020, 1, 4)), session=session)
+    assert df.max_date.isnull().all()
+
+
+def test_rebuild_fixes_drift(session):
+    daily_price.upsert_df(make_prices(1, [dt.date(2020, 1, 1)]), session=session)
+    session.query(TickerLatest).delete()
+    session.commit()
+    assert ticker_latest.rebuild(session=session) == 1
+    assert latest(session) == {1:(dt.date(2020, 1, 1), 1)}
+
+
+def test_prepare_db_bootstraps_an_old_database():
+    import stock_trading_ml_modelling.scrapping
+    from stock_trading_ml_modelling.scrapping.database import prepare_db
+    engine = create_engine("sqlite://")
+    #Built before ticker_latest, price_changes and change_consumer existed
+    with engine.begin() as conn:
+        conn.exec_driver_sql("CREATE TABLE ticker (id INTEGER PRIMARY KEY, ticker VARCHAR, company VARCHAR, last_seen_date DATE)")
+        conn.exec_driver_sql("""CREATE TABLE daily_price (id INTEGER PRIMARY KEY, date DATE, open FLOAT, high FLOAT, low FLOAT,
+            close FLOAT, change FLOAT, volume FLOAT, week_start_date DATE, ticker_id INTEGER)""")
+        conn.exec_driver_sql("INSERT INTO ticker VALUES (1, 'AAA', 'A', NULL)")
+        conn.exec_driver_sql("INSERT INTO daily_price VALUES (1, '2020-01-06', 1, 1, 1, 1, 0, 1, '2020-01-06', 1)")
+    session = scoped_session(sessionmaker(bind=engine))
+    try:
+        prepare_db(engine=engine, session=session)
+        latest = sqlaq_to_df(daily_price.fetch_latest(session, ticker_ids=[1]), session=session)
+        assert latest.max_date.tolist() == [dt.date(2020, 1, 6)]
+        with engine.begin() as conn:
+            tables = set(conn.exec_driver_sql("SELECT name FROM sqlite_master WHERE type = 'table'").scalars())
+        assert {"ticker_latest","price_changes","change_consumer"} <= tables
+        #Re-running leaves a filled summary alone
+        prepare_db(engine=engine, session=session)
+    finally:
+        session.remove()
+        engine.dispose()
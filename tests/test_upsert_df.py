@@ -0,0 +1,59 @@
+import datetime as dt
+
+import pandas as pd
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker, scoped_session
+
+from stock_trading_ml_modelling.database import daily_price, weekly_price
+from stock_trading_ml_modelling.database.models.prices import create_db
+
+
+@pytest.fixture
+def session(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'prices.db'}")
+    create_db(engine)
+    session = scoped_session(sessionmaker(bind=engine))
+    with engine.begin() as conn:
+        conn.exec_driver_sql("INSERT INTO ticker (id, ticker, company) VALUES (1, 'AAA', 'A'), (2, 'BBB', 'B')")
+    yield session
+    session.remove()
+    engine.dispose()
+
+
+def make_prices(rows):
+    return pd.DataFrame([{
+        "ticker_id":t, "date":dt.date(2020, 1, d), "week_start_date":dt.date(2020, 1, 6),
+        "open":1., "high":2., "low":.5, "close":close, "change":0., "volume":10.,
+        } for t, d, close in rows])
+
+
+def read(session, table):
+    with session.bind.connect() as conn:
+        return conn.exec_driver_sql(f"SELECT id, ticker_id, date, close FROM {table} ORDER BY id").all()
+
+
+@pytest.mark.parametrize("table, price_cl", [("daily_price", daily_price), ("weekly_price", weekly_price)])
+def test_upsert_updates_in_place_and_inserts(session, table, price_cl):
+    price_cl.upsert_df(make_prices([(1, 6, 1.), (1, 7, 1.), (2, 6, 1.)]), session=session)
+    before = read(session, table)
+    assert [r[0] for r in before] == [1, 2, 3]
+
+    #Existing keys (1, 7) and (2, 6) and new keys in one frame, sent over
+    #several chunks
+    count = price_cl.upsert_df(make_prices([(1, 7, 2.), (2, 6, 3.), (2, 7, 4.), (1, 8, 5.)]),
+        session=session, chunk_size=3)
+    assert count == 4
+    assert read(session, table) == [
+        (1, 1, "2020-01-06", 1.),
+        #Updated in place, the ids are kept
+        (2, 1, "2020-01-07", 2.),
+        (3, 2, "2020-01-06", 3.),
+        #Inserted
+        (4, 2, "2020-01-07", 4.),
+        (5, 1, "2020-01-08", 5.),
+        ]
+    with session.bind.connect() as conn:
+        assert conn.exec_driver_sql(
+            f"SELECT COUNT(*) FROM (SELECT 1 FROM {table} GROUP BY ticker_id, date HAVING COUNT(*) > 1)"
+            ).scalar() == 0
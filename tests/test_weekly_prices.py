@@ -0,0 +1,103 @@
+import datetime as dt
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker, scoped_session
+
+import stock_trading_ml_modelling.scrapping
+from stock_trading_ml_modelling.database import daily_price
+from stock_trading_ml_modelling.database.models.prices import create_db
+from stock_trading_ml_modelling.libs.manage_data import aggregate_weekly_prices
+from stock_trading_ml_modelling.utils.date import calc_wk_st_date
+
+
+def legacy_daily_to_weekly(dp_df):
+    """The merge based conversion aggregate_weekly_prices replaced"""
+    dp_df = dp_df.copy()
+    dp_df['isocalendar'] = [x.isocalendar()[:2] for x in dp_df['date']]
+    high_df = dp_df.loc[dp_df['high'] > 0, ['high','ticker_id','isocalendar']] \
+        .groupby(['ticker_id','isocalendar'], as_index=False).max()
+    low_df = dp_df.loc[dp_df['low'] > 0, ['low','ticker_id','isocalendar']] \
+        .groupby(['ticker_id','isocalendar'], as_index=False).min()
+    vol_df = dp_df.loc[dp_df['volume'] > 0, ['volume','ticker_id','isocalendar']] \
+        .groupby(['ticker_id','isocalendar'], as_index=False).sum()
+    max_wk_day = dp_df.loc[dp_df['close'] > 0, ['date','ticker_id','isocalendar']] \
+        .groupby(['ticker_id','isocalendar'], as_index=False).max()
+    min_wk_day = dp_df.loc[dp_df['open'] > 0, ['date','ticker_id','isocalendar']] \
+        .groupby(['ticker_id','isocalendar'], as_index=False).min()
+    open_df = pd.merge(dp_df[['date','open']], min_wk_day, on='date')
+    close_df = pd.merge(dp_df[['date','close']], max_wk_day, on='date')
+    wp_df = dp_df[['ticker_id','isocalendar']]
+    wp_df = pd.merge(wp_df, min_wk_day, on=['ticker_id','isocalendar'], how="left")
+    wp_df = pd.merge(wp_df, high_df, on=['ticker_id','isocalendar'], how="left")
+    wp_df = pd.merge(wp_df, low_df, on=['ticker_id','isocalendar'], how="left")
+    wp_df = pd.merge(wp_df, vol_df, on=['ticker_id','isocalendar'], how="left")
+    wp_df = pd.merge(wp_df, open_df[['ticker_id','isocalendar','open']], on=['ticker_id','isocalendar'], how="left")
+    wp_df = pd.merge(wp_df, close_df[['ticker_id','isocalendar','close']], on=['ticker_id','isocalendar'], how="left")
+    wp_df['change'] = wp_df['close'] - wp_df['open']
+    wp_df = wp_df.drop_duplicates().reset_index(drop=True)
+    wp_df['date'] = [calc_wk_st_date(x) for x in wp_df.date]
+    wp_df = wp_df.drop(columns=['isocalendar'])
+    return wp_df.fillna(0)
+
+
+def sample_prices(ticker_id, seed):
+    rng = np.random.default_rng(seed)
+    dates = [d for d in pd.date_range("2019-12-23", "2020-02-07") if d.weekday() < 5]
+    df = pd.DataFrame({
+        "ticker_id":ticker_id,
+        "date":dates,
+        "open":rng.uniform(1, 10, len(dates)),
+        "high":rng.uniform(10, 20, len(dates)),
+        "low":rng.uniform(0.5, 1, len(dates)),
+        "close":rng.uniform(1, 10, len(dates)),
+        "volume":rng.uniform(100, 1000, len(dates)),
+        })
+    #Non-positive values, every week keeps a positive open and close
+    for c, i in [("open", 0), ("close", 4), ("high", 7), ("low", 12), ("volume", 15), ("volume", 16)]:
+        df.loc[i, c] = 0 if i % 2 else -1
+    df.loc[20:24, "volume"] = 0
+    return df
+
+
+def normalise(wp_df):
+    wp_df = wp_df[['ticker_id','date','open','high','low','close','change','volume']].copy()
+    wp_df['date'] = pd.to_datetime(wp_df.date)
+    return wp_df.sort_values(['ticker_id','date']).reset_index(drop=True)
+
+
+def test_matches_legacy_conversion_for_one_ticker():
+    dp_df = sample_prices(1, 0)
+    pd.testing.assert_frame_equal(
+        normalise(aggregate_weekly_prices(dp_df)), normalise(legacy_daily_to_weekly(dp_df)), check_dtype=False)
+
+
+def test_tickers_sharing_dates_are_kept_apart():
+    dp_df = pd.concat([sample_prices(1, 0), sample_prices(2, 1), sample_prices(3, 2)], ignore_index=True)
+    #The legacy conversion joined the open and close on date alone, so it is
+    #only correct one ticker at a time
+    expected = pd.concat([legacy_daily_to_weekly(g) for _,g in dp_df.groupby("ticker_id")], ignore_index=True)
+    pd.testing.assert_frame_equal(
+        normalise(aggregate_weekly_prices(dp_df)), normalise(expected), check_dtype=False)
+
+
+def test_fetch_filters_each_ticker_from_its_own_date():
+    engine = create_engine("sqlite://")
+    create_db(engine)
+    session = scoped_session(sessionmaker(bind=engine))
+    try:
+        prices = pd.concat([sample_prices(t, t) for t in [1, 2, 3]], ignore_index=True)
+        prices["week_start_date"] = prices.date.dt.date
+        prices["change"] = 0.
+        prices["date"] = prices.date.dt.date
+        daily_price.upsert_df(prices, session=session)
+        from_dates = {1:dt.date(2020, 2, 3), 2:dt.date(2019, 12, 30), 3:dt.date(2020, 2, 3)}
+        query = daily_price.fetch(from_dates=from_dates, ordered=True)
+        rows = session.execute(query.statement).scalars().all()
+        df = pd.DataFrame([(r.ticker_id, r.date) for r in rows], columns=["ticker_id","date"])
+        assert df.groupby("ticker_id").date.min().to_dict() == from_dates
+        assert df.shape[0] == 5 + 30 + 5
+    finally:
+        session.remove()
+        engine.dispose()